@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -73,6 +73,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'orbitview_v8.wsgi.application'
+# Streaming chat views are async and should be served through ASGI
+ASGI_APPLICATION = 'orbitview_v8.asgi.application'
 
 
 # Database
@@ -89,6 +91,22 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Version stamps, stream replay buffers and rendered pages live here, so run
+# more than one process against a shared backend, e.g.
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# CACHE_LOCATION=redis://127.0.0.1:6379/1
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='orbitview'),
+        'TIMEOUT': config('CACHE_TIMEOUT', default=300, cast=int),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -125,6 +143,10 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files; point MEDIA_URL at the CDN in production
+MEDIA_URL = config('MEDIA_URL', default='/media/')
+MEDIA_ROOT = config('MEDIA_ROOT', default=str(BASE_DIR / 'media'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -133,6 +155,15 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Custom User Model
 AUTH_USER_MODEL = 'users.User'
 
+# Sessions and per-request user lookups are served from the cache (see users/auth_cache.py);
+# ModelBackend stays listed so sessions created before the switch remain valid
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.cached_db')
+AUTHENTICATION_BACKENDS = [
+    'users.auth_cache.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+AUTH_CACHE_TTL = config('AUTH_CACHE_TTL', default=300, cast=int)
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -154,3 +185,105 @@ CORS_ALLOW_CREDENTIALS = True
 # Google OAuth settings
 GOOGLE_OAUTH2_CLIENT_ID = config('GOOGLE_OAUTH2_CLIENT_ID', default='')
 GOOGLE_OAUTH2_CLIENT_SECRET = config('GOOGLE_OAUTH2_CLIENT_SECRET', default='')
+
+# LLM provider (see users/llm.py)
+GROQ_API_KEY = config('GROQ_API_KEY', default='')
+GROQ_BASE_URL = config('GROQ_BASE_URL', default='')
+LLM_TIMEOUT = config('LLM_TIMEOUT', default=60.0, cast=float)
+LLM_MAX_CONNECTIONS = config('LLM_MAX_CONNECTIONS', default=100, cast=int)
+LLM_MAX_CONCURRENCY = config('LLM_MAX_CONCURRENCY', default=64, cast=int)
+LLM_MAX_RETRIES = config('LLM_MAX_RETRIES', default=2, cast=int)
+# Per-model overrides of LLM_MAX_CONCURRENCY, e.g. {'openai/gpt-oss-120b': 8}
+LLM_MODEL_CONCURRENCY = {}
+
+# Cached answers to visitors' opening questions (see users/response_cache.py)
+RESPONSE_CACHE_MAX_ENTRIES = config('RESPONSE_CACHE_MAX_ENTRIES', default=10000, cast=int)
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=3600, cast=int)
+# Optional sentence-transformers model for local embeddings, e.g. 'all-MiniLM-L6-v2'
+EMBEDDING_MODEL = config('EMBEDDING_MODEL', default='')
+# Cosine similarity at which a reworded question reuses a cached answer; 0 disables.
+# Off without an EMBEDDING_MODEL: the hashed fallback vectors only see shared words,
+# so "built with Python" matches "built with Java" and "not open to" matches "open to"
+RESPONSE_CACHE_SIMILARITY = config(
+    'RESPONSE_CACHE_SIMILARITY', default=0.85 if EMBEDDING_MODEL else 0.0, cast=float
+)
+
+# Chat prompts of big profiles carry only the snippets relevant to the question (see users/retrieval.py)
+RETRIEVAL_FULL_CONTEXT_CHARS = config('RETRIEVAL_FULL_CONTEXT_CHARS', default=12000, cast=int)
+RETRIEVAL_TOP_K = config('RETRIEVAL_TOP_K', default=8, cast=int)
+# Size of the hashed snippet vectors when no EMBEDDING_MODEL is set
+RETRIEVAL_EMBEDDING_DIM = config('RETRIEVAL_EMBEDDING_DIM', default=1024, cast=int)
+# Profiles whose vectors are kept in memory for search
+RETRIEVAL_CACHE_PROFILES = config('RETRIEVAL_CACHE_PROFILES', default=32, cast=int)
+
+# Profile search (see users/search.py): postings of the rarest query term read per query,
+# weight of a profile's static rank in its score, and values listed per facet
+SEARCH_CANDIDATES = config('SEARCH_CANDIDATES', default=1000, cast=int)
+SEARCH_RANK_WEIGHT = config('SEARCH_RANK_WEIGHT', default=0.1, cast=float)
+SEARCH_FACET_LIMIT = config('SEARCH_FACET_LIMIT', default=20, cast=int)
+
+# System prompt templates (see users/prompts.py): directories of <name>.v<N>.txt files,
+# plain prompt files replacing a template outright, and versions pinned instead of the latest
+PROMPT_DIRS = [BASE_DIR / 'users' / 'prompt_templates']
+PROMPT_FILES = {
+    'profile_answering': config('ORBITVIEW_V8_PROFILE_PROFILE_ANSWERING_SYSTEM_PROMPT', default=''),
+}
+PROMPT_VERSIONS = {}
+PROMPT_AUTO_RELOAD = config('PROMPT_AUTO_RELOAD', default=DEBUG, cast=bool)
+
+# Most tokens of past turns resent with each chat message (see users/history.py)
+CHAT_HISTORY_MAX_TOKENS = config('CHAT_HISTORY_MAX_TOKENS', default=4000, cast=int)
+# tiktoken encoding loaded at startup to count them ('' to always estimate), and a
+# directory pre-populated with it where the network is unavailable
+TOKEN_ENCODING = config('TOKEN_ENCODING', default='cl100k_base')
+TIKTOKEN_CACHE_DIR = config('TIKTOKEN_CACHE_DIR', default='')
+
+# Chat messages are written in batches off the request path (see users/write_behind.py)
+MESSAGE_WRITE_BEHIND = config('MESSAGE_WRITE_BEHIND', default=True, cast=bool)
+MESSAGE_WRITE_BATCH_SIZE = config('MESSAGE_WRITE_BATCH_SIZE', default=200, cast=int)
+MESSAGE_WRITE_INTERVAL = config('MESSAGE_WRITE_INTERVAL', default=1.0, cast=float)
+
+# Conversations idle this long move to compressed archives (see users/archive.py),
+# that many conversations per batch and message rows per DELETE
+CHAT_RETENTION_DAYS = config('CHAT_RETENTION_DAYS', default=365, cast=int)
+CHAT_ARCHIVE_BATCH_SIZE = config('CHAT_ARCHIVE_BATCH_SIZE', default=200, cast=int)
+CHAT_ARCHIVE_DELETE_BATCH = config('CHAT_ARCHIVE_DELETE_BATCH', default=5000, cast=int)
+
+# Profile view/conversation counters are aggregated in memory (see users/counters.py)
+COUNTER_WRITE_BEHIND = config('COUNTER_WRITE_BEHIND', default=True, cast=bool)
+COUNTER_FLUSH_INTERVAL = config('COUNTER_FLUSH_INTERVAL', default=5.0, cast=float)
+# Counters gaining this much in one interval are spread over COUNTER_SHARDS rows
+COUNTER_HOT_THRESHOLD = config('COUNTER_HOT_THRESHOLD', default=100, cast=int)
+COUNTER_SHARDS = config('COUNTER_SHARDS', default=8, cast=int)
+
+# Visitor questions are clustered and counted in batches (see users/popular_questions.py)
+POPULAR_QUESTIONS_BATCH_SIZE = config('POPULAR_QUESTIONS_BATCH_SIZE', default=500, cast=int)
+POPULAR_QUESTIONS_INTERVAL = config('POPULAR_QUESTIONS_INTERVAL', default=10.0, cast=float)
+# Estimated word-shingle Jaccard similarity at which a reworded question joins a cluster
+POPULAR_QUESTIONS_SIMILARITY = config('POPULAR_QUESTIONS_SIMILARITY', default=0.6, cast=float)
+POPULAR_QUESTIONS_TOP_N = config('POPULAR_QUESTIONS_TOP_N', default=10, cast=int)
+
+# Views, conversations, questions and unique visitors are counted per hour in memory,
+# written every ANALYTICS_FLUSH_INTERVAL seconds and rolled up into days (see users/analytics.py)
+ANALYTICS_WRITE_BEHIND = config('ANALYTICS_WRITE_BEHIND', default=True, cast=bool)
+ANALYTICS_FLUSH_INTERVAL = config('ANALYTICS_FLUSH_INTERVAL', default=10.0, cast=float)
+# Hourly rows are kept this long after being rolled up into days
+ANALYTICS_HOURLY_RETENTION_DAYS = config('ANALYTICS_HOURLY_RETENTION_DAYS', default=14, cast=int)
+
+# Rendered public profile pages (see users/page_cache.py); the version stamp
+# retires them on any change, the TTL bounds how stale their stats get
+PAGE_CACHE_TTL = config('PAGE_CACHE_TTL', default=300, cast=int)
+
+# Uploaded images are resized and re-encoded off the request path (see users/images.py)
+IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)
+IMAGE_VARIANT_WIDTHS = config('IMAGE_VARIANT_WIDTHS', default='320,640,1280,1920', cast=Csv(int))
+# Any of webp, avif, jpeg; the first is used for the default url
+IMAGE_VARIANT_FORMATS = config('IMAGE_VARIANT_FORMATS', default='webp', cast=Csv())
+IMAGE_DEFAULT_WIDTH = config('IMAGE_DEFAULT_WIDTH', default=1280, cast=int)
+
+# Context files are extracted and chunked off the request path (see users/context_ingest.py)
+CONTEXT_INGEST_WORKERS = config('CONTEXT_INGEST_WORKERS', default=1, cast=int)
+CONTEXT_READ_BLOCK = config('CONTEXT_READ_BLOCK', default=64 * 1024, cast=int)
+# Characters per retrieval chunk, and how many of them repeat the previous chunk
+CONTEXT_CHUNK_CHARS = config('CONTEXT_CHUNK_CHARS', default=1200, cast=int)
+CONTEXT_CHUNK_OVERLAP = config('CONTEXT_CHUNK_OVERLAP', default=200, cast=int)
@@ -0,0 +1,273 @@
+"""
+Profile analytics over time.
+
+The request path counts views, new conversations and questions, and adds
+the visitor to a HyperLogLog sketch (see hll.py), all in memory per profile
+and hour. A background thread writes the hours out every
+ANALYTICS_FLUSH_INTERVAL seconds, adding the counts with F() and merging the
+sketches under a row lock, so a profile's hour is one ProfileStats row
+however busy it was.
+
+`manage.py rollup_analytics` folds each finished day's hours into a 'day'
+row and expires hours older than ANALYTICS_HOURLY_RETENTION_DAYS. A day row
+is recomputed from its hours rather than added to, so rolling a day up twice
+is harmless.
+
+dashboard() reads at most one row per day of its range plus the last two
+days' hours, so it costs the same for a profile with ten views or ten
+million. Top questions come from the per-day counts popular_questions.py
+keeps.
+"""
+import atexit
+import datetime
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .hll import HyperLogLog
+from .models import PopularQuestionDay, ProfileStats
+
+
+logger = logging.getLogger(__name__)
+
+
+EVENTS = ('views', 'conversations', 'questions')
+TOP_QUESTIONS = 10
+ROLLUP_BATCH_SIZE = 1000
+EXPIRE_BATCH_SIZE = 5000
+
+
+def _hour(at):
+    return at.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _day_start(day):
+    return datetime.datetime.combine(day, datetime.time.min, tzinfo=datetime.timezone.utc)
+
+
+def visitor_key(request, user=None, visitor_id=None):
+    """
+    Who a hit is from: the signed-in user, else the chat's visitor id, else
+    the client's address and browser.
+    """
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    if visitor_id:
+        return f"visitor:{visitor_id}"
+    address = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')[0].strip()
+    address = address or request.META.get('REMOTE_ADDR', '')
+    return f"client:{address}|{request.META.get('HTTP_USER_AGENT', '')}"
+
+
+class ProfileAnalytics:
+    def __init__(self, interval=10.0, enabled=True):
+        self.interval = interval
+        self.enabled = enabled
+        # {(profile id, hour): [{event: count}, HyperLogLog or None]}
+        self._hours = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, profile_id, event, visitor=None, at=None):
+        """Count an event of a profile, and its visitor. Never touches the database."""
+        if event not in EVENTS:
+            raise ValueError(f"{event} is not an analytics event")
+        key = (profile_id, _hour(at or timezone.now()))
+        with self._lock:
+            entry = self._hours.get(key)
+            if entry is None:
+                entry = self._hours[key] = [dict.fromkeys(EVENTS, 0), None]
+            entry[0][event] += 1
+            if visitor:
+                if entry[1] is None:
+                    entry[1] = HyperLogLog()
+                entry[1].add(visitor)
+        if not self.enabled:
+            self.flush()
+        else:
+            self._ensure_thread()
+
+    async def arecord(self, profile_id, event, visitor=None, at=None):
+        if not self.enabled:
+            return await sync_to_async(self.record)(profile_id, event, visitor, at)
+        self.record(profile_id, event, visitor, at)
+
+    def _restore(self, taken):
+        with self._lock:
+            for key, (counts, sketch) in taken.items():
+                entry = self._hours.setdefault(key, [dict.fromkeys(EVENTS, 0), None])
+                for event, count in counts.items():
+                    entry[0][event] += count
+                if sketch is not None:
+                    entry[1] = sketch if entry[1] is None else entry[1].merge(sketch)
+
+    def flush(self):
+        """Add every pending hour to its ProfileStats row. Returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                taken, self._hours = self._hours, {}
+            if not taken:
+                return 0
+            try:
+                self._write(taken)
+            except Exception:
+                logger.exception('Flushing %d analytics hours failed, will retry', len(taken))
+                self._restore(taken)
+                return 0
+            return len(taken)
+
+    @staticmethod
+    def _write(taken):
+        with transaction.atomic():
+            ProfileStats.objects.bulk_create(
+                [ProfileStats(profile_id=profile_id, period='hour', start=hour) for profile_id, hour in taken],
+                ignore_conflicts=True,
+            )
+            rows = ProfileStats.objects.select_for_update().filter(
+                period='hour',
+                profile_id__in={profile_id for profile_id, _ in taken},
+                start__in={hour for _, hour in taken},
+            ).only('pk', 'profile_id', 'start', 'visitors')
+            updated = []
+            for row in rows:
+                entry = taken.get((row.profile_id, row.start))
+                if entry is None:
+                    continue
+                counts, sketch = entry
+                for event, count in counts.items():
+                    setattr(row, event, F(event) + count)
+                if sketch is not None:
+                    row.visitors = HyperLogLog.from_bytes(row.visitors).merge(sketch).to_bytes()
+                updated.append(row)
+            ProfileStats.objects.bulk_update(updated, [*EVENTS, 'visitors'])
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name='profile-analytics', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            close_old_connections()
+            self.flush()
+            close_old_connections()
+
+    def close(self):
+        """Stop the background thread after a final flush."""
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+
+def _write_days(start, rows):
+    profile_ids = [row.profile_id for row in rows]
+    with transaction.atomic():
+        ProfileStats.objects.filter(period='day', start=start, profile_id__in=profile_ids).delete()
+        ProfileStats.objects.bulk_create(rows)
+
+
+def rollup_day(day):
+    """Recompute the 'day' rows of a UTC day from its hours. Returns how many profiles had any."""
+    start = _day_start(day)
+    hours = ProfileStats.objects.filter(
+        period='hour', start__gte=start, start__lt=start + datetime.timedelta(days=1)
+    ).order_by('profile_id').values_list('profile_id', *EVENTS, 'visitors')
+    batch, current, sketch, total = [], None, None, 0
+    for profile_id, views, conversations, questions, visitors in hours.iterator(chunk_size=ROLLUP_BATCH_SIZE):
+        if current is None or current.profile_id != profile_id:
+            if current is not None:
+                current.visitors = sketch.to_bytes()
+            current = ProfileStats(profile_id=profile_id, period='day', start=start)
+            sketch = HyperLogLog()
+            batch.append(current)
+            total += 1
+            if len(batch) > ROLLUP_BATCH_SIZE:
+                _write_days(start, batch[:-1])
+                batch = batch[-1:]
+        current.views += views
+        current.conversations += conversations
+        current.questions += questions
+        sketch.merge(HyperLogLog.from_bytes(visitors))
+    if current is not None:
+        current.visitors = sketch.to_bytes()
+        _write_days(start, batch)
+    return total
+
+
+def expire_hours(before):
+    """Delete hour rows that started before `before`, a batch per statement."""
+    expired = ProfileStats.objects.filter(period='hour', start__lt=before)
+    deleted = 0
+    while True:
+        pks = list(expired.values_list('pk', flat=True)[:EXPIRE_BATCH_SIZE])
+        if not pks:
+            return deleted
+        deleted += ProfileStats.objects.filter(pk__in=pks).delete()[0]
+
+
+def _point(counts, sketch):
+    return {**counts, 'visitors': sketch.count()}
+
+
+def dashboard(profile_id, days=30, now=None):
+    """Daily and hourly activity of a profile over the last `days` days, and its top questions then."""
+    now = now or timezone.now()
+    today = now.astimezone(datetime.timezone.utc).date()
+    first = today - datetime.timedelta(days=days - 1)
+    rows = ProfileStats.objects.filter(profile_id=profile_id).values_list('period', 'start', *EVENTS, 'visitors')
+    # Days not rolled up yet are summed from their hours
+    day_rows = rows.filter(period='day', start__gte=_day_start(first))
+    hour_rows = rows.filter(period='hour', start__gte=_day_start(max(first, today - datetime.timedelta(days=1))))
+
+    # {day: [{event: count}, visitors, whether it came from a day row]}
+    series = {
+        first + datetime.timedelta(days=i): [dict.fromkeys(EVENTS, 0), HyperLogLog(), False]
+        for i in range(days)
+    }
+    hours = []
+    # Day rows come first, so a rolled up day ignores its hours
+    for period, start, views, conversations, questions, visitors in [*day_rows, *hour_rows]:
+        counts = {'views': views, 'conversations': conversations, 'questions': questions}
+        sketch = HyperLogLog.from_bytes(visitors)
+        if period == 'hour' and start > now - datetime.timedelta(hours=24):
+            hours.append({'start': start, **_point(counts, sketch)})
+        entry = series.get(start.astimezone(datetime.timezone.utc).date())
+        if entry is None or (period == 'hour' and entry[2]):
+            continue
+        entry[2] = entry[2] or period == 'day'
+        for event, count in counts.items():
+            entry[0][event] += count
+        entry[1].merge(sketch)
+
+    totals, everyone = dict.fromkeys(EVENTS, 0), HyperLogLog()
+    for counts, sketch, _ in series.values():
+        for event, count in counts.items():
+            totals[event] += count
+        everyone.merge(sketch)
+    top = PopularQuestionDay.objects.filter(profile_id=profile_id, day__gte=first).values(
+        'question_id', 'question__question'
+    ).annotate(total=Sum('count')).order_by('-total')[:TOP_QUESTIONS]
+    return {
+        'days': [{'date': day, **_point(counts, sketch)} for day, (counts, sketch, _) in series.items()],
+        'hours': sorted(hours, key=lambda point: point['start']),
+        'totals': _point(totals, everyone),
+        'top_questions': [{'question': row['question__question'], 'count': row['total']} for row in top],
+    }
+
+
+profile_analytics = ProfileAnalytics(
+    interval=settings.ANALYTICS_FLUSH_INTERVAL,
+    enabled=settings.ANALYTICS_WRITE_BEHIND,
+)
+atexit.register(profile_analytics.close)
@@ -4,3 +4,18 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        import os
+
+        from django.conf import settings
+
+        from . import signals  # noqa: F401
+        from . import tokens
+        from .prompts import prompt_registry
+
+        prompt_registry.load()
+        if settings.TIKTOKEN_CACHE_DIR:
+            os.environ.setdefault('TIKTOKEN_CACHE_DIR', settings.TIKTOKEN_CACHE_DIR)
+        if settings.TOKEN_ENCODING:
+            tokens.load_encoding(settings.TOKEN_ENCODING)
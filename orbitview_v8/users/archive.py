@@ -0,0 +1,318 @@
+"""
+Retention of chat history.
+
+Conversations idle for longer than CHAT_RETENTION_DAYS move out of the hot
+conversations and messages tables into compressed JSONL files, one line per
+conversation, written per profile and month the conversation started in
+(`manage.py archive_conversations`, run from cron or with --every). Each file
+gets a ChatArchive row and each conversation an ArchivedConversation row with
+what the owner's list shows, so conversations.py lists archived and live
+conversations together and reads an archived one's messages from its file.
+
+A batch is moved in two steps: the files are written first, without locks,
+then one transaction locks the conversations, keeps only those still idle,
+records their archive rows and deletes them, their messages
+CHAT_ARCHIVE_DELETE_BATCH rows per statement. A message written after a file
+was started therefore either keeps its conversation live or waits for the
+delete and fails, never vanishes with it. Messages still queued for write-behind
+(see write_behind.py) haven't moved last_activity yet, so the chat view calls
+amark_active() before taking a turn on a long idle conversation, and refuses
+conversations that are already archived.
+
+Files are zstd-compressed when the zstandard package is installed and gzip
+otherwise; the ChatArchive row records which.
+
+On MySQL, `messages` can also be range-partitioned by month of `timestamp`
+(see message_partition_sql()); the scheduled run then keeps partitions for
+the coming months in place. Archiving works by conversation, so it runs the
+same on a partitioned table.
+"""
+import datetime
+import gzip
+import io
+import json
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ArchivedConversation, ChatArchive, Conversation, Message
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+ZSTD_LEVEL = 10
+# Archive files are assembled in memory up to this size, then on disk
+SPOOL_BYTES = 8 * 1024 * 1024
+MESSAGE_READ_CHUNK = 2000
+PARTITION_MONTHS_AHEAD = 3
+# A turn on a conversation idle for longer than this moves its last_activity
+# right away instead of when its messages are flushed
+MARK_ACTIVE_AFTER = datetime.timedelta(hours=1)
+CONVERSATION_FIELDS = (
+    'id', 'profile_id', 'visitor_id', 'started_at', 'last_activity', 'summary',
+    'last_message_preview', 'last_message_role',
+)
+
+
+def _month(at):
+    return at.astimezone(datetime.timezone.utc).date().replace(day=1)
+
+
+def _next_month(month):
+    return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def _json(value):
+    return json.dumps(value, cls=DjangoJSONEncoder)
+
+
+class _ArchiveFile:
+    """An archive file being written, compressed into a spooled temporary file."""
+
+    def __init__(self, profile_id, month):
+        self.profile_id = profile_id
+        self.month = month
+        self.buffer = tempfile.SpooledTemporaryFile(SPOOL_BYTES)
+        if zstandard is not None:
+            self.compression = 'zstd'
+            self.stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(self.buffer, closefd=False)
+        else:
+            self.compression = 'gzip'
+            self.stream = gzip.GzipFile(fileobj=self.buffer, mode='wb')
+        # {conversation id: (conversation row, message count)}
+        self.conversations = {}
+
+    def add(self, row):
+        """Write one conversation as a line, its messages streamed in rather than held."""
+        record = {key: value for key, value in row.items() if key != 'profile_id'}
+        # The id leads each line, so readers can skip lines without parsing them
+        self.stream.write(_json(record)[:-1].encode() + b', "messages": [')
+        messages = Message.objects.filter(conversation_id=row['id']).order_by('timestamp', 'id').values(
+            'id', 'role', 'content', 'timestamp'
+        )
+        count = 0
+        for message in messages.iterator(chunk_size=MESSAGE_READ_CHUNK):
+            self.stream.write((', ' if count else '').encode() + _json(message).encode())
+            count += 1
+        self.stream.write(b']}\n')
+        self.conversations[row['id']] = (row, count)
+
+    def save(self):
+        """Store the file; returns its unsaved ChatArchive."""
+        self.stream.close()
+        self.buffer.seek(0)
+        archive = ChatArchive(profile_id=self.profile_id, month=self.month, compression=self.compression)
+        extension = 'zst' if self.compression == 'zstd' else 'gz'
+        name = f"{self.profile_id}/{self.month:%Y-%m}/{uuid.uuid4().hex}.jsonl.{extension}"
+        archive.file.save(name, File(self.buffer), save=False)
+        self.buffer.close()
+        return archive
+
+
+def _lock_idle(conversation_ids, cutoff):
+    return set(Conversation.objects.select_for_update().filter(
+        pk__in=conversation_ids, last_activity__lt=cutoff
+    ).values_list('id', flat=True))
+
+
+def _record(files, cutoff):
+    """
+    Store the files and their rows and purge the conversations they archived,
+    under the same locks. Returns the ids of the conversations archived.
+    """
+    archives = [(archive_file, archive_file.save()) for archive_file in files]
+    unused = []
+    with transaction.atomic():
+        # Any that got a new message while their file was written stay live;
+        # their line in the file is never read
+        idle = _lock_idle([pk for archive_file in files for pk in archive_file.conversations], cutoff)
+        for archive_file, archive in archives:
+            kept = [entry for pk, entry in archive_file.conversations.items() if pk in idle]
+            if not kept:
+                unused.append(archive)
+                continue
+            archive.conversation_count = len(kept)
+            archive.message_count = sum(count for _, count in kept)
+            archive.save()
+            ArchivedConversation.objects.bulk_create([
+                ArchivedConversation(
+                    id=row['id'],
+                    profile_id=row['profile_id'],
+                    archive=archive,
+                    visitor_id=row['visitor_id'],
+                    last_message_preview=row['last_message_preview'],
+                    last_message_role=row['last_message_role'],
+                    message_count=count,
+                    started_at=row['started_at'],
+                    last_activity=row['last_activity'],
+                )
+                for row, count in kept
+            ])
+        purge(idle)
+    for archive in unused:
+        archive.file.delete(save=False)
+    return idle
+
+
+def purge(conversation_ids, delete_batch=None):
+    """
+    Delete conversations and their messages, at most `delete_batch` message
+    rows per statement. Callers hold the conversations' row locks.
+    """
+    delete_batch = delete_batch or settings.CHAT_ARCHIVE_DELETE_BATCH
+    conversation_ids = list(conversation_ids)
+    messages = Message.objects.filter(conversation_id__in=conversation_ids)
+    while True:
+        pks = list(messages.values_list('pk', flat=True)[:delete_batch])
+        if not pks:
+            break
+        Message.objects.filter(pk__in=pks).delete()
+    Conversation.objects.filter(pk__in=conversation_ids).delete()
+
+
+def archive_batch(cutoff, batch_size=None):
+    """
+    Archive up to `batch_size` conversations idle since before `cutoff`.
+    Returns how many left the hot tables.
+    """
+    batch_size = batch_size or settings.CHAT_ARCHIVE_BATCH_SIZE
+    rows = list(Conversation.objects.filter(last_activity__lt=cutoff).order_by('last_activity').values(
+        *CONVERSATION_FIELDS
+    )[:batch_size])
+    if not rows:
+        return 0
+    # Archived by a run that stopped before purging them
+    done = set(ArchivedConversation.objects.filter(
+        pk__in=[row['id'] for row in rows]
+    ).values_list('id', flat=True))
+    files = {}
+    for row in rows:
+        if row['id'] in done:
+            continue
+        key = (row['profile_id'], _month(row['started_at']))
+        if key not in files:
+            files[key] = _ArchiveFile(*key)
+        files[key].add(row)
+    archived = _record(list(files.values()), cutoff) if files else set()
+    if done:
+        with transaction.atomic():
+            done = _lock_idle(done, cutoff)
+            purge(done)
+    return len(done | archived)
+
+
+async def amark_active(conversation_id, last_activity):
+    """
+    Note a new turn on a conversation whose last_activity is `last_activity`.
+    One idle for a while gets it moved to now, so an archive run can't take
+    the conversation while the turn's messages wait in the write-behind
+    queue. Returns False when the conversation is archived or gone.
+    """
+    if await ArchivedConversation.objects.filter(pk=conversation_id).aexists():
+        return False
+    now = timezone.now()
+    if last_activity >= now - MARK_ACTIVE_AFTER:
+        return True
+    return bool(await Conversation.objects.filter(pk=conversation_id).aupdate(last_activity=now))
+
+
+def _lines(archive):
+    with archive.file.open('rb') as handle:
+        if archive.compression == 'zstd':
+            if zstandard is None:
+                raise RuntimeError('Reading zstd chat archives needs the zstandard package')
+            stream = zstandard.ZstdDecompressor().stream_reader(handle)
+        else:
+            stream = gzip.GzipFile(fileobj=handle, mode='rb')
+        with io.TextIOWrapper(stream, encoding='utf-8') as lines:
+            yield from lines
+
+
+def read_conversation(archived):
+    """The archived record of an ArchivedConversation, messages included, or None."""
+    prefix = f'{{"id": "{archived.pk}"'
+    for line in _lines(archived.archive):
+        if line.startswith(prefix):
+            return json.loads(line)
+    return None
+
+
+def messages_partitioned():
+    """Whether the messages table is partitioned (only ever on MySQL)."""
+    return bool(_partitions())
+
+
+def _partitions():
+    if connection.vendor != 'mysql':
+        return set()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL",
+            [Message._meta.db_table],
+        )
+        return {name for (name,) in cursor.fetchall()}
+
+
+def message_partition_sql(today=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    """
+    MySQL statements that range-partition `messages` by month of `timestamp`
+    or, once it is, add the partitions missing for this and the next
+    `months_ahead` months. Empty on other backends.
+
+    MySQL requires the partitioning column in the primary key and allows no
+    foreign keys on a partitioned table, so the conversion drops the
+    conversation foreign key and makes the key (id, timestamp). It rewrites
+    the table; run it in a maintenance window.
+    """
+    if connection.vendor != 'mysql':
+        return []
+    table = connection.ops.quote_name(Message._meta.db_table)
+    month = (today or datetime.date.today()).replace(day=1)
+    months = [month]
+    for _ in range(months_ahead):
+        months.append(_next_month(months[-1]))
+    existing = _partitions()
+    wanted = [
+        f"PARTITION p{m:%Y%m} VALUES LESS THAN ('{_next_month(m):%Y-%m-%d}')"
+        for m in months if f"p{m:%Y%m}" not in existing
+    ]
+    future = 'PARTITION p_future VALUES LESS THAN (MAXVALUE)'
+    if existing:
+        if not wanted:
+            return []
+        return [f"ALTER TABLE {table} REORGANIZE PARTITION p_future INTO ({', '.join(wanted)}, {future})"]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS "
+            "WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            [Message._meta.db_table],
+        )
+        foreign_keys = [name for (name,) in cursor.fetchall()]
+    statements = [f"ALTER TABLE {table} DROP FOREIGN KEY {connection.ops.quote_name(name)}" for name in foreign_keys]
+    statements.append(f"ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)")
+    statements.append(
+        f"ALTER TABLE {table} PARTITION BY RANGE COLUMNS(timestamp) ("
+        f"PARTITION p_old VALUES LESS THAN ('{month:%Y-%m-%d}'), {', '.join(wanted)}, {future})"
+    )
+    return statements
+
+
+def extend_partitions():
+    """Add the coming months' partitions when the messages table is partitioned."""
+    if not messages_partitioned():
+        return 0
+    statements = message_partition_sql()
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+    return len(statements)
@@ -0,0 +1,81 @@
+"""
+Cache-backed authentication lookups.
+
+Sessions use the cached_db engine: reads come from the cache, writes go to
+both the cache and the sessions table, so a cache flush only costs a reload.
+CachedModelBackend resolves the session's user id through the cache, and the
+/api/auth/me/ payload is cached per user. Both are dropped by the signal
+handlers whenever the user or their profile is saved or deleted; AUTH_CACHE_TTL
+bounds them otherwise, and 0 turns the caching off.
+
+The cached user leaves out the password hash. It carries the session hash
+derived from it for django.contrib.auth to check instead, and the password
+column is only loaded from the database if something reads it.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from .models import OrbitViewProfile, User
+
+
+def _user_key(user_id):
+    return f"auth-user:{user_id}"
+
+
+def _payload_key(user_id):
+    return f"auth-me:{user_id}"
+
+
+# User columns kept in the cache: all but the password hash
+CACHED_FIELDS = [field.attname for field in User._meta.concrete_fields if field.attname != 'password']
+
+
+def invalidate_user(user_id):
+    cache.delete_many([_user_key(user_id), _payload_key(user_id)])
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose per-request user lookup is served from the cache."""
+
+    def get_user(self, user_id):
+        if not settings.AUTH_CACHE_TTL:
+            return super().get_user(user_id)
+        cached = cache.get(_user_key(user_id))
+        if cached is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cached = {
+                'values': [getattr(user, name) for name in CACHED_FIELDS],
+                'session_auth_hash': user.get_session_auth_hash(),
+            }
+            cache.set(_user_key(user_id), cached, settings.AUTH_CACHE_TTL)
+        user = User.from_db(User.objects.db, CACHED_FIELDS, cached['values'])
+        user._session_auth_hash = cached['session_auth_hash']
+        return user if self.user_can_authenticate(user) else None
+
+
+def current_user_payload(user):
+    """What /api/auth/me/ returns for `user`, built once per change."""
+    payload = cache.get(_payload_key(user.pk)) if settings.AUTH_CACHE_TTL else None
+    if payload is None:
+        profile_username = (
+            OrbitViewProfile.objects.filter(user_id=user.pk).values_list('username', flat=True).first()
+        )
+        payload = {
+            'user': {
+                'id': str(user.id),
+                'email': user.email,
+                'first_name': user.first_name,
+                'last_name': user.last_name,
+                'avatar_url': user.avatar_url,
+                'email_verified': user.email_verified,
+            },
+            'has_profile': profile_username is not None,
+            'profile_username': profile_username,
+        }
+        if settings.AUTH_CACHE_TTL:
+            cache.set(_payload_key(user.pk), payload, settings.AUTH_CACHE_TTL)
+    return payload
+
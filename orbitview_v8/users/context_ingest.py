@@ -0,0 +1,328 @@
+"""
+Streaming ingestion of uploaded context files.
+
+A ContextFile is read in CONTEXT_READ_BLOCK sized blocks and never loaded
+whole. A first pass hashes the bytes, so a re-upload of a file the profile
+already has is marked as a duplicate of it instead of being chunked again. A
+second pass pipes the blocks through the extractor for the file's type and a
+chunker, and the chunks are bulk-inserted in batches as they come, so memory
+use stays around one batch of chunks whatever the size of the file. The
+chunks are then embedded for retrieval (see retrieval.py).
+
+Ingestion runs on a small worker pool once the upload is committed (see
+signals.py); `manage.py ingest_context_files` catches up on rows whose jobs
+were lost.
+"""
+import atexit
+import codecs
+import hashlib
+import logging
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from xml.etree.ElementTree import XMLPullParser
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from pypdf import PdfReader
+
+from . import retrieval
+from .models import ContextChunk, ContextFile
+
+
+logger = logging.getLogger(__name__)
+
+
+DOCX_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+TEXT_FILE_TYPES = ('text/', 'application/json', 'application/x-ndjson', 'application/csv')
+HTML_FILE_TYPES = ('text/html', 'application/xhtml+xml', 'application/xml', 'text/xml')
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+# Chunks written per INSERT
+CHUNK_BATCH_SIZE = 200
+
+
+def _blocks(handle, block_size):
+    return iter(lambda: handle.read(block_size), b'')
+
+
+def extract_text(handle, block_size):
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    for block in _blocks(handle, block_size):
+        yield decoder.decode(block)
+    yield decoder.decode(b'', final=True)
+
+
+class _MarkupText(HTMLParser):
+    """Text content of HTML or XML, with line breaks for block elements."""
+
+    SKIP = {'script', 'style', 'head', 'noscript', 'svg'}
+    BLOCKS = {
+        'p', 'div', 'br', 'li', 'tr', 'section', 'article', 'header', 'footer',
+        'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'blockquote', 'table',
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.pieces = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skipping += 1
+        elif tag in self.BLOCKS:
+            self.pieces.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in self.BLOCKS:
+            self.pieces.append('\n')
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.pieces.append(data)
+
+
+def extract_markup(handle, block_size):
+    parser = _MarkupText()
+    for text in extract_text(handle, block_size):
+        parser.feed(text)
+        yield ''.join(parser.pieces)
+        parser.pieces.clear()
+    parser.close()
+    yield ''.join(parser.pieces)
+
+
+def extract_docx(handle, block_size):
+    """Paragraph text of a Word document, streamed out of its document.xml."""
+    parser = XMLPullParser(events=('end',))
+    with zipfile.ZipFile(handle) as archive, archive.open('word/document.xml') as document:
+        for block in _blocks(document, block_size):
+            parser.feed(block)
+            pieces = []
+            for _, element in parser.read_events():
+                if element.tag == f'{WORD_NS}t':
+                    pieces.append(element.text or '')
+                elif element.tag == f'{WORD_NS}tab':
+                    pieces.append('\t')
+                elif element.tag == f'{WORD_NS}br':
+                    pieces.append('\n')
+                elif element.tag == f'{WORD_NS}p':
+                    pieces.append('\n\n')
+                element.clear()
+            yield ''.join(pieces)
+    parser.close()
+
+
+def extract_pdf(handle, block_size):
+    # pypdf reads pages on demand, so only one page's text is held at a time
+    for page in PdfReader(handle).pages:
+        yield (page.extract_text() or '') + '\n\n'
+
+
+def extractor_for(file_type):
+    """The extractor for a MIME type, or None when its text can't be read here."""
+    mime = file_type.split(';', 1)[0].strip().lower()
+    if mime == DOCX_TYPE:
+        return extract_docx
+    if mime == 'application/pdf':
+        return extract_pdf
+    if mime in HTML_FILE_TYPES or mime.endswith('+xml'):
+        return extract_markup
+    if mime.startswith(TEXT_FILE_TYPES):
+        return extract_text
+    return None
+
+
+def _cut(buffer, size):
+    """Where to end a chunk: the last paragraph, line, sentence or word break in its back half."""
+    for separator in ('\n\n', '\n', '. ', ' '):
+        index = buffer.rfind(separator, size // 2, size)
+        if index != -1:
+            return index + len(separator)
+    return size
+
+
+def chunk_text(pieces, size, overlap):
+    """
+    Yield (char_start, text) windows of about `size` characters over a stream
+    of text pieces. Each window repeats up to `overlap` characters of the one
+    before it, starting on a word boundary; whitespace-only windows are skipped.
+    """
+    if not 0 <= overlap < size // 2:
+        raise ValueError('overlap must be less than half the chunk size')
+    buffer = ''
+    start = 0
+    emitted_to = 0
+
+    def window(offset, text):
+        stripped = text.lstrip()
+        if stripped.strip():
+            return offset + len(text) - len(stripped), stripped.rstrip()
+        return None
+
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) > size:
+            cut = _cut(buffer, size)
+            chunk = window(start, buffer[:cut])
+            if chunk:
+                yield chunk
+            emitted_to = start + cut
+            begin = cut
+            if overlap:
+                space = buffer.find(' ', cut - overlap, cut)
+                begin = space + 1 if space != -1 else cut - overlap
+            buffer = buffer[begin:]
+            start += begin
+    if start + len(buffer) > emitted_to:
+        chunk = window(start, buffer)
+        if chunk and chunk[0] + len(chunk[1]) > emitted_to:
+            yield chunk
+
+
+def needs_ingestion(context_file):
+    if not context_file.file:
+        return False
+    if context_file.ingested_file != context_file.file.name:
+        return True
+    # Its original was deleted or changed, taking the chunks it stood in with
+    return context_file.status == 'duplicate' and context_file.duplicate_of_id is None
+
+
+def _hash_file(context_file, block_size):
+    digest = hashlib.sha256()
+    size = 0
+    with context_file.file.open('rb') as handle:
+        for block in _blocks(handle, block_size):
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def _write_chunks(context_file, extract, block_size):
+    batch = []
+    ordinal = 0
+    with context_file.file.open('rb') as handle:
+        windows = chunk_text(
+            extract(handle, block_size), settings.CONTEXT_CHUNK_CHARS, settings.CONTEXT_CHUNK_OVERLAP
+        )
+        for char_start, text in windows:
+            batch.append(ContextChunk(
+                context_file=context_file,
+                profile_id=context_file.profile_id,
+                ordinal=ordinal,
+                char_start=char_start,
+                text=text,
+                content_hash=hashlib.sha256(text.encode()).hexdigest(),
+            ))
+            ordinal += 1
+            if len(batch) >= CHUNK_BATCH_SIZE:
+                ContextChunk.objects.bulk_create(batch)
+                batch = []
+    ContextChunk.objects.bulk_create(batch)
+    return ordinal
+
+
+def _release_duplicates(context_file, content_hash=None):
+    """
+    Detach and re-queue the duplicates of a re-ingested file unless it still
+    holds chunks of `content_hash`, as when an original is deleted (see
+    signals.py).
+    """
+    stale = ContextFile.objects.filter(duplicate_of=context_file)
+    if content_hash is not None:
+        stale = stale.exclude(content_hash=content_hash)
+    released = list(stale.values_list('pk', flat=True))
+    if not released:
+        return
+    ContextFile.objects.filter(pk__in=released).update(duplicate_of=None)
+
+    def reingest():
+        for pk in released:
+            context_ingestion.submit(pk)
+
+    transaction.on_commit(reingest)
+
+
+def ingest_context_file(context_file, block_size=None):
+    """Hash, extract and chunk one ContextFile, replacing any chunks it had."""
+    block_size = block_size or settings.CONTEXT_READ_BLOCK
+    content_hash, size = _hash_file(context_file, block_size)
+    original = ContextFile.objects.filter(
+        profile_id=context_file.profile_id, content_hash=content_hash, status='ready'
+    ).exclude(pk=context_file.pk).order_by('uploaded_at').first()
+
+    context_file.content_hash = content_hash
+    context_file.size_bytes = size
+    context_file.ingested_file = context_file.file.name
+    context_file.duplicate_of = original
+    extract = extractor_for(context_file.file_type)
+    try:
+        with transaction.atomic():
+            ContextChunk.objects.filter(context_file=context_file).delete()
+            if original is not None:
+                context_file.status = 'duplicate'
+            elif extract is None:
+                context_file.status = 'unsupported'
+            else:
+                _write_chunks(context_file, extract, block_size)
+                context_file.status = 'ready'
+            context_file.save(update_fields=[
+                'content_hash', 'size_bytes', 'ingested_file', 'duplicate_of', 'status'
+            ])
+            _release_duplicates(context_file, content_hash if context_file.status == 'ready' else None)
+    except Exception:
+        # Recorded so the row isn't picked up again until a new file is uploaded
+        context_file.status = 'failed'
+        context_file.save(update_fields=['content_hash', 'size_bytes', 'ingested_file', 'duplicate_of', 'status'])
+        _release_duplicates(context_file)
+        retrieval.invalidate(context_file.profile_id)
+        raise
+    retrieval.file_ingested(context_file)
+    return context_file
+
+
+class ContextIngestion:
+    """Worker pool for ingest_context_file(); with no workers files are ingested inline."""
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, pk):
+        if not self.workers:
+            return self._process(pk)
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='context-ingest')
+        return self._executor.submit(self._run, pk)
+
+    @staticmethod
+    def _process(pk):
+        context_file = ContextFile.objects.filter(pk=pk).first()
+        if context_file is not None and needs_ingestion(context_file):
+            return ingest_context_file(context_file)
+        return context_file
+
+    def _run(self, pk):
+        close_old_connections()
+        try:
+            return self._process(pk)
+        except Exception:
+            logger.exception('Ingesting context file %s failed', pk)
+        finally:
+            close_old_connections()
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+            self._executor = None
+
+
+context_ingestion = ContextIngestion(workers=settings.CONTEXT_INGEST_WORKERS)
+# Queued jobs are dropped at exit; ingest_context_files picks them up later
+atexit.register(context_ingestion.shutdown, wait=False)
@@ -0,0 +1,124 @@
+"""
+A profile owner's view of the conversations visitors had with their AI.
+
+Both listings are keyset-paginated. A cursor holds the sort key of the last
+row served, and the next page is read from that point of the
+(profile, -started_at) or (conversation, timestamp) index, so the thousandth
+page costs what the first does. Ties on the timestamp are broken by id in
+the direction the index stores it: MySQL appends the primary key ascending
+to a secondary index, even a descending one.
+
+Conversation rows carry their last message's preview (kept by the message
+writer, see write_behind.py), so a page of conversations is one query, plus
+one for the profile's archived conversations (see archive.py), which are
+listed alongside and read back from their archive file.
+"""
+import base64
+import datetime
+import json
+import uuid
+
+from django.db.models import Q
+
+from .archive import read_conversation
+from .models import ArchivedConversation, Conversation, Message
+from .write_behind import message_writer
+
+
+CONVERSATION_FIELDS = (
+    'id', 'visitor_id', 'started_at', 'last_activity', 'last_message_preview', 'last_message_role',
+)
+MESSAGE_FIELDS = ('id', 'role', 'content', 'timestamp')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(at, pk):
+    payload = json.dumps([at.isoformat(), str(pk)]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        at, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        at = datetime.datetime.fromisoformat(at)
+        if at.tzinfo is None:
+            raise ValueError('naive timestamp')
+        return at, uuid.UUID(pk)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def _after(rows, field, cursor, newest_first=False):
+    """Rows past the cursor: on from its timestamp, then later ids at that timestamp."""
+    if not cursor:
+        return rows
+    at, pk = decode_cursor(cursor)
+    bound, strict = ('lte', 'lt') if newest_first else ('gte', 'gt')
+    # The plain bound is implied by the OR, but it is what starts the index range
+    return rows.filter(Q(**{f'{field}__{bound}': at}), Q(**{f'{field}__{strict}': at}) | Q(id__gt=pk))
+
+
+def _page(rows, field, limit):
+    """rows: up to limit + 1 rows in order; the extra one only says there is more."""
+    page = rows[:limit]
+    next_cursor = encode_cursor(page[-1][field], page[-1]['id']) if len(rows) > limit else None
+    return page, next_cursor
+
+
+def list_conversations(profile_id, cursor=None, limit=20):
+    """
+    A page of a profile's live and archived conversations, newest first, and
+    the cursor of the next one.
+    """
+    rows = {}
+    for model, archived in ((ArchivedConversation, True), (Conversation, False)):
+        page = model.objects.filter(profile_id=profile_id).order_by('-started_at', 'id')
+        page = _after(page, 'started_at', cursor, newest_first=True).values(*CONVERSATION_FIELDS)
+        # One being archived is in both for a moment; the archived row wins
+        for row in page[:limit + 1]:
+            rows.setdefault(row['id'], dict(row, archived=archived))
+    rows = sorted(rows.values(), key=lambda row: row['id'])
+    rows.sort(key=lambda row: row['started_at'], reverse=True)
+    return _page(rows[:limit + 1], 'started_at', limit)
+
+
+def list_messages(conversation_id, cursor=None, limit=50):
+    """
+    A page of a conversation's messages, oldest first, and the cursor of the
+    next one. The last page includes messages still queued for writing.
+    """
+    # Snapshot the queue first: a flush in between then shows up in the query
+    pending = message_writer.pending_messages(conversation_id)
+    rows = Message.objects.filter(conversation_id=conversation_id).order_by('timestamp', 'id')
+    rows = list(_after(rows, 'timestamp', cursor).values(*MESSAGE_FIELDS)[:limit + 1])
+    if len(rows) <= limit and pending:
+        after = decode_cursor(cursor) if cursor else None
+        stored = {row['id'] for row in rows}
+        rows += [
+            {'id': m.id, 'role': m.role, 'content': m.content, 'timestamp': m.timestamp}
+            for m in pending
+            if m.id not in stored and (after is None or (m.timestamp, m.id) > after)
+        ]
+        rows.sort(key=lambda row: (row['timestamp'], row['id']))
+    return _page(rows, 'timestamp', limit)
+
+
+def list_archived_messages(archived, cursor=None, limit=50):
+    """list_messages() for an ArchivedConversation, read from its archive file."""
+    after = decode_cursor(cursor) if cursor else None
+    record = read_conversation(archived)
+    rows = []
+    for message in record['messages'] if record else []:
+        row = dict(
+            message,
+            id=uuid.UUID(message['id']),
+            timestamp=datetime.datetime.fromisoformat(message['timestamp']),
+        )
+        if after is None or (row['timestamp'], row['id']) > after:
+            rows.append(row)
+            if len(rows) > limit:
+                break
+    return _page(rows, 'timestamp', limit)
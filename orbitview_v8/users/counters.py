@@ -0,0 +1,212 @@
+"""
+Contention-free profile counters.
+
+Views and conversations are counted in memory, spread over striped locks so
+request threads don't queue on a single lock, and a background thread writes
+the accumulated deltas out every COUNTER_FLUSH_INTERVAL seconds as atomic
+`F()` updates. A profile gets one UPDATE per flush however many hits it took.
+
+A counter that collects at least COUNTER_HOT_THRESHOLD in one interval is
+hot: its delta goes to one of COUNTER_SHARDS CounterShard rows instead of the
+profile row, so processes flushing at the same time don't wait on one row
+lock. Shards are folded back into the profile column every few flushes.
+
+Reads are approximate but fresh: the stored value plus the unfolded shards
+plus whatever this process hasn't flushed yet.
+"""
+import atexit
+import logging
+import random
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Sum
+
+from .models import CounterShard, OrbitViewProfile
+
+
+logger = logging.getLogger(__name__)
+
+
+COUNTED_FIELDS = ('total_views', 'total_conversations')
+
+
+class ProfileCounters:
+    def __init__(self, interval=5.0, stripes=16, shards=8, hot_threshold=100,
+                 fold_every=12, enabled=True):
+        self.interval = interval
+        self.shards = shards
+        self.hot_threshold = hot_threshold
+        self.fold_every = fold_every
+        self.enabled = enabled
+        self._stripes = [(threading.Lock(), defaultdict(int)) for _ in range(stripes)]
+        self._flush_lock = threading.Lock()
+        self._flushes = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def _stripe(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def incr(self, profile_id, field, amount=1):
+        """Count `amount` against a profile counter. Never touches the database."""
+        if field not in COUNTED_FIELDS:
+            raise ValueError(f"{field} is not a counted field")
+        key = (profile_id, field)
+        lock, deltas = self._stripe(key)
+        with lock:
+            deltas[key] += amount
+        if not self.enabled:
+            self.flush()
+        else:
+            self._ensure_thread()
+
+    async def aincr(self, profile_id, field, amount=1):
+        if not self.enabled:
+            return await sync_to_async(self.incr)(profile_id, field, amount)
+        self.incr(profile_id, field, amount)
+
+    def pending(self, profile_id):
+        """Increments of a profile this process hasn't written yet."""
+        counts = {}
+        for field in COUNTED_FIELDS:
+            key = (profile_id, field)
+            lock, deltas = self._stripe(key)
+            with lock:
+                counts[field] = deltas.get(key, 0)
+        return counts
+
+    def counts(self, profile_id):
+        """Approximate current value of every counter of a profile."""
+        counts = OrbitViewProfile.objects.filter(pk=profile_id).values(*COUNTED_FIELDS).first()
+        if counts is None:
+            return None
+        shards = CounterShard.objects.filter(profile_id=profile_id).values('field').annotate(total=Sum('value'))
+        for row in shards:
+            counts[row['field']] += row['total']
+        for field, delta in self.pending(profile_id).items():
+            counts[field] += delta
+        return counts
+
+    async def acounts(self, profile_id):
+        return await sync_to_async(self.counts)(profile_id)
+
+    def _take(self):
+        taken = defaultdict(int)
+        for lock, deltas in self._stripes:
+            with lock:
+                items = list(deltas.items())
+                deltas.clear()
+            for key, delta in items:
+                taken[key] += delta
+        return taken
+
+    def _restore(self, taken):
+        for key, delta in taken.items():
+            lock, deltas = self._stripe(key)
+            with lock:
+                deltas[key] += delta
+
+    def flush(self):
+        """Write out every pending delta. Returns the number of counters written."""
+        with self._flush_lock:
+            taken = {key: delta for key, delta in self._take().items() if delta}
+            if not taken:
+                return 0
+            # Rows updated by the same amount share one UPDATE
+            direct = defaultdict(list)
+            sharded = defaultdict(list)
+            for (profile_id, field), delta in taken.items():
+                if self.shards > 1 and abs(delta) >= self.hot_threshold:
+                    sharded[(field, random.randrange(self.shards), delta)].append(profile_id)
+                else:
+                    direct[(field, delta)].append(profile_id)
+            try:
+                with transaction.atomic():
+                    for (field, delta), profile_ids in direct.items():
+                        OrbitViewProfile.objects.filter(pk__in=profile_ids).update(
+                            **{field: F(field) + delta}
+                        )
+                    if sharded:
+                        CounterShard.objects.bulk_create(
+                            [
+                                CounterShard(profile_id=profile_id, field=field, shard=shard)
+                                for (field, shard, _), profile_ids in sharded.items()
+                                for profile_id in profile_ids
+                            ],
+                            ignore_conflicts=True,
+                        )
+                    for (field, shard, delta), profile_ids in sharded.items():
+                        CounterShard.objects.filter(
+                            profile_id__in=profile_ids, field=field, shard=shard
+                        ).update(value=F('value') + delta)
+            except Exception:
+                logger.exception('Flushing %d profile counters failed, will retry', len(taken))
+                self._restore(taken)
+                return 0
+            self._flushes += 1
+            if self._flushes % self.fold_every == 0:
+                try:
+                    self.fold_shards()
+                except Exception:
+                    logger.exception('Folding counter shards failed')
+            return len(taken)
+
+    def fold_shards(self):
+        """Move shard values into the profile columns."""
+        with transaction.atomic():
+            rows = list(
+                CounterShard.objects.select_for_update()
+                .exclude(value=0)
+                .values_list('pk', 'profile_id', 'field', 'value')
+            )
+            totals = defaultdict(int)
+            by_value = defaultdict(list)
+            for pk, profile_id, field, value in rows:
+                totals[(field, profile_id)] += value
+                by_value[value].append(pk)
+            # Subtract what was read rather than zeroing, in case of other writers
+            for value, pks in by_value.items():
+                CounterShard.objects.filter(pk__in=pks).update(value=F('value') - value)
+            by_total = defaultdict(list)
+            for (field, profile_id), total in totals.items():
+                by_total[(field, total)].append(profile_id)
+            for (field, total), profile_ids in by_total.items():
+                OrbitViewProfile.objects.filter(pk__in=profile_ids).update(**{field: F(field) + total})
+        return len(rows)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(
+                        target=self._run, name='profile-counters', daemon=True
+                    )
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            close_old_connections()
+            self.flush()
+            close_old_connections()
+
+    def close(self):
+        """Stop the background thread after a final flush."""
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+
+profile_counters = ProfileCounters(
+    interval=settings.COUNTER_FLUSH_INTERVAL,
+    shards=settings.COUNTER_SHARDS,
+    hot_threshold=settings.COUNTER_HOT_THRESHOLD,
+    enabled=settings.COUNTER_WRITE_BEHIND,
+)
+atexit.register(profile_counters.close)
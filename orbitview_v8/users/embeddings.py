@@ -0,0 +1,105 @@
+"""
+Local text embeddings.
+
+get_embedder() returns a sentence-transformers model when EMBEDDING_MODEL is
+set and the package is installed. Otherwise it falls back to HashingEmbedder,
+a dependency-free feature-hashing embedder over words and word bigrams that is
+good enough to match reworded near-duplicates. get_document_embedder() is the
+same model, or a hashing variant suited to longer snippets, for retrieval.
+"""
+import re
+import threading
+import zlib
+
+import numpy as np
+from django.conf import settings
+
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+class HashingEmbedder:
+    """Signed feature hashing of words and bigrams into a fixed-size unit vector."""
+
+    def __init__(self, dim=256, bigrams=True, sublinear=False):
+        self.dim = dim
+        self.bigrams = bigrams
+        self.sublinear = sublinear
+        self.name = f"hashing-{dim}" + ('' if bigrams else '-words') + ('-log' if sublinear else '')
+
+    def _features(self, text):
+        words = WORD_RE.findall(text.lower())
+        if not self.bigrams:
+            return words
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = zlib.crc32(feature.encode())
+                vectors[row, digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        if self.sublinear:
+            # A word repeated ten times shouldn't outweigh ten different ones
+            vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device='cpu')
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = model_name
+
+    def embed(self, texts):
+        return self.model.encode(
+            list(texts), normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+
+
+_embedders = {}
+_embedder_lock = threading.Lock()
+
+
+def _sentence_transformer():
+    model_name = getattr(settings, 'EMBEDDING_MODEL', '')
+    if model_name:
+        try:
+            return SentenceTransformerEmbedder(model_name)
+        except ImportError:
+            pass
+    return None
+
+
+def _get(kind, fallback):
+    embedder = _embedders.get(kind)
+    if embedder is None:
+        with _embedder_lock:
+            embedder = _embedders.get(kind)
+            if embedder is None:
+                # One model instance serves every kind
+                if 'model' not in _embedders:
+                    _embedders['model'] = _sentence_transformer()
+                embedder = _embedders[kind] = _embedders['model'] or fallback()
+    return embedder
+
+
+def get_embedder():
+    """The process-wide embedder for short texts such as questions, loaded on first use."""
+    return _get('questions', HashingEmbedder)
+
+
+def get_document_embedder():
+    """
+    The process-wide embedder for retrieval snippets and the questions searched
+    against them. Without a model it hashes log-scaled word counts only, into
+    RETRIEVAL_EMBEDDING_DIM dimensions: the bigrams of a long snippet would
+    crowd out the words that identify it.
+    """
+    return _get('documents', lambda: HashingEmbedder(
+        settings.RETRIEVAL_EMBEDDING_DIM, bigrams=False, sublinear=True
+    ))
@@ -0,0 +1,159 @@
+"""
+A tiny OpenAI-compatible chat completions server for local benchmarks.
+
+It speaks just enough HTTP/1.1 (keep-alive, chunked SSE bodies) for the Groq
+client to talk to it, and emits a fixed number of tokens with a configurable
+time-to-first-token and inter-token delay, so streaming paths can be load
+tested without touching the real API.
+"""
+import asyncio
+import json
+import threading
+import time
+
+
+class FakeLLMServer:
+    """Serve canned streamed completions on a local port from a background thread."""
+
+    def __init__(self, host='127.0.0.1', port=0, tokens=32, first_token_delay=0.2,
+                 token_delay=0.01, reply=None, fail_first=0):
+        self.host = host
+        self.port = port
+        self.tokens = tokens
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.reply = reply
+        # Answer this many requests with a 503 before succeeding
+        self.fail_first = fail_first
+        self.requests_served = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='fake-llm', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port, backlog=4096)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            # Drop idle keep-alive connections before the loop goes away
+            handlers = asyncio.all_tasks(self._loop)
+            for task in handlers:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*handlers, return_exceptions=True))
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+    def _reply_tokens(self):
+        if self.reply is not None:
+            return [f"{word} " for word in self.reply.split()]
+        return [f"token{i} " for i in range(self.tokens)]
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                headers = {}
+                for line in head.decode('latin-1').split('\r\n')[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                payload = json.loads(body or b'{}')
+                self.requests_served += 1
+                if self.requests_served <= self.fail_first:
+                    await self._error_reply(writer)
+                elif payload.get('stream'):
+                    await self._stream_reply(writer, payload)
+                else:
+                    await self._plain_reply(writer, payload)
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _error_reply(self, writer):
+        body = json.dumps({'error': {'message': 'Service unavailable', 'type': 'server_error'}}).encode()
+        writer.write(
+            b'HTTP/1.1 503 Service Unavailable\r\ncontent-type: application/json\r\n'
+            + f"content-length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    async def _plain_reply(self, writer, payload):
+        await asyncio.sleep(self.first_token_delay)
+        body = json.dumps({
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': ''.join(self._reply_tokens()).strip()},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': self.tokens, 'total_tokens': self.tokens},
+        }).encode()
+        writer.write(
+            b'HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n'
+            + f"content-length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    async def _stream_reply(self, writer, payload):
+        writer.write(
+            b'HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\n'
+            b'transfer-encoding: chunked\r\n\r\n'
+        )
+        await writer.drain()
+        await asyncio.sleep(self.first_token_delay)
+        created = int(time.time())
+        for index, token in enumerate(self._reply_tokens()):
+            if index:
+                await asyncio.sleep(self.token_delay)
+            chunk = {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': payload.get('model', 'fake'),
+                'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}],
+            }
+            self._write_chunk(writer, f"data: {json.dumps(chunk)}\n\n".encode())
+            await writer.drain()
+        self._write_chunk(writer, b'data: [DONE]\n\n')
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    @staticmethod
+    def _write_chunk(writer, data):
+        writer.write(f"{len(data):x}\r\n".encode() + data + b'\r\n')
@@ -0,0 +1,164 @@
+"""
+Google ID token verification against a local key store.
+
+id_token.verify_oauth2_token() downloads Google's signing certificates on
+every call. Here they are kept in a process-wide KeyStore for as long as
+their Cache-Control max-age allows, fetched over one pooled httpx.Client,
+and tokens are verified locally. A token signed with a key the store hasn't
+seen yet (Google rotates keys) triggers one early refresh, rate limited so
+garbage key ids can't turn into a fetch per request.
+
+Keys come from a KeySource; tests plug in StaticKeySource with locally
+generated keys and never touch the network.
+"""
+import base64
+import json
+import logging
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import httpx
+from google.auth import jwt
+
+
+logger = logging.getLogger(__name__)
+
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+# Used when the certificate response carries no usable max-age
+DEFAULT_MAX_AGE = 3600
+MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class KeySource(ABC):
+    """Where signing keys come from."""
+
+    @abstractmethod
+    def fetch(self):
+        """Return ({key id: PEM certificate or public key}, max age in seconds or None)."""
+
+
+class GoogleCertsSource(KeySource):
+    """Google's published x509 certificates, over a pooled HTTP client."""
+
+    def __init__(self, url=GOOGLE_CERTS_URL, client=None, timeout=5.0):
+        self.url = url
+        self.client = client or httpx.Client()
+        self.timeout = timeout
+
+    def fetch(self):
+        response = self.client.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        match = MAX_AGE_RE.search(response.headers.get('Cache-Control', ''))
+        max_age = None
+        if match:
+            age = response.headers.get('Age', '0')
+            max_age = max(0, int(match.group(1)) - (int(age) if age.isdigit() else 0))
+        return response.json(), max_age
+
+
+class StaticKeySource(KeySource):
+    """A fixed set of keys, e.g. generated locally for tests."""
+
+    def __init__(self, keys, max_age=None):
+        self.keys = dict(keys)
+        self.max_age = max_age
+        self.fetches = 0
+
+    def fetch(self):
+        self.fetches += 1
+        return dict(self.keys), self.max_age
+
+
+class KeyStore:
+    """Signing keys cached until they expire, refreshed early for unknown key ids."""
+
+    def __init__(self, source, min_refresh_interval=30.0):
+        self.source = source
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = {}
+        self._expires_at = 0.0
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def _refresh(self, now):
+        try:
+            keys, max_age = self.source.fetch()
+        except Exception:
+            if not self._keys:
+                raise
+            # Keep verifying with the keys we have rather than failing every login
+            logger.exception('Refreshing token signing keys failed, keeping %d cached keys', len(self._keys))
+            self._fetched_at = now
+            return
+        self._keys = keys
+        self._fetched_at = now
+        self._expires_at = now + (DEFAULT_MAX_AGE if max_age is None else max_age)
+
+    def keys(self, key_id=None):
+        """Current keys, making sure `key_id` is among them if it can be."""
+        now = time.monotonic()
+        with self._lock:
+            expired = now >= self._expires_at
+            unknown = key_id is not None and key_id not in self._keys and (
+                self._fetched_at is None or now - self._fetched_at >= self.min_refresh_interval
+            )
+            if expired or unknown:
+                self._refresh(now)
+            return self._keys
+
+
+def _token_key_id(token):
+    if isinstance(token, bytes):
+        token = token.decode('ascii', 'ignore')
+    header = token.split('.', 1)[0]
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(header + '=' * (-len(header) % 4)))
+    except ValueError:
+        raise ValueError('Malformed token header')
+    return decoded.get('kid') if isinstance(decoded, dict) else None
+
+
+class GoogleTokenVerifier:
+    def __init__(self, key_store, issuers=GOOGLE_ISSUERS, clock_skew=10):
+        self.key_store = key_store
+        self.issuers = issuers
+        self.clock_skew = clock_skew
+
+    def verify(self, token, audience):
+        """
+        Claims of a valid token issued for `audience`. Raises ValueError for any
+        invalid, expired or foreign token, like verify_oauth2_token().
+        """
+        certs = self.key_store.keys(_token_key_id(token))
+        claims = jwt.decode(
+            token, certs=certs, audience=audience, clock_skew_in_seconds=self.clock_skew
+        )
+        if claims.get('iss') not in self.issuers:
+            raise ValueError(f"Wrong issuer: {claims.get('iss')}")
+        return claims
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def get_token_verifier():
+    """The process-wide verifier, backed by Google's certificates."""
+    global _verifier
+    if _verifier is None:
+        with _verifier_lock:
+            if _verifier is None:
+                _verifier = GoogleTokenVerifier(KeyStore(GoogleCertsSource()))
+    return _verifier
+
+
+def configure_token_verifier(source, **options):
+    """Replace the process-wide verifier, e.g. with a StaticKeySource in tests."""
+    global _verifier
+    with _verifier_lock:
+        _verifier = GoogleTokenVerifier(KeyStore(source), **options)
+    return _verifier
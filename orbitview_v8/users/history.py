@@ -0,0 +1,147 @@
+"""
+Token-budgeted conversation history.
+
+Each chat turn only loads the newest HISTORY_TAIL_MESSAGES messages that are
+not yet covered by the conversation's rolling summary, counts their tokens
+locally, and keeps as many of the most recent turns as fit the model's
+budget. Turns that fall out of the window are folded into
+`Conversation.summary` in the background, so prompt size stays bounded
+however long a conversation runs.
+"""
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .llm import get_gateway
+from .models import Conversation, Message
+from .tokens import context_window, fit_messages, message_tokens
+from .write_behind import message_writer
+
+
+logger = logging.getLogger(__name__)
+
+
+HISTORY_TAIL_MESSAGES = 50
+SUMMARY_BATCH_MESSAGES = 200
+SUMMARY_MAX_TOKENS = 400
+SUMMARY_MODEL = "llama-3.1-8b-instant"
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below between a visitor and the AI version of a "
+    "profile owner. Keep names, facts, questions asked and commitments made; drop "
+    "pleasantries. Merge it with the existing summary if there is one. Reply with "
+    "the summary only."
+)
+
+
+def history_budget(model, system_messages, max_output_tokens):
+    """Tokens left for history once the system prompt and the answer are reserved."""
+    window = context_window(model)
+    fixed = sum(message_tokens(m) for m in system_messages)
+    return max(0, min(window - max_output_tokens - fixed, settings.CHAT_HISTORY_MAX_TOKENS))
+
+
+async def aload_history(conversation):
+    """
+    Newest unsummarized messages of a conversation, oldest first, including
+    ones still queued in the write-behind buffer.
+    """
+    # Snapshot the queue first: a flush in between then shows up in the query
+    pending = message_writer.pending_messages(conversation.pk)
+    messages = Message.objects.filter(conversation_id=conversation.pk)
+    if conversation.summary_through:
+        messages = messages.filter(timestamp__gt=conversation.summary_through)
+    rows = messages.order_by('-timestamp').values('id', 'role', 'content', 'timestamp')
+    history = [row async for row in rows[:HISTORY_TAIL_MESSAGES]]
+    stored = {row['id'] for row in history}
+    history += [
+        {'id': m.id, 'role': m.role, 'content': m.content, 'timestamp': m.timestamp}
+        for m in pending if m.id not in stored
+    ]
+    history.sort(key=lambda row: row['timestamp'])
+    return [
+        {'role': row['role'], 'content': row['content']}
+        for row in history[-HISTORY_TAIL_MESSAGES:]
+    ]
+
+
+async def abuild_prompt(conversation, system_prompt, user_message, model, max_output_tokens):
+    """
+    The message list for one turn: system prompt, rolling summary, as much
+    recent history as fits, and the new question. Also returns whether some
+    history was left out and should be folded into the summary.
+    """
+    system_messages = [{'role': 'system', 'content': system_prompt}]
+    if conversation.summary:
+        system_messages.append({
+            'role': 'system',
+            'content': f"Summary of the earlier conversation:\n{conversation.summary}",
+        })
+    history = await aload_history(conversation)
+    budget = history_budget(model, system_messages, max_output_tokens)
+    messages, dropped = fit_messages(system_messages, history, user_message, budget)
+    return messages, dropped > 0 or len(history) >= HISTORY_TAIL_MESSAGES
+
+
+async def asummarize(conversation_id, keep_tokens):
+    """
+    Fold the oldest unsummarized messages into the rolling summary, leaving the
+    newest `keep_tokens` worth of messages for the prompt window.
+    """
+    # Summarizing works from stored rows, so write out anything still queued
+    await sync_to_async(message_writer.flush)()
+    conversation = await Conversation.objects.only('summary', 'summary_through').aget(pk=conversation_id)
+    messages = Message.objects.filter(conversation_id=conversation_id)
+    if conversation.summary_through:
+        messages = messages.filter(timestamp__gt=conversation.summary_through)
+    oldest = messages.order_by('timestamp').values('role', 'content', 'timestamp')
+    rows = [row async for row in oldest[:SUMMARY_BATCH_MESSAGES]]
+
+    # Everything before the newest keep_tokens of messages gets summarized
+    kept = 0
+    cut = len(rows)
+    while cut > 0 and kept + message_tokens(rows[cut - 1]) <= keep_tokens:
+        cut -= 1
+        kept += message_tokens(rows[cut])
+    # A long backlog is folded over several turns, half a batch at a time
+    if len(rows) == SUMMARY_BATCH_MESSAGES:
+        cut = max(cut, len(rows) // 2)
+    folded = rows[:cut]
+    if not folded:
+        return
+
+    transcript = '\n'.join(f"{row['role']}: {row['content']}" for row in folded)
+    if conversation.summary:
+        transcript = f"Existing summary:\n{conversation.summary}\n\nNew turns:\n{transcript}"
+    summary = await get_gateway().complete(
+        SUMMARY_MODEL,
+        [{'role': 'system', 'content': SUMMARY_PROMPT}, {'role': 'user', 'content': transcript}],
+        max_tokens=SUMMARY_MAX_TOKENS,
+    )
+    # Only apply if no other turn folded the same messages meanwhile
+    await Conversation.objects.filter(
+        pk=conversation_id, summary_through=conversation.summary_through
+    ).aupdate(summary=summary.strip(), summary_through=folded[-1]['timestamp'])
+
+
+_background = set()
+
+
+def _summary_done(task):
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning('Conversation summary failed', exc_info=task.exception())
+
+
+def schedule_summary(conversation_id):
+    """
+    Summarize in the background without holding up the finished answer. Half
+    the history budget stays unsummarized so folding doesn't happen every turn.
+    """
+    keep_tokens = settings.CHAT_HISTORY_MAX_TOKENS // 2
+    task = asyncio.get_running_loop().create_task(asummarize(conversation_id, keep_tokens))
+    _background.add(task)
+    task.add_done_callback(_summary_done)
+    return task
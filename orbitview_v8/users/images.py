@@ -0,0 +1,164 @@
+"""
+Off-request processing of uploaded profile and work images.
+
+Saving a ProfileImage or WorkImage with a new file only queues it (see
+signals.py); a small worker pool then decodes it once, applies the EXIF
+orientation, drops EXIF/XMP metadata, writes resized copies at each of
+IMAGE_VARIANT_WIDTHS narrower than the original in IMAGE_VARIANT_FORMATS, and
+fills in `url`, `width`, `height` and `variants`. The default `url` points at
+the IMAGE_DEFAULT_WIDTH copy so pages stop serving full-size originals.
+
+Rows whose variants don't match their current file can be (re)processed with
+`manage.py process_images`, e.g. after a restart dropped queued jobs.
+
+A job only writes its result while the row still holds the file it processed:
+an image replaced (or deleted) meanwhile keeps what its newer job writes, and
+the stale job deletes the variants it made instead of the row's.
+"""
+import atexit
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+
+# Pillow format name and encoder options per variant format
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'avif': ('AVIF', {'quality': 60}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def needs_processing(row):
+    return bool(row.image) and row.variants.get('source') != row.image.name
+
+
+def _decode(row):
+    with row.image.open('rb') as handle:
+        with Image.open(handle) as original:
+            icc_profile = original.info.get('icc_profile')
+            image = ImageOps.exif_transpose(original)
+            image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.mode else 'RGB')
+    return image, icc_profile
+
+
+def _encode(image, fmt, icc_profile):
+    pil_format, options = FORMATS[fmt]
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    # Only the colour profile is carried over; EXIF, XMP and comments are dropped
+    image.save(buffer, pil_format, icc_profile=icc_profile, **options)
+    return buffer.getvalue()
+
+
+def process_image(row, widths=None, formats=None):
+    """
+    Make the variants of one image row and store them on it. Returns the row,
+    or None when its image was replaced or removed before they were stored.
+    """
+    widths = widths or settings.IMAGE_VARIANT_WIDTHS
+    formats = formats or settings.IMAGE_VARIANT_FORMATS
+    image, icc_profile = _decode(row)
+    width, height = image.size
+    stem = os.path.splitext(row.image.name)[0]
+
+    items = []
+    for target in sorted({w for w in widths if w < width} | {width}):
+        if target == width:
+            resized = image
+        else:
+            resized = image.resize((target, max(1, round(height * target / width))), Image.LANCZOS)
+        for fmt in formats:
+            data = _encode(resized, fmt, icc_profile)
+            name = default_storage.save(f"{stem}-{target}w.{fmt}", ContentFile(data))
+            items.append({
+                'width': resized.width,
+                'height': resized.height,
+                'format': fmt,
+                'name': name,
+                'url': default_storage.url(name),
+                'bytes': len(data),
+            })
+
+    default_format = formats[0]
+    candidates = [i for i in items if i['format'] == default_format]
+    fitting = [i for i in candidates if i['width'] <= settings.IMAGE_DEFAULT_WIDTH]
+    default = fitting[-1] if fitting else candidates[0]
+
+    with transaction.atomic():
+        current = type(row).objects.select_for_update().filter(
+            pk=row.pk, image=row.image.name
+        ).values_list('variants', flat=True).first()
+        if current is not None:
+            row.url = default['url']
+            row.width = width
+            row.height = height
+            row.variants = {'source': row.image.name, 'items': items}
+            row.save(update_fields=['url', 'width', 'height', 'variants'])
+
+    if current is None:
+        # Replaced or deleted while this job ran; the newer upload has its own job
+        for item in items:
+            default_storage.delete(item['name'])
+        return None
+    for item in current.get('items', []):
+        default_storage.delete(item['name'])
+    return row
+
+
+class ImagePipeline:
+    """Worker pool for process_image(); with no workers images are processed inline."""
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, model, pk):
+        if not self.workers:
+            return self._process(model, pk)
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='image-pipeline')
+        return self._executor.submit(self._run, model, pk)
+
+    @staticmethod
+    def _process(model, pk):
+        row = model.objects.filter(pk=pk).first()
+        if row is not None and needs_processing(row):
+            return process_image(row)
+        return row
+
+    def _run(self, model, pk):
+        close_old_connections()
+        try:
+            return self._process(model, pk)
+        except Exception:
+            logger.exception('Processing %s %s failed', model.__name__, pk)
+        finally:
+            close_old_connections()
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+            self._executor = None
+
+
+image_pipeline = ImagePipeline(workers=settings.IMAGE_WORKERS)
+# Queued jobs are dropped at exit; process_images picks them up later
+atexit.register(image_pipeline.shutdown, wait=False)
@@ -0,0 +1,430 @@
+"""
+Shared gateway to the LLM provider.
+
+Every view talks to Groq through one LLMGateway so that, per process, there is
+a single pooled HTTP client (HTTP/2 when `h2` is installed), a cap on how many
+upstream calls run at once per model, bounded retries with jittered backoff
+for transient failures, and a circuit breaker that fails fast while the
+provider is down. `metrics()` reports pool and queue state.
+"""
+import asyncio
+import importlib.util
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import groq
+import httpx
+from django.conf import settings
+
+
+RETRYABLE_ERRORS = (
+    groq.APIConnectionError,
+    groq.RateLimitError,
+    groq.InternalServerError,
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the provider while its circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds, then lets a single trial call through (half-open).
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """End a call that says nothing about the provider's health (a 4xx, a cancellation)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class ModelStats:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+
+
+class LLMGateway:
+    """Pooled, concurrency-limited, retrying access to chat completions."""
+
+    def __init__(self, api_key, base_url=None, max_connections=100, max_keepalive_connections=20,
+                 keepalive_expiry=30.0, timeout=60.0, connect_timeout=5.0, max_concurrency=64,
+                 model_concurrency=None, max_retries=2, backoff_base=0.25, backoff_max=4.0,
+                 breaker_threshold=5, breaker_reset_timeout=30.0, http2=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.http2 = importlib.util.find_spec('h2') is not None if http2 is None else http2
+        self.max_concurrency = max_concurrency
+        self.model_concurrency = model_concurrency or {}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._breakers = {}
+        self._sync_slots = {}
+        self._sync_client = None
+        self._async_loop = None
+        self._async_client = None
+        self._async_slots = {}
+        # Tasks closing each loop's client when that loop shuts down
+        self._closers = set()
+
+    @classmethod
+    def from_settings(cls, **overrides):
+        options = {
+            'api_key': settings.GROQ_API_KEY,
+            'base_url': settings.GROQ_BASE_URL or None,
+            'max_connections': settings.LLM_MAX_CONNECTIONS,
+            'timeout': settings.LLM_TIMEOUT,
+            'max_concurrency': settings.LLM_MAX_CONCURRENCY,
+            'model_concurrency': settings.LLM_MODEL_CONCURRENCY,
+            'max_retries': settings.LLM_MAX_RETRIES,
+        }
+        options.update(overrides)
+        return cls(**options)
+
+    # ---------------------------------------------------------------- clients
+
+    def _http_options(self):
+        return {'limits': self.limits, 'timeout': self.timeout, 'http2': self.http2}
+
+    @property
+    def sync_client(self):
+        with self._lock:
+            if self._sync_client is None:
+                self._sync_client = groq.Groq(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    max_retries=0,
+                    http_client=httpx.Client(**self._http_options()),
+                )
+            return self._sync_client
+
+    def _bind_loop(self):
+        # httpx.AsyncClient connections and asyncio semaphores belong to the
+        # loop that created them, so start afresh when the loop changes
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_loop = loop
+            self._async_slots = {}
+            self._async_client = groq.AsyncGroq(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=0,
+                http_client=httpx.AsyncClient(**self._http_options()),
+            )
+            # Once the loop is gone its connections can't be closed, so close
+            # the client as the loop shuts down
+            closer = loop.create_task(self._close_with_loop(self._async_client))
+            self._closers.add(closer)
+            closer.add_done_callback(self._closers.discard)
+
+    @staticmethod
+    async def _close_with_loop(client):
+        # asyncio.run() and async_to_sync() cancel pending tasks before they
+        # close their loop
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            await client.close()
+
+    @property
+    def async_client(self):
+        self._bind_loop()
+        return self._async_client
+
+    def close(self):
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+            self._async_loop = None
+
+    # ------------------------------------------------------ limits and health
+
+    def _limit(self, model):
+        return self.model_concurrency.get(model, self.max_concurrency)
+
+    def _model(self, model):
+        with self._lock:
+            if model not in self._stats:
+                self._stats[model] = ModelStats(self._limit(model))
+                self._breakers[model] = CircuitBreaker(
+                    self.breaker_threshold, self.breaker_reset_timeout
+                )
+            return self._stats[model], self._breakers[model]
+
+    def available(self, model):
+        """False while the model's circuit is open, so callers can fail fast."""
+        return self._model(model)[1].state != 'open'
+
+    def _backoff(self, attempt, exc):
+        retry_after = None
+        response = getattr(exc, 'response', None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get('retry-after', ''))
+            except ValueError:
+                pass
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _check_breaker(self, stats, breaker):
+        if not breaker.allow():
+            stats.rejected += 1
+            raise CircuitOpenError('LLM provider circuit is open')
+
+    @asynccontextmanager
+    async def _async_slot(self, model, stats):
+        self._bind_loop()
+        slot = self._async_slots.get(model)
+        if slot is None:
+            slot = self._async_slots[model] = asyncio.Semaphore(stats.limit)
+        stats.waiting += 1
+        try:
+            await slot.acquire()
+        finally:
+            stats.waiting -= 1
+        stats.in_flight += 1
+        try:
+            yield
+        finally:
+            stats.in_flight -= 1
+            slot.release()
+
+    @contextmanager
+    def _sync_slot(self, model, stats):
+        with self._lock:
+            slot = self._sync_slots.get(model)
+            if slot is None:
+                slot = self._sync_slots[model] = threading.BoundedSemaphore(stats.limit)
+            stats.waiting += 1
+        slot.acquire()
+        with self._lock:
+            stats.waiting -= 1
+            stats.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                stats.in_flight -= 1
+            slot.release()
+
+    # ------------------------------------------------------------------ calls
+
+    async def _acreate(self, model, messages, stats, breaker, **kwargs):
+        """Open a completion, retrying transient failures before any output."""
+        attempt = 0
+        while True:
+            self._check_breaker(stats, breaker)
+            stats.requests += 1
+            try:
+                response = await self.async_client.chat.completions.create(
+                    model=model, messages=messages, **kwargs
+                )
+            except RETRYABLE_ERRORS as exc:
+                breaker.record_failure()
+                if attempt >= self.max_retries:
+                    stats.failures += 1
+                    raise
+                stats.retries += 1
+                await asyncio.sleep(self._backoff(attempt, exc))
+                attempt += 1
+            except BaseException:
+                # Otherwise a half-open circuit would wait for this trial forever
+                breaker.release()
+                raise
+            else:
+                breaker.record_success()
+                return response
+
+    def _create(self, model, messages, stats, breaker, **kwargs):
+        attempt = 0
+        while True:
+            self._check_breaker(stats, breaker)
+            stats.requests += 1
+            try:
+                response = self.sync_client.chat.completions.create(
+                    model=model, messages=messages, **kwargs
+                )
+            except RETRYABLE_ERRORS as exc:
+                breaker.record_failure()
+                if attempt >= self.max_retries:
+                    stats.failures += 1
+                    raise
+                stats.retries += 1
+                time.sleep(self._backoff(attempt, exc))
+                attempt += 1
+            except BaseException:
+                # Otherwise a half-open circuit would wait for this trial forever
+                breaker.release()
+                raise
+            else:
+                breaker.record_success()
+                return response
+
+    async def stream_chat(self, model, messages, **kwargs):
+        """
+        Async generator of content deltas. Retries only happen before the first
+        token; closing the generator closes the upstream response.
+        """
+        stats, breaker = self._model(model)
+        async with self._async_slot(model, stats):
+            response = await self._acreate(model, messages, stats, breaker, stream=True, **kwargs)
+            try:
+                async for chunk in response:
+                    content = chunk.choices[0].delta.content if chunk.choices else None
+                    if content:
+                        yield content
+            except RETRYABLE_ERRORS:
+                stats.failures += 1
+                breaker.record_failure()
+                raise
+            finally:
+                await response.close()
+
+    async def complete(self, model, messages, **kwargs):
+        stats, breaker = self._model(model)
+        async with self._async_slot(model, stats):
+            response = await self._acreate(model, messages, stats, breaker, **kwargs)
+        return response.choices[0].message.content or ''
+
+    def stream_chat_sync(self, model, messages, **kwargs):
+        """Blocking counterpart of stream_chat for WSGI views and scripts."""
+        stats, breaker = self._model(model)
+        with self._sync_slot(model, stats):
+            response = self._create(model, messages, stats, breaker, stream=True, **kwargs)
+            try:
+                for chunk in response:
+                    content = chunk.choices[0].delta.content if chunk.choices else None
+                    if content:
+                        yield content
+            except RETRYABLE_ERRORS:
+                stats.failures += 1
+                breaker.record_failure()
+                raise
+            finally:
+                response.close()
+
+    def complete_sync(self, model, messages, **kwargs):
+        stats, breaker = self._model(model)
+        with self._sync_slot(model, stats):
+            response = self._create(model, messages, stats, breaker, **kwargs)
+        return response.choices[0].message.content or ''
+
+    # ---------------------------------------------------------------- metrics
+
+    @staticmethod
+    def _pool_size(client):
+        if client is None:
+            return None
+        # httpx does not expose pool state publicly; read it when available
+        pool = getattr(getattr(client._client, '_transport', None), '_pool', None)
+        connections = getattr(pool, 'connections', None)
+        return len(connections) if connections is not None else None
+
+    def metrics(self):
+        models = {}
+        for model, stats in list(self._stats.items()):
+            models[model] = {
+                'limit': stats.limit,
+                'in_flight': stats.in_flight,
+                'waiting': stats.waiting,
+                'requests': stats.requests,
+                'retries': stats.retries,
+                'failures': stats.failures,
+                'rejected': stats.rejected,
+                'circuit': self._breakers[model].state,
+            }
+        return {
+            'http2': self.http2,
+            'max_connections': self.limits.max_connections,
+            'sync_pool_connections': self._pool_size(self._sync_client),
+            'async_pool_connections': self._pool_size(self._async_client),
+            'models': models,
+        }
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """The process-wide gateway, built from settings on first use."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway.from_settings()
+    return _gateway
+
+
+def configure_gateway(**overrides):
+    """Replace the process-wide gateway, e.g. to point it at a local stub server."""
+    global _gateway
+    with _gateway_lock:
+        _gateway = LLMGateway.from_settings(**overrides)
+    return _gateway
@@ -0,0 +1,69 @@
+"""Shared helpers for the bench_* management commands."""
+import statistics
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def test_database(verbosity=0, name=None):
+    """
+    Run a benchmark against a throwaway test database, never the configured one.
+    `name` overrides the test database's name, e.g. to put a big sqlite one on disk.
+    """
+    old_name = connection.settings_dict['NAME']
+    old_test = connection.settings_dict.get('TEST')
+    if name:
+        connection.settings_dict['TEST'] = dict(old_test or {}, NAME=name)
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        connection.settings_dict['TEST'] = old_test
+        teardown_test_environment()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    """p50/p95/max of a list of seconds, formatted in milliseconds."""
+    if not values:
+        return 'n/a'
+    return (
+        f"p50={percentile(values, 50) * 1000:.1f}ms "
+        f"p95={percentile(values, 95) * 1000:.1f}ms "
+        f"max={max(values) * 1000:.1f}ms "
+        f"mean={statistics.fmean(values) * 1000:.1f}ms"
+    )
+
+
+def make_profile(username='benchuser', **fields):
+    """Create a user with a minimal public OrbitView profile."""
+    from users.models import OrbitViewProfile, User
+
+    user = User.objects.create(
+        email=f"{username}@example.com",
+        username=username,
+        first_name='Bench',
+        last_name='User',
+    )
+    defaults = {
+        'first_name': 'Bench',
+        'last_name': 'User',
+        'byline': 'Builds things',
+        'about': 'A profile generated for benchmarking.',
+        'nicknames': 'bench',
+        'values': 'Move fast',
+        'is_public': True,
+    }
+    defaults.update(fields)
+    return OrbitViewProfile.objects.create(user=user, username=username, **defaults)
@@ -0,0 +1,71 @@
+"""
+Move conversations idle for longer than CHAT_RETENTION_DAYS into compressed
+archives (see users/archive.py).
+
+Run it daily from cron, or keep it running as the scheduler:
+
+    python manage.py archive_conversations --every 3600
+
+On MySQL, --partition-sql prints the statements that partition the messages
+table by month; once it is partitioned every run adds the coming months'
+partitions.
+"""
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from users import archive
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Archive and delete conversations idle for longer than the retention period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CHAT_RETENTION_DAYS)
+        parser.add_argument('--batch-size', type=int, default=settings.CHAT_ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, default=0, help='Stop after this many batches; 0 for no limit.')
+        parser.add_argument('--every', type=float, default=0, help='Keep running, once every this many seconds.')
+        parser.add_argument('--partition-sql', action='store_true', help='Print the partitioning SQL and exit.')
+
+    def handle(self, *args, **options):
+        if options['partition_sql']:
+            statements = archive.message_partition_sql()
+            if not statements:
+                self.stderr.write('Nothing to do: partitioning needs MySQL, or the partitions exist.')
+            for statement in statements:
+                self.stdout.write(f"{statement};")
+            return
+
+        while True:
+            try:
+                self.run_once(options)
+            except Exception:
+                if not options['every']:
+                    raise
+                logger.exception('Archiving conversations failed, will retry')
+            if not options['every']:
+                return
+            close_old_connections()
+            time.sleep(options['every'])
+
+    def run_once(self, options):
+        added = archive.extend_partitions()
+        if added:
+            self.stdout.write(f"Added partitions with {added} statement(s)")
+        cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+        total = batches = 0
+        while True:
+            moved = archive.archive_batch(cutoff, options['batch_size'])
+            total += moved
+            batches += 1
+            if not moved or batches == options['max_batches']:
+                break
+        self.stdout.write(f"Archived {total} conversations idle since before {cutoff:%Y-%m-%d}")
@@ -0,0 +1,73 @@
+"""
+Measure the analytics pipeline: events recorded per second on the request
+path, the flush and daily rollup, and dashboard latency for a quiet profile
+against a busy one, which should match since both read the same number of
+rollup rows.
+
+    python manage.py bench_analytics --events 1000000 --days 30
+"""
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.utils import timezone
+
+from users.analytics import ProfileAnalytics, dashboard, rollup_day
+from users.models import ProfileStats
+
+from ._bench import make_profile, summarize, test_database
+
+
+class Command(BaseCommand):
+    help = 'Benchmark analytics recording, rollups and dashboard reads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=200000, help='Events on the busy profile.')
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--visitors', type=int, default=50000)
+        parser.add_argument('--queries', type=int, default=50)
+
+    def handle(self, *args, **options):
+        days = options['days']
+        with override_settings(DEBUG=False), test_database():
+            busy, quiet = make_profile('busybench'), make_profile('quietbench')
+            # Flushed once, below, rather than by its thread while recording
+            analytics = ProfileAnalytics(interval=3600)
+            now = timezone.now()
+            rng = random.Random(4)
+            spread = days * 24 * 3600
+            started = time.perf_counter()
+            for _ in range(options['events']):
+                at = now - datetime.timedelta(seconds=rng.randrange(spread))
+                analytics.record(busy.id, 'views', f"visitor {rng.randrange(options['visitors'])}", at=at)
+            recorded = time.perf_counter() - started
+            for i in range(days):
+                analytics.record(quiet.id, 'views', 'visitor', at=now - datetime.timedelta(days=i))
+            started = time.perf_counter()
+            analytics.close()
+            flushed = time.perf_counter() - started
+            rows = ProfileStats.objects.count()
+
+            started = time.perf_counter()
+            for i in range(days, 1, -1):
+                rollup_day((now - datetime.timedelta(days=i)).date())
+            rolled = time.perf_counter() - started
+
+            timings = {'quiet': [], 'busy': []}
+            for _ in range(options['queries']):
+                for name, profile in (('quiet', quiet), ('busy', busy)):
+                    started = time.perf_counter()
+                    board = dashboard(profile.id, days, now=now)
+                    timings[name].append(time.perf_counter() - started)
+                    if name == 'busy':
+                        totals = board['totals']
+
+        events = options['events']
+        self.stdout.write(f"record: {events / recorded:.0f} events/s ({recorded / events * 1e6:.1f}us each)")
+        self.stdout.write(f"flush: {rows} hour rows in {flushed:.2f}s; rollup of {days - 1} days in {rolled:.2f}s")
+        self.stdout.write(f"busy totals: {totals['views']} views, ~{totals['visitors']} unique visitors "
+                          f"(at most {options['visitors']})")
+        for name, values in timings.items():
+            self.stdout.write(f"dashboard {name:>5}: {summarize(values)}")
@@ -0,0 +1,84 @@
+"""
+Measure archive_conversations: conversations moved per second, the longest
+single DELETE (how long any one statement holds its locks) and the archive
+size against the raw message text.
+
+    python manage.py bench_archive --conversations 5000 --messages 40
+"""
+import datetime
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Sum
+from django.test import override_settings
+from django.utils import timezone
+
+from users import archive
+from users.models import ChatArchive, Conversation, Message
+
+from ._bench import make_profile, summarize, test_database
+
+
+class Command(BaseCommand):
+    help = 'Benchmark archiving idle conversations into compressed files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=5000)
+        parser.add_argument('--messages', type=int, default=40, help='Messages per conversation.')
+        parser.add_argument('--profiles', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--database', help='File for the sqlite test database.')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root, DEBUG=False), test_database(name=options['database']):
+            profiles = [make_profile(f'archivebench{i}') for i in range(options['profiles'])]
+            old = timezone.now() - datetime.timedelta(days=400)
+            raw = 0
+            for start in range(0, options['conversations'], 500):
+                rows = Conversation.objects.bulk_create(
+                    Conversation(profile=profiles[i % len(profiles)])
+                    for i in range(start, min(start + 500, options['conversations']))
+                )
+                messages = [
+                    Message(
+                        conversation=row, role='user' if j % 2 == 0 else 'assistant',
+                        content=f"Message {j} about the work on project {i % 97}, and what came of it.",
+                        timestamp=old + datetime.timedelta(minutes=i, seconds=j),
+                    )
+                    for i, row in enumerate(rows) for j in range(options['messages'])
+                ]
+                raw += sum(len(m.content.encode()) for m in messages)
+                Message.objects.bulk_create(messages, batch_size=5000)
+            Conversation.objects.update(started_at=old, last_activity=old)
+
+            deletes = []
+
+            def time_deletes(execute, sql, params, many, context):
+                started = time.perf_counter()
+                try:
+                    return execute(sql, params, many, context)
+                finally:
+                    if sql.lstrip().upper().startswith('DELETE'):
+                        deletes.append(time.perf_counter() - started)
+
+            cutoff = timezone.now() - datetime.timedelta(days=365)
+            started = time.perf_counter()
+            moved = 0
+            with connection.execute_wrapper(time_deletes):
+                while True:
+                    count = archive.archive_batch(cutoff, options['batch_size'])
+                    if not count:
+                        break
+                    moved += count
+            elapsed = time.perf_counter() - started
+            stored = sum(row.file.size for row in ChatArchive.objects.all())
+            archived_messages = ChatArchive.objects.aggregate(total=Sum('message_count'))['total']
+
+        self.stdout.write(f"compression: {'zstd' if archive.zstandard else 'gzip'}")
+        self.stdout.write(f"moved {moved} conversations, {archived_messages} messages in {elapsed:.1f}s "
+                          f"({moved / elapsed:.0f} conversations/s)")
+        self.stdout.write(f"DELETE statements: {len(deletes)}, {summarize(deletes)}")
+        self.stdout.write(f"archive size: {stored / 1e6:.1f}MB for {raw / 1e6:.1f}MB of message text")
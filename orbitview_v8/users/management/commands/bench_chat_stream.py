@@ -0,0 +1,125 @@
+"""
+Compare the sync (WSGI-style) and async (ASGI) chat streaming paths.
+
+Both views are driven in-process against a local fake LLM server and every
+stream is opened at t=0, so time-to-first-token includes any wait for a free
+worker. The sync
+view runs on a fixed pool of threads standing in for WSGI workers, so at most
+`--workers` streams can be in flight; the async view runs every stream as a
+coroutine on one event loop.
+
+    python manage.py bench_chat_stream --streams 500 --workers 16
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from users.analytics import profile_analytics
+from users.counters import profile_counters
+from users.fake_llm import FakeLLMServer
+from users.llm import configure_gateway
+from users.popular_questions import popular_questions
+from users.write_behind import message_writer
+
+from ._bench import make_profile, summarize, test_database
+
+
+class InFlight:
+    """Thread-safe counter of concurrently open streams."""
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.current -= 1
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent chat streams and time-to-first-token, sync vs async.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--streams', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=16, help='Threads for the sync path')
+        parser.add_argument('--tokens', type=int, default=32)
+        parser.add_argument('--first-token-delay', type=float, default=0.2)
+        parser.add_argument('--token-delay', type=float, default=0.01)
+
+    def handle(self, *args, **options):
+        fake = FakeLLMServer(
+            tokens=options['tokens'],
+            first_token_delay=options['first_token_delay'],
+            token_delay=options['token_delay'],
+        )
+        with fake, test_database():
+            make_profile('benchuser')
+            # Let concurrency be bounded by the serving model, not the gateway
+            configure_gateway(
+                api_key='bench',
+                base_url=fake.base_url,
+                max_connections=options['streams'],
+                max_concurrency=options['streams'],
+            )
+
+            sync_result = self._run_sync(options['streams'], options['workers'])
+            async_result = asyncio.run(self._run_async(options['streams']))
+            # Written behind the views; flushed while their rows still exist
+            for pipeline in (message_writer, popular_questions, profile_analytics, profile_counters):
+                pipeline.flush()
+
+        self.stdout.write(f"{options['streams']} streams, {options['tokens']} tokens each")
+        for label, (elapsed, ttft, peak) in (
+            (f"sync  ({options['workers']} workers)", sync_result),
+            ('async (asgi)', async_result),
+        ):
+            self.stdout.write(
+                f"{label:22} wall={elapsed:.2f}s peak_in_flight={peak} ttft {summarize(ttft)}"
+            )
+
+    def _run_sync(self, streams, workers):
+        in_flight = InFlight()
+        started = time.perf_counter()
+
+        def one_stream(_):
+            client = Client()
+            response = client.post('/stream-test/', {'message': 'hi'}, content_type='application/json')
+            first = None
+            with in_flight:
+                for part in response.streaming_content:
+                    if first is None and part:
+                        first = time.perf_counter() - started
+            return first
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            ttft = [value for value in pool.map(one_stream, range(streams)) if value is not None]
+        return time.perf_counter() - started, ttft, in_flight.peak
+
+    async def _run_async(self, streams):
+        in_flight = InFlight()
+        client = AsyncClient()
+        started = time.perf_counter()
+
+        async def one_stream():
+            response = await client.post(
+                '/api/profiles/benchuser/chat/', {'message': 'hi'}, content_type='application/json'
+            )
+            first = None
+            with in_flight:
+                async for part in response.streaming_content:
+                    if first is None and part:
+                        first = time.perf_counter() - started
+            return first
+
+        results = await asyncio.gather(*(one_stream() for _ in range(streams)))
+        ttft = [value for value in results if value is not None]
+        return time.perf_counter() - started, ttft, in_flight.peak
@@ -0,0 +1,118 @@
+"""
+Measure memory and time to ingest a large context file.
+
+"whole" reads the upload into memory, decodes and splits it in one go;
+"streaming" is ingest_context_file(). Both use the same chunker and overlap,
+and neither embeds the chunks for retrieval, so only reading, extracting and
+writing chunks is compared. A re-upload of the same bytes is timed too, which
+only hashes the file.
+
+    python manage.py bench_context_ingest --megabytes 20
+"""
+import hashlib
+import random
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db.models.signals import post_save
+from django.test import override_settings
+
+from users import retrieval
+from users.context_ingest import chunk_text, ingest_context_file
+from users.models import ContextChunk, ContextFile
+from users.signals import _context_file_saved
+
+from ._bench import make_profile, test_database
+
+
+WORDS = (
+    'shipped scaled designed migrated mentored platform latency queue cache index '
+    'résumé naïve café team customers revenue launch reliability'
+).split()
+
+
+def make_text(megabytes, seed=0):
+    rng = random.Random(seed)
+    paragraphs = []
+    size = 0
+    while size < megabytes * 1024 * 1024:
+        paragraph = ' '.join(rng.choice(WORDS) for _ in range(rng.randrange(40, 160))) + '.'
+        paragraphs.append(paragraph)
+        size += len(paragraph.encode()) + 2
+    return '\n\n'.join(paragraphs).encode()
+
+
+def ingest_whole(context_file):
+    """The naive path: everything in memory at once."""
+    with context_file.file.open('rb') as handle:
+        data = handle.read()
+    text = data.decode('utf-8-sig', 'replace')
+    # The same chunker as streaming, fed slices of the decoded text held in memory
+    block = settings.CONTEXT_READ_BLOCK
+    pieces = (text[start:start + block] for start in range(0, len(text), block))
+    chunks = [
+        ContextChunk(
+            context_file=context_file, profile_id=context_file.profile_id, ordinal=ordinal,
+            char_start=start, text=piece, content_hash=hashlib.sha256(piece.encode()).hexdigest(),
+        )
+        for ordinal, (start, piece) in enumerate(
+            chunk_text(pieces, settings.CONTEXT_CHUNK_CHARS, settings.CONTEXT_CHUNK_OVERLAP)
+        )
+    ]
+    ContextChunk.objects.bulk_create(chunks, batch_size=200)
+    return len(chunks)
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+class Command(BaseCommand):
+    help = 'Benchmark streaming context file ingestion.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--megabytes', type=int, default=20)
+
+    def handle(self, *args, **options):
+        data = make_text(options['megabytes'])
+        mb = len(data) / 1024 / 1024
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root, DEBUG=False), test_database(), \
+                mock.patch.object(retrieval, 'file_ingested'):
+            profile = make_profile('ingestbench')
+            # Ingest in the foreground here rather than on the pool
+            post_save.disconnect(sender=ContextFile, dispatch_uid='ContextFile-ingest')
+
+            def upload(title):
+                return ContextFile.objects.create(
+                    profile=profile, title=title, file_type='text/plain', size_bytes=len(data),
+                    file=ContentFile(data, name=f"{title}.txt"),
+                )
+
+            chunks, whole_time, whole_peak = measure(ingest_whole, upload('whole'))
+            ContextFile.objects.all().delete()
+            streamed, stream_time, stream_peak = measure(ingest_context_file, upload('streamed'))
+            duplicate, dup_time, dup_peak = measure(ingest_context_file, upload('again'))
+            post_save.connect(_context_file_saved, sender=ContextFile, dispatch_uid='ContextFile-ingest')
+            streamed_chunks = streamed.chunks.count()
+
+        self.stdout.write(
+            f"{mb:.1f}MB text file, {settings.CONTEXT_CHUNK_CHARS}-char chunks, "
+            f"{settings.CONTEXT_CHUNK_OVERLAP}-char overlap, no embedding"
+        )
+        self.stdout.write(f"whole      {whole_time:.2f}s  peak {whole_peak / 1024 / 1024:.1f}MB  {chunks} chunks")
+        self.stdout.write(
+            f"streaming  {stream_time:.2f}s  peak {stream_peak / 1024 / 1024:.1f}MB  {streamed_chunks} chunks"
+        )
+        self.stdout.write(f"re-upload  {dup_time:.2f}s  peak {dup_peak / 1024 / 1024:.1f}MB  status={duplicate.status}")
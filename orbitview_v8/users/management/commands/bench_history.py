@@ -0,0 +1,114 @@
+"""
+Compare OFFSET pages with the keyset pages of users/conversations.py, at the
+start, middle and end of one profile's conversations and of one long
+conversation's messages. The OFFSET conversation pages look up each row's
+last message with a subquery, as they would without the denormalized preview.
+
+    python manage.py bench_history --conversations 200000 --messages 1000000
+"""
+import datetime
+import random
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+from django.test import override_settings
+from django.utils import timezone
+
+from users.conversations import (
+    CONVERSATION_FIELDS, MESSAGE_FIELDS, encode_cursor, list_conversations, list_messages,
+)
+from users.models import Conversation, Message
+
+from ._bench import make_profile, summarize, test_database
+
+
+PAGE = 20
+
+
+def generate(profile, conversations, messages, batch_size=5000, seed=3):
+    rng = random.Random(seed)
+    start = timezone.now() - datetime.timedelta(days=365)
+    for offset in range(0, conversations, batch_size):
+        rows = [
+            Conversation(
+                id=uuid.UUID(int=rng.getrandbits(128)), profile=profile,
+                last_message_preview='Thanks, that helps', last_message_role='assistant',
+            )
+            for _ in range(min(batch_size, conversations - offset))
+        ]
+        Conversation.objects.bulk_create(rows)
+        # auto_now_add ignores the value given, so spread the start times afterwards
+        for i, row in enumerate(rows):
+            row.started_at = start + datetime.timedelta(seconds=(offset + i) * 10)
+        Conversation.objects.bulk_update(rows, ['started_at'])
+        # A couple of messages each, for the preview subquery to find
+        Message.objects.bulk_create(
+            Message(conversation=row, role=role, content='Thanks, that helps', timestamp=row.started_at)
+            for row in rows for role in ('user', 'assistant')
+        )
+    long = Conversation.objects.create(profile=profile)
+    for offset in range(0, messages, batch_size):
+        Message.objects.bulk_create(
+            Message(
+                conversation=long, role='user' if i % 2 else 'assistant', content=f"message {offset + i}",
+                timestamp=start + datetime.timedelta(milliseconds=(offset + i) * 10),
+            )
+            for i in range(min(batch_size, messages - offset))
+        )
+    return long
+
+
+class Command(BaseCommand):
+    help = 'Benchmark OFFSET against keyset pagination of conversations and messages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=100000)
+        parser.add_argument('--messages', type=int, default=1000000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--database', help='File for the sqlite test database.')
+
+    def handle(self, *args, **options):
+        with override_settings(DEBUG=False), test_database(name=options['database']):
+            profile = make_profile('historybench')
+            long = generate(profile, options['conversations'], options['messages'])
+
+            latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-timestamp')
+            conversations = Conversation.objects.filter(profile=profile).order_by('-started_at', 'id')
+            with_preview = conversations.annotate(
+                preview=Subquery(latest.values('content')[:1])
+            ).values('id', 'visitor_id', 'started_at', 'last_activity', 'preview')
+            messages = Message.objects.filter(conversation=long).order_by('timestamp', 'id')
+
+            total = options['conversations'] + 1
+            self.compare(
+                'conversations', total, options['repeat'], 'started_at',
+                lambda offset: list(with_preview[offset:offset + PAGE]),
+                conversations.values(*CONVERSATION_FIELDS),
+                lambda cursor: list_conversations(profile.id, cursor, PAGE),
+            )
+            self.compare(
+                'messages', options['messages'], options['repeat'], 'timestamp',
+                lambda offset: list(messages.values(*MESSAGE_FIELDS)[offset:offset + PAGE]),
+                messages.values(*MESSAGE_FIELDS),
+                lambda cursor: list_messages(long.pk, cursor, PAGE),
+            )
+
+    def compare(self, name, total, repeat, field, offset_page, rows, keyset_page):
+        for label, offset in (('first', 0), ('middle', total // 2), ('last', max(0, total - PAGE))):
+            # The cursor a client would hold after paging down to `offset`
+            cursor = None
+            if offset:
+                before = rows[offset - 1]
+                cursor = encode_cursor(before[field], before['id'])
+            timings = {'offset': [], 'keyset': []}
+            for _ in range(repeat):
+                started = time.perf_counter()
+                offset_page(offset)
+                timings['offset'].append(time.perf_counter() - started)
+                started = time.perf_counter()
+                keyset_page(cursor)
+                timings['keyset'].append(time.perf_counter() - started)
+            for kind, values in timings.items():
+                self.stdout.write(f"{name:>13} {label:>6} {kind:>6}: {summarize(values)}")
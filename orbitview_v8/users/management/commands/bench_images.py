@@ -0,0 +1,108 @@
+"""
+Measure image upload latency and served bytes with and without the pipeline.
+
+"inline" decodes the upload in the request to fill in width/height and serves
+the original; "pipeline" only stores the file and lets the post_save hook
+queue it, and pages then serve the IMAGE_DEFAULT_WIDTH variant.
+
+    python manage.py bench_images --uploads 20 --size 3000x2000
+"""
+import io
+import random
+import tempfile
+import time
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db.models.signals import post_save
+from django.test import override_settings
+from PIL import Image, ImageDraw
+
+from users.images import image_pipeline
+from users.models import Work, WorkImage
+from users.signals import _image_saved
+
+from ._bench import make_profile, summarize, test_database
+
+
+def make_photo(width, height, seed):
+    """A JPEG with gradients, shapes and EXIF, compressing roughly like a photo."""
+    rng = random.Random(seed)
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(200):
+        x, y = rng.randrange(width), rng.randrange(height)
+        radius = rng.randrange(10, width // 8)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=colour)
+    exif = Image.Exif()
+    exif[0x010F] = 'BenchCam'
+    exif[0x0112] = 1
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=92, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark image upload latency and served bytes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uploads', type=int, default=20)
+        parser.add_argument('--size', default='3000x2000')
+
+    def handle(self, *args, **options):
+        width, height = (int(v) for v in options['size'].split('x'))
+        photos = [make_photo(width, height, seed) for seed in range(options['uploads'])]
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root), test_database():
+            work = Work.objects.create(profile=make_profile('imagebench'), title='Photos', description='')
+            post_save.disconnect(sender=WorkImage, dispatch_uid='WorkImage-process')
+            try:
+                inline = self._inline(work, photos)
+            finally:
+                post_save.connect(_image_saved, sender=WorkImage, dispatch_uid='WorkImage-process')
+            queued, drained = self._pipelined(work, photos)
+            default = [
+                next(i for i in row.variants['items'] if i['url'] == row.url)
+                for row in WorkImage.objects.filter(work=work)
+            ]
+
+        original = sum(len(p) for p in photos) / len(photos)
+        self.stdout.write(f"{len(photos)} uploads of {width}x{height} JPEG, {image_pipeline.workers} workers")
+        self.stdout.write(f"inline decode   {summarize(inline)}")
+        self.stdout.write(f"pipeline        {summarize(queued)}  (all variants ready after {drained:.2f}s)")
+        self.stdout.write(
+            f"served bytes    original {original / 1024:.0f}KB -> "
+            f"{default[0]['width']}w {default[0]['format']} "
+            f"{sum(i['bytes'] for i in default) / len(default) / 1024:.0f}KB"
+        )
+
+    @staticmethod
+    def _upload(data, index):
+        return SimpleUploadedFile(f"photo{index}.jpg", data, content_type='image/jpeg')
+
+    def _inline(self, work, photos):
+        """The old path: the request decodes the upload to fill in its size."""
+        timings = []
+        for index, data in enumerate(photos):
+            started = time.perf_counter()
+            upload = self._upload(data, index)
+            with Image.open(upload) as image:
+                image.load()
+                size = image.size
+            upload.seek(0)
+            WorkImage.objects.create(work=work, image=upload, url='', width=size[0], height=size[1])
+            timings.append(time.perf_counter() - started)
+        WorkImage.objects.filter(work=work).delete()
+        return timings
+
+    def _pipelined(self, work, photos):
+        """The new path: the request stores the file, the post_save hook queues it."""
+        timings = []
+        started_all = time.perf_counter()
+        for index, data in enumerate(photos):
+            started = time.perf_counter()
+            WorkImage.objects.create(work=work, image=self._upload(data, index))
+            timings.append(time.perf_counter() - started)
+        image_pipeline.shutdown(wait=True)
+        return timings, time.perf_counter() - started_all
@@ -0,0 +1,62 @@
+"""
+Measure /api/auth/me/ throughput with DB-backed sessions and user lookups
+against the cached session engine, cached user backend and cached payload.
+
+    python manage.py bench_me --requests 2000
+"""
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+
+from ._bench import make_profile, test_database
+
+
+UNCACHED = {
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+    'AUTHENTICATION_BACKENDS': ['django.contrib.auth.backends.ModelBackend'],
+    'AUTH_CACHE_TTL': 0,
+}
+CACHED = {
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db',
+    'AUTHENTICATION_BACKENDS': ['users.auth_cache.CachedModelBackend'],
+    'AUTH_CACHE_TTL': 300,
+}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark requests/sec of the current-user endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with test_database(), override_settings(ALLOWED_HOSTS=['testserver']):
+            profile = make_profile('mebench')
+            for label, overrides in (('db sessions + lookups', UNCACHED), ('cached', CACHED)):
+                with override_settings(**overrides):
+                    cache.clear()
+                    self._run(label, profile.user, options['requests'])
+
+    def _run(self, label, user, requests):
+        client = Client()
+        client.force_login(user)
+        assert client.get('/api/auth/me/').status_code == 200
+
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            for _ in range(requests):
+                client.get('/api/auth/me/')
+            elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{label:<22} {requests / elapsed:8.0f} req/s  {queries / requests:.1f} queries/request"
+        )
@@ -0,0 +1,56 @@
+"""
+Compare per-row message saves with the write-behind MessageWriter.
+
+    python manage.py bench_message_writes --messages 20000 --conversations 200
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.models import Conversation, Message
+from users.write_behind import MessageWriter
+
+from ._bench import make_profile, test_database
+
+
+class Command(BaseCommand):
+    help = 'Benchmark chat message inserts/sec, per-row saves vs write-behind batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10000)
+        parser.add_argument('--conversations', type=int, default=100)
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        total = options['messages']
+        with test_database():
+            profile = make_profile('writebench')
+            conversations = Conversation.objects.bulk_create(
+                Conversation(profile=profile) for _ in range(options['conversations'])
+            )
+
+            started = time.perf_counter()
+            for i in range(total):
+                conversation = conversations[i % len(conversations)]
+                Message.objects.create(conversation=conversation, role='user', content=f"message {i}")
+                # What auto_now on last_activity costs when saved per message
+                conversation.save(update_fields=['last_activity'])
+            per_row = time.perf_counter() - started
+
+            writer = MessageWriter(batch_size=options['batch_size'], interval=0.05)
+            started = time.perf_counter()
+            for i in range(total):
+                writer.add_message(conversations[i % len(conversations)].pk, 'user', f"message {i}")
+            enqueued = time.perf_counter() - started
+            writer.close()
+            batched = time.perf_counter() - started
+
+            stored = Message.objects.count()
+
+        self.stdout.write(f"{total} messages over {len(conversations)} conversations")
+        self.stdout.write(f"per-row saves   {total / per_row:10.0f} msgs/s ({per_row:.2f}s)")
+        self.stdout.write(
+            f"write-behind    {total / batched:10.0f} msgs/s ({batched:.2f}s, "
+            f"{enqueued / total * 1e6:.1f}us on the request path)"
+        )
+        self.stdout.write(f"rows stored: {stored} (expected {2 * total})")
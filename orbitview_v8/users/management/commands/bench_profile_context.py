@@ -0,0 +1,108 @@
+"""
+Measure chat-turn prompt preparation on a profile with many works.
+
+Compares rendering the profile from the ORM on every turn (naively, and with
+prefetching) against reading the precompiled ProfileContext, and times the
+incremental rebuild after a single work changes.
+
+    python manage.py bench_profile_context --works 500
+"""
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from users import profile_context
+from users.models import Accomplishment, SocialLink, Work, WorkImage, WorkLink
+from users.tags import create_pending_tags
+
+from ._bench import make_profile, summarize, test_database
+
+
+class Command(BaseCommand):
+    help = 'Benchmark chat-turn profile context preparation.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--works', type=int, default=300)
+        parser.add_argument('--turns', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with test_database():
+            profile = make_profile('contextbench', skills='Python, Rust, Django')
+            self._populate(profile, options['works'])
+            profile_context.compile_profile_context(profile.pk)
+
+            rows = [
+                ('naive ORM render', lambda: self._naive_render(profile.pk)),
+                ('prefetched render', lambda: profile_context.compile_profile_context(profile.pk)),
+                ('compiled read', lambda: profile_context.get_profile_context(profile.pk)),
+            ]
+            self.stdout.write(f"profile with {options['works']} works, {options['turns']} turns")
+            for label, prepare in rows:
+                timings, queries = self._measure(prepare, options['turns'])
+                self.stdout.write(f"{label:20} queries/turn={queries:<5} {summarize(timings)}")
+
+            work = Work.objects.filter(profile=profile).first()
+
+            def touch_work():
+                work.impact = f"{time.perf_counter()}"
+                work.save()
+
+            timings, queries = self._measure(touch_work, options['turns'])
+            self.stdout.write(f"{'one-work rebuild':20} queries/save={queries:<5} {summarize(timings)}")
+
+    def _measure(self, fn, turns):
+        timings = []
+        queries = 0
+        for _ in range(turns):
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - started)
+            queries += len(captured)
+        return timings, queries // turns
+
+    def _naive_render(self, profile_id):
+        """What a view would do touching relations lazily on every turn."""
+        from users.models import OrbitViewProfile
+
+        profile = OrbitViewProfile.objects.get(pk=profile_id)
+        parts = [profile_context.render_profile(profile)[2]]
+        parts += [profile_context.render_work(w)[2] for w in profile.works.all()]
+        parts += [profile_context.render_accomplishment(a)[2] for a in profile.accomplishments.all()]
+        parts += [profile_context.render_social_link(s)[2] for s in profile.social_links.all()]
+        return '\n\n'.join(parts)
+
+    def _populate(self, profile, count):
+        works = Work.objects.bulk_create(
+            Work(
+                profile=profile,
+                title=f"Project {i}",
+                description=f"Built project {i} end to end with a small team. " * 3,
+                tags='AI/ML, hackathon',
+                tech_stack='Python, React',
+                impact=f"{i * 10}+ users",
+                display_order=i,
+                start_date=date(2020, 1, 1),
+            )
+            for i in range(count)
+        )
+        create_pending_tags(works, 'work_tags')
+        work_ids = [work.pk for work in works]
+        WorkImage.objects.bulk_create(
+            WorkImage(work_id=pk, image=f"work_images/{pk}.png", url=f"https://cdn.example.com/{pk}.png",
+                      alt='Screenshot')
+            for pk in work_ids
+        )
+        WorkLink.objects.bulk_create(
+            WorkLink(work_id=pk, title='Repo', url=f"https://github.com/example/{pk}") for pk in work_ids
+        )
+        Accomplishment.objects.bulk_create(
+            Accomplishment(profile=profile, title=f"Award {i}", issuer='Hackathon', description='Won',
+                           date=date(2023, 1, 1 + i % 28), type='award')
+            for i in range(count // 10)
+        )
+        SocialLink.objects.create(profile=profile, platform='github', url='https://github.com/example')
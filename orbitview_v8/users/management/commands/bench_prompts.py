@@ -0,0 +1,45 @@
+"""
+Measure building the profile answering system prompt: reading and
+substituting the template file on every turn, as the chat view used to,
+against rendering the template compiled at startup.
+
+    python manage.py bench_prompts --renders 100000
+"""
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.prompts import personality_values, prompt_registry
+
+
+class Command(BaseCommand):
+    help = 'Benchmark system prompt rendering.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--renders', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        renders = options['renders']
+        values = {
+            **personality_values({
+                'tone': 'friendly', 'personality_traits': ['curious', 'direct'],
+                'custom_instructions': 'Mention my newsletter when it fits.',
+            }),
+            'context': 'Name: Ada Lovelace\n' + 'Worked on the analytical engine. ' * 200,
+        }
+        template = prompt_registry.get('profile_answering')
+
+        started = time.perf_counter()
+        for _ in range(renders):
+            string.Template(template.path.read_text(encoding='utf-8').strip()).safe_substitute(values)
+        from_file = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(renders):
+            prompt_registry.render('profile_answering', values)
+        compiled = time.perf_counter() - started
+
+        self.stdout.write(f"template {template.name} v{template.version}, {len(template.render(values))} chars")
+        self.stdout.write(f"read + substitute per turn: {from_file / renders * 1e6:.1f}us each")
+        self.stdout.write(f"compiled at startup:        {compiled / renders * 1e6:.1f}us each")
@@ -0,0 +1,100 @@
+"""
+Measure retrieval recall and latency on synthetic profiles.
+
+Each profile gets N chunks of random text over a shared vocabulary. Every
+query is a few of the rarer words of one target chunk plus noise words, so
+recall@k is how often the target comes back in the top k, from the int8
+matrix searched in memory and from exact float32 scoring of the same vectors.
+
+    python manage.py bench_retrieval --sizes 10,1000,100000
+"""
+import random
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from users.embeddings import get_document_embedder
+from users.retrieval import index_snippets, retrieval_index
+
+from ._bench import make_profile, summarize, test_database
+
+
+def make_vocabulary(rng, size=20000):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return list({''.join(rng.choice(letters) for _ in range(rng.randrange(4, 10))) for _ in range(size)})
+
+
+def make_chunks(rng, vocabulary, count, words=120):
+    # Zipf-ish: a few common words everywhere, many rare ones that identify a chunk
+    weights = 1 / np.arange(1, len(vocabulary) + 1)
+    weights /= weights.sum()
+    picks = np.random.default_rng(rng.randrange(2**32)).choice(len(vocabulary), size=(count, words), p=weights)
+    return [' '.join(vocabulary[i] for i in row) for row in picks]
+
+
+def make_query(rng, vocabulary, rank, text, words=4, noise=2):
+    # Visitors ask about what is specific to a snippet: its rarer words
+    distinctive = sorted(set(text.split()), key=rank.__getitem__)[-words * 3:]
+    terms = rng.sample(distinctive, words) + rng.sample(vocabulary, noise)
+    rng.shuffle(terms)
+    return ' '.join(terms)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark retrieval recall and search latency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,1000,100000')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=settings.RETRIEVAL_TOP_K)
+
+    def handle(self, *args, **options):
+        rng = random.Random(7)
+        vocabulary = make_vocabulary(rng)
+        embedder = get_document_embedder()
+        k = options['k']
+        self.stdout.write(f"embedder {embedder.name}, k={k}, {options['queries']} queries per profile")
+        with override_settings(DEBUG=False), test_database():
+            for size in (int(s) for s in options['sizes'].split(',')):
+                self.run(rng, vocabulary, size, k, options['queries'])
+
+    def run(self, rng, vocabulary, size, k, queries):
+        profile = make_profile(f"retrieval{size}")
+        chunks = make_chunks(rng, vocabulary, size)
+
+        started = time.perf_counter()
+        index_snippets(profile.pk, ((f"chunk:{i}", text, None) for i, text in enumerate(chunks)))
+        indexed = time.perf_counter() - started
+
+        retrieval_index.clear()
+        started = time.perf_counter()
+        entry = retrieval_index.matrix(profile.pk)
+        loaded = time.perf_counter() - started
+
+        targets = [rng.randrange(size) for _ in range(queries)]
+        rank = {word: i for i, word in enumerate(vocabulary)}
+        questions = [make_query(rng, vocabulary, rank, chunks[t]) for t in targets]
+        exact = get_document_embedder().embed(chunks)
+        timings, found, found_exact = [], 0, 0
+        for target, question in zip(targets, questions):
+            started = time.perf_counter()
+            hits = retrieval_index.search(profile.pk, question, k)
+            timings.append(time.perf_counter() - started)
+            found += f"chunk:{target}" in [key for _, key, _ in hits]
+            scores = exact @ get_document_embedder().embed([question])[0]
+            found_exact += target in np.argsort(-scores)[:k]
+
+        prompt_chars = sum(len(text) for text in chunks)
+        retrieved_chars = k * sum(len(text) for text in chunks) / size if size > k else prompt_chars
+        self.stdout.write(
+            f"{size:>7} chunks  index {indexed:.2f}s ({size / indexed:,.0f}/s)  "
+            f"load {loaded * 1000:.1f}ms  matrix {(entry.vectors.nbytes + entry.scales.nbytes) / 1024 / 1024:.2f}MB"
+        )
+        self.stdout.write(f"          search {summarize(timings)}")
+        self.stdout.write(
+            f"          recall@{k} {found / queries:.3f} (float32 {found_exact / queries:.3f})  "
+            f"prompt {prompt_chars:,} -> {retrieved_chars:,.0f} chars"
+        )
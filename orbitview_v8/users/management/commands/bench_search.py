@@ -0,0 +1,140 @@
+"""
+Measure profile search latency on generated profiles.
+
+Profiles get a byline, about text, skills and a work with a tech stack drawn
+from Zipf-distributed vocabularies, so some words and skills are on a large
+share of profiles and most are rare. The index is built with rebuild_index(),
+then each query mix is run against it:
+
+    python manage.py bench_search --profiles 1000000 --database /tmp/bench_search.sqlite3
+
+Big runs want a file-backed database (--database); the default is in memory.
+"""
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from users.models import OrbitViewProfile, User, Work
+from users.search import rebuild_index, search
+from users.tags import create_pending_tags
+
+from ._bench import summarize, test_database
+
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def make_vocabulary(rng, size, length=(4, 10)):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(LETTERS) for _ in range(rng.randrange(*length))))
+    return sorted(words)
+
+
+class Zipf:
+    def __init__(self, items, seed):
+        self.items = items
+        weights = 1 / np.arange(1, len(items) + 1)
+        self.p = weights / weights.sum()
+        self.rng = np.random.default_rng(seed)
+
+    def sample(self, shape):
+        return self.rng.choice(len(self.items), size=shape, p=self.p)
+
+
+def generate(count, batch_size=5000, seed=11):
+    rng = random.Random(seed)
+    words = Zipf(make_vocabulary(rng, 30000), seed)
+    skills = Zipf(make_vocabulary(rng, 400, (3, 9)), seed + 1)
+    techs = Zipf(make_vocabulary(rng, 150, (2, 8)), seed + 2)
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        about = words.sample((size, 40))
+        byline = words.sample((size, 6))
+        skill_picks = skills.sample((size, 5))
+        tech_picks = techs.sample((size, 3))
+        users, profiles, works = [], [], []
+        for i in range(size):
+            n = start + i
+            user = User(email=f"user{n}@example.com", username=f"user{n}", first_name='Bench', last_name=str(n))
+            users.append(user)
+            profile = OrbitViewProfile(
+                user=user,
+                username=f"user{n}",
+                first_name='Bench',
+                last_name=str(n),
+                byline=' '.join(words.items[w] for w in byline[i]),
+                about=' '.join(words.items[w] for w in about[i]),
+                nicknames='',
+                skills=', '.join(skills.items[s] for s in skill_picks[i][:rng.randrange(2, 6)]),
+                values='',
+                is_public=rng.random() < 0.9,
+                profile_completion=rng.randrange(0, 101),
+                total_views=int(rng.paretovariate(1.2)) - 1,
+            )
+            profiles.append(profile)
+            works.append(Work(
+                profile=profile,
+                title='Project',
+                description='',
+                tags='',
+                tech_stack=', '.join(techs.items[t] for t in tech_picks[i]),
+            ))
+        User.objects.bulk_create(users)
+        OrbitViewProfile.objects.bulk_create(profiles)
+        Work.objects.bulk_create(works)
+        create_pending_tags(profiles, 'profile_tags')
+        create_pending_tags(works, 'work_tags')
+    return words.items, skills.items, techs.items
+
+
+class Command(BaseCommand):
+    help = 'Benchmark profile search latency on generated profiles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--database', help='File for the sqlite test database.')
+
+    def handle(self, *args, **options):
+        with override_settings(DEBUG=False), test_database(name=options['database']):
+            started = time.perf_counter()
+            words, skills, techs = generate(options['profiles'])
+            self.stdout.write(f"generated {options['profiles']} profiles in {time.perf_counter() - started:.0f}s")
+            started = time.perf_counter()
+            indexed = rebuild_index(batch_size=2000)
+            self.stdout.write(f"indexed {indexed} public profiles in {time.perf_counter() - started:.0f}s")
+            self.run_queries(words, skills, techs, options['queries'])
+
+    def run_queries(self, words, skills, techs, count):
+        rng = random.Random(3)
+        # Common words are near the front of the Zipf vocabularies, rare ones further back
+        common = lambda items: items[rng.randrange(min(20, len(items)))]
+        rare = lambda items: items[rng.randrange(len(items) // 10, len(items))]
+        mixes = {
+            'browse': lambda: ('', {}),
+            'common word': lambda: (common(words), {}),
+            'rare word': lambda: (rare(words), {}),
+            'two words': lambda: (f"{common(words)} {rare(words)}", {}),
+            'three common words': lambda: (' '.join(common(words) for _ in range(3)), {}),
+            'skill filter': lambda: ('', {'skill': [common(skills)]}),
+            'word + skill + tech': lambda: (common(words), {'skill': [common(skills)], 'tech': [common(techs)]}),
+        }
+        search('warm up')
+        for name, make in mixes.items():
+            timings, pages, estimated = [], [], 0
+            for _ in range(count):
+                query, filters = make()
+                started = time.perf_counter()
+                result = search(query, filters)
+                timings.append(time.perf_counter() - started)
+                estimated += result['estimated']
+                if result['next_cursor']:
+                    started = time.perf_counter()
+                    search(query, filters, cursor=result['next_cursor'])
+                    pages.append(time.perf_counter() - started)
+            self.stdout.write(f"{name:>20}: {summarize(timings)}  ({estimated}/{count} estimated)")
+            self.stdout.write(f"{'next page':>20}: {summarize(pages)}")
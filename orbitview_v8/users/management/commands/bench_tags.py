@@ -0,0 +1,111 @@
+"""
+Measure "profiles with skill X" / "profiles using tech X" before and after
+the tag tables.
+
+The test database is migrated back to just before 0012_tags, profiles and
+works are generated with the old comma-separated columns, and the old query
+(an icontains scan) is timed. The database is then migrated forward, which
+runs the data migration over the generated rows, and the same lookups are
+timed through tagged() and tag_count(). Each lookup reads a first page of 20
+usernames in primary key order and the total, as a filtered listing would.
+
+    python manage.py bench_tags --profiles 100000
+"""
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import override_settings
+
+from users.models import OrbitViewProfile
+from users.tags import tag_count, tagged
+
+from ._bench import summarize, test_database
+from .bench_search import Zipf, make_vocabulary
+
+
+BEFORE = ('users', '0011_profile_search')
+
+
+def migrate(target=None):
+    """Migrate the users app to `target`, or to its latest migration."""
+    executor = MigrationExecutor(connection)
+    executor.loader.build_graph()
+    target = target or executor.loader.graph.leaf_nodes('users')[0]
+    executor.migrate([target])
+    return executor.loader.project_state(target).apps
+
+
+def generate(apps, count, batch_size=5000, seed=5):
+    User = apps.get_model('users', 'User')
+    Profile = apps.get_model('users', 'OrbitViewProfile')
+    Work = apps.get_model('users', 'Work')
+    rng = random.Random(seed)
+    skills = Zipf(make_vocabulary(rng, 2000, (3, 10)), seed)
+    techs = Zipf(make_vocabulary(rng, 500, (2, 8)), seed + 1)
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        skill_picks = skills.sample((size, 6))
+        tech_picks = techs.sample((size, 4))
+        users = [User(email=f"tags{start + i}@example.com", username=f"tags{start + i}") for i in range(size)]
+        profiles = [
+            Profile(
+                user=user, username=user.username, first_name='Tag', last_name='Bench', byline='', about='',
+                nicknames='', values='', skills=', '.join(skills.items[s] for s in skill_picks[i]),
+            )
+            for i, user in enumerate(users)
+        ]
+        works = [
+            Work(profile=profile, title='Work', description='', tech_stack=str([techs.items[t] for t in tech_picks[i]]))
+            for i, profile in enumerate(profiles)
+        ]
+        User.objects.bulk_create(users)
+        Profile.objects.bulk_create(profiles)
+        Work.objects.bulk_create(works)
+    return skills.items, techs.items
+
+
+class Command(BaseCommand):
+    help = 'Benchmark tag-filter queries on comma-separated text and on the tag tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, default=100000)
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--database', help='File for the sqlite test database.')
+
+    def handle(self, *args, **options):
+        with override_settings(DEBUG=False), test_database(name=options['database']):
+            apps = migrate(BEFORE)
+            skills, techs = generate(apps, options['profiles'])
+            rng = random.Random(9)
+            # Half common values, half from the long tail
+            pick = lambda items, i: items[rng.randrange(10)] if i % 2 else items[rng.randrange(len(items))]
+            skill_picks = [pick(skills, i) for i in range(options['queries'])]
+            tech_picks = [pick(techs, i) for i in range(options['queries'])]
+
+            Profile = apps.get_model('users', 'OrbitViewProfile')
+            Work = apps.get_model('users', 'Work')
+            with_skill = lambda v: Profile.objects.filter(skills__icontains=v)
+            with_tech = lambda v: Profile.objects.filter(
+                pk__in=Work.objects.filter(tech_stack__icontains=v).values('profile_id')
+            )
+            self.report('text skill', skill_picks, lambda v: with_skill(v).order_by('pk'), lambda v: with_skill(v).count())
+            self.report('text tech', tech_picks, lambda v: with_tech(v).order_by('pk'), lambda v: with_tech(v).count())
+
+            started = time.perf_counter()
+            migrate()
+            self.stdout.write(f"data migration: {time.perf_counter() - started:.1f}s")
+            profiles = OrbitViewProfile.objects.all()
+            self.report('tag skill', skill_picks, lambda v: tagged(profiles, 'skill', v), lambda v: tag_count('skill', v))
+            self.report('tag tech', tech_picks, lambda v: tagged(profiles, 'tech', v), lambda v: tag_count('tech', v))
+
+    def report(self, name, values, page, count):
+        timings, found = [], 0
+        for value in values:
+            started = time.perf_counter()
+            list(page(value).values_list('username', flat=True)[:20])
+            found += count(value)
+            timings.append(time.perf_counter() - started)
+        self.stdout.write(f"{name:>12}: {summarize(timings)}  ({found / len(values):.0f} profiles per value)")
@@ -0,0 +1,85 @@
+"""
+Measure username allocation as collisions on a popular name pile up.
+
+Compares the old probe loop (one exists() query per taken suffix) with the
+sequence-backed allocator at growing numbers of existing 'johnsmith's.
+
+    python manage.py bench_usernames --collisions 10000
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from users.models import User, UsernameSequence
+from users.usernames import allocate_username
+
+from ._bench import test_database
+
+
+BASE = 'johnsmith'
+
+
+def probe_loop(base):
+    username = base
+    counter = 1
+    while User.objects.filter(username=username).exists():
+        username = f"{base}{counter}"
+        counter += 1
+    return username
+
+
+class Command(BaseCommand):
+    help = 'Benchmark unique username allocation against many existing collisions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collisions', type=int, default=10000)
+        parser.add_argument('--allocations', type=int, default=100)
+
+    def handle(self, *args, **options):
+        with test_database():
+            existing = 0
+            for target in self._steps(options['collisions']):
+                User.objects.bulk_create(
+                    User(
+                        username=f"{BASE}{i}" if i else BASE,
+                        email=f"{BASE}{i}@example.com",
+                    )
+                    for i in range(existing, target)
+                )
+                existing = target
+                self._measure(target, options['allocations'])
+
+    @staticmethod
+    def _steps(collisions):
+        steps = [n for n in (10, 100, 1000) if n < collisions]
+        return steps + [collisions]
+
+    def _measure(self, existing, allocations):
+        probe, probe_queries = self._timed(lambda: probe_loop(BASE))
+        # Forget the sequence so the first allocation pays for seeding it
+        UsernameSequence.objects.filter(scope='user', base=BASE).delete()
+        seeded, seed_queries = self._timed(lambda: allocate_username('user', BASE))
+        allocated, allocate_queries = self._timed(
+            lambda: [allocate_username('user', BASE) for _ in range(allocations)]
+        )
+        self.stdout.write(
+            f"{existing:>6} taken | probe loop {probe * 1000:8.1f}ms {probe_queries:>6} queries"
+            f" | first allocation {seeded * 1000:5.2f}ms {seed_queries} queries"
+            f" | next allocations {allocated / allocations * 1000:5.2f}ms"
+            f" {allocate_queries / allocations:.0f} queries"
+        )
+
+    @staticmethod
+    def _timed(func):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            func()
+            return time.perf_counter() - started, queries
@@ -0,0 +1,25 @@
+"""
+Build or refresh the retrieval vectors of profiles, e.g. after deploying or
+after changing EMBEDDING_MODEL. Unchanged snippets are not re-embedded.
+
+    python manage.py build_retrieval_index [--profile USERNAME]
+"""
+from django.core.management.base import BaseCommand
+
+from users.models import OrbitViewProfile
+from users.retrieval import index_profile
+
+
+class Command(BaseCommand):
+    help = 'Embed the retrievable snippets of every profile (or one) and drop stale ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', help='Username of a single profile.')
+
+    def handle(self, *args, **options):
+        profiles = OrbitViewProfile.objects.order_by('username')
+        if options['profile']:
+            profiles = profiles.filter(username=options['profile'])
+        for profile_id, username in profiles.values_list('id', 'username').iterator():
+            embedded, removed = index_profile(profile_id)
+            self.stdout.write(f"{username}: {embedded} embedded, {removed} removed")
@@ -0,0 +1,30 @@
+"""
+Extract and chunk context files the background ingestion hasn't got to.
+
+    python manage.py ingest_context_files [--all]
+"""
+from django.core.management.base import BaseCommand
+
+from users.context_ingest import ingest_context_file, needs_ingestion
+from users.models import ContextFile
+
+
+class Command(BaseCommand):
+    help = 'Ingest context files whose chunks are missing or out of date.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-ingest every file.')
+
+    def handle(self, *args, **options):
+        counts = {}
+        for context_file in ContextFile.objects.exclude(file='').order_by('uploaded_at').iterator():
+            if not (options['all'] or needs_ingestion(context_file)):
+                continue
+            try:
+                status = ingest_context_file(context_file).status
+            except Exception as exc:
+                status = 'failed'
+                self.stderr.write(f"{context_file.pk}: {exc}")
+            counts[status] = counts.get(status, 0) + 1
+        summary = ', '.join(f"{count} {status}" for status, count in sorted(counts.items()))
+        self.stdout.write(f"Context files: {summary or 'nothing to do'}")
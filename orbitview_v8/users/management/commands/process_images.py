@@ -0,0 +1,31 @@
+"""
+Make the resized variants of images the background pipeline hasn't processed.
+
+    python manage.py process_images [--all]
+"""
+from django.core.management.base import BaseCommand
+
+from users.images import needs_processing, process_image
+from users.models import ProfileImage, WorkImage
+
+
+class Command(BaseCommand):
+    help = 'Process profile and work images whose variants are missing or out of date.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Reprocess every image.')
+
+    def handle(self, *args, **options):
+        for model in (ProfileImage, WorkImage):
+            done = failed = 0
+            for row in model.objects.exclude(image='').iterator():
+                if not (options['all'] or needs_processing(row)):
+                    continue
+                try:
+                    # None when the image was replaced meanwhile; its new file has its own job
+                    if process_image(row) is not None:
+                        done += 1
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f"{model.__name__} {row.pk}: {exc}")
+            self.stdout.write(f"{model.__name__}: {done} processed, {failed} failed")
@@ -0,0 +1,33 @@
+"""
+Bring the profile search index up to date in place, e.g. after deploying it
+or to refresh ranks, which move with views without going through the signals.
+Search keeps answering from the index while it runs.
+
+    python manage.py rebuild_search_index [--profile USERNAME]
+"""
+from django.core.management.base import BaseCommand
+
+from users.models import OrbitViewProfile
+from users.search import index_profile, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Re-index every public profile for search (or just one).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', help='Username of a single profile.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['profile']:
+            profile_id = OrbitViewProfile.objects.filter(
+                username=options['profile']
+            ).values_list('id', flat=True).first()
+            if profile_id is None:
+                self.stderr.write(f"No profile {options['profile']}")
+                return
+            document = index_profile(profile_id)
+            self.stdout.write(f"{options['profile']}: {'indexed' if document else 'not public, removed'}")
+            return
+        count = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(f"Indexed {count} public profiles")
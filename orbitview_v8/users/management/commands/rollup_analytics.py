@@ -0,0 +1,54 @@
+"""
+Roll finished days of hourly profile analytics up into day rows and expire
+old hours (see users/analytics.py).
+
+Run it shortly after midnight UTC from cron, or keep it running:
+
+    python manage.py rollup_analytics --every 3600
+
+--days 7 catches up after the job has been down for a week.
+"""
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from users.analytics import expire_hours, rollup_day
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Roll hourly profile analytics up into days and expire old hours.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2, help='Finished days to (re)compute.')
+        parser.add_argument('--every', type=float, default=0, help='Keep running, once every this many seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                self.run_once(options['days'])
+            except Exception:
+                if not options['every']:
+                    raise
+                logger.exception('Rolling up analytics failed, will retry')
+            if not options['every']:
+                return
+            close_old_connections()
+            time.sleep(options['every'])
+
+    def run_once(self, days):
+        now = timezone.now()
+        today = now.astimezone(datetime.timezone.utc).date()
+        for back in range(days, 0, -1):
+            day = today - datetime.timedelta(days=back)
+            profiles = rollup_day(day)
+            self.stdout.write(f"{day}: {profiles} profiles")
+        expired = expire_hours(now - datetime.timedelta(days=settings.ANALYTICS_HOURLY_RETENTION_DAYS))
+        self.stdout.write(f"Expired {expired} hourly rows")
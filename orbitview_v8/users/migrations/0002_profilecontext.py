@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileContext',
+            fields=[
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='compiled_context', serialize=False, to='users.orbitviewprofile')),
+                ('sections', models.JSONField(default=dict, help_text="Rendered fragments keyed by source row, e.g. 'work:<id>' -> [sort key, text]")),
+                ('document', models.TextField(blank=True, default='')),
+                ('content_hash', models.CharField(blank=True, default='', max_length=64)),
+                ('compiled_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'profile_contexts',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_profilecontext'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='summary',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='summary_through',
+            field=models.DateTimeField(blank=True, help_text='Timestamp of the last message folded into the summary', null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_message_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(help_text="e.g. 'total_views'", max_length=50)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('value', models.BigIntegerField(default=0)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counter_shards', to='users.orbitviewprofile')),
+            ],
+            options={
+                'db_table': 'profile_counter_shards',
+                'unique_together': {('profile', 'field', 'shard')},
+            },
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:20
+
+import hashlib
+import re
+import zlib
+
+import numpy as np
+from django.db import migrations, models
+
+
+# users.popular_questions' fingerprint and MinHash as of this migration
+MINHASH_PERMUTATIONS = 64
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = np.random.RandomState(1729)
+_A = _rng.randint(1, 1 << 31, MINHASH_PERMUTATIONS).astype(np.uint64)
+_B = _rng.randint(0, 1 << 31, MINHASH_PERMUTATIONS).astype(np.uint64)
+
+
+def normalize_question(text):
+    text = re.sub(r"[^\w\s]", ' ', text.lower())
+    return re.sub(r"\s+", ' ', text).strip()
+
+
+def question_fingerprint(question):
+    return hashlib.sha1(normalize_question(question).encode()).hexdigest()
+
+
+def minhash_signature(question):
+    words = normalize_question(question).split()
+    shingles = set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+    if not shingles:
+        return [0] * MINHASH_PERMUTATIONS
+    hashes = np.array([zlib.crc32(s.encode()) for s in shingles], dtype=np.uint64)
+    permuted = (hashes[:, None] * _A[None, :] + _B[None, :]) % _MERSENNE_PRIME
+    return permuted.min(axis=0).tolist()
+
+
+def backfill_fingerprints(apps, schema_editor):
+    """Fingerprint existing rows and merge ones that only differed in wording noise."""
+    PopularQuestion = apps.get_model('users', 'PopularQuestion')
+    seen = {}
+    for row in PopularQuestion.objects.order_by('-count', 'first_asked').iterator():
+        key = (row.profile_id, question_fingerprint(row.question))
+        kept = seen.get(key)
+        if kept is None:
+            row.fingerprint = key[1]
+            row.signature = minhash_signature(row.question)
+            row.save(update_fields=['fingerprint', 'signature'])
+            seen[key] = row
+            continue
+        kept.count += row.count
+        kept.first_asked = min(kept.first_asked, row.first_asked)
+        kept.last_asked = max(kept.last_asked, row.last_asked)
+        PopularQuestion.objects.filter(pk=kept.pk).update(
+            count=kept.count, first_asked=kept.first_asked, last_asked=kept.last_asked
+        )
+        row.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_countershard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='popularquestion',
+            name='fingerprint',
+            field=models.CharField(default='', help_text='SHA-1 of the normalized question', max_length=40),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='popularquestion',
+            name='signature',
+            field=models.JSONField(default=list, help_text="MinHash of the question's word shingles"),
+        ),
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='popularquestion',
+            unique_together={('profile', 'fingerprint')},
+        ),
+    ]
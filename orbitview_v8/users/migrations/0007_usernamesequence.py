@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_popularquestion_clustering'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsernameSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('user', 'User username'), ('profile', 'Profile slug')], max_length=20)),
+                ('base', models.CharField(max_length=150)),
+                ('next_suffix', models.PositiveBigIntegerField(default=0, help_text='0 means the bare base is free')),
+            ],
+            options={
+                'db_table': 'username_sequences',
+                'unique_together': {('scope', 'base')},
+            },
+        ),
+    ]
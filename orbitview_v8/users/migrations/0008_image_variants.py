@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_usernamesequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profileimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, help_text="Resized copies made by users/images.py: {'source': name, 'items': [...]}"),
+        ),
+        migrations.AddField(
+            model_name='workimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, help_text="Resized copies made by users/images.py: {'source': name, 'items': [...]}"),
+        ),
+        migrations.AlterField(
+            model_name='profileimage',
+            name='url',
+            field=models.URLField(blank=True, default='', help_text='CDN URL, filled in by the image pipeline'),
+        ),
+        migrations.AlterField(
+            model_name='workimage',
+            name='url',
+            field=models.URLField(blank=True, default='', help_text='CDN URL, filled in by the image pipeline'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContextChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ordinal', models.PositiveIntegerField()),
+                ('char_start', models.PositiveBigIntegerField(help_text='Offset of the chunk in the extracted text')),
+                ('text', models.TextField()),
+                ('content_hash', models.CharField(help_text='SHA-256 of the chunk text', max_length=64)),
+            ],
+            options={
+                'db_table': 'context_chunks',
+                'ordering': ['context_file', 'ordinal'],
+            },
+        ),
+        migrations.AddField(
+            model_name='contextfile',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 of the file', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='contextfile',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, help_text='Earlier upload of the same file, whose chunks stand in for this one', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='users.contextfile'),
+        ),
+        migrations.AddField(
+            model_name='contextfile',
+            name='ingested_file',
+            field=models.CharField(blank=True, default='', help_text='File name the chunks were made from', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='contextfile',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('duplicate', 'Duplicate'), ('unsupported', 'Unsupported type'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='contextfile',
+            index=models.Index(fields=['profile', 'content_hash'], name='context_fil_profile_cf9cc9_idx'),
+        ),
+        migrations.AddField(
+            model_name='contextchunk',
+            name='context_file',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='users.contextfile'),
+        ),
+        migrations.AddField(
+            model_name='contextchunk',
+            name='profile',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='context_chunks', to='users.orbitviewprofile'),
+        ),
+        migrations.AddIndex(
+            model_name='contextchunk',
+            index=models.Index(fields=['profile', 'content_hash'], name='context_chu_profile_b6e1fc_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='contextchunk',
+            unique_together={('context_file', 'ordinal')},
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_context_chunks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetrievalVector',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text="Source of the snippet, e.g. 'work:<id>' or 'chunk:<id>'", max_length=100)),
+                ('text', models.TextField()),
+                ('vector', models.BinaryField(help_text='float16 unit vector')),
+                ('model', models.CharField(help_text='Embedder that made the vector', max_length=100)),
+                ('content_hash', models.CharField(help_text='SHA-256 of the embedded text', max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('chunk', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='users.contextchunk')),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retrieval_vectors', to='users.orbitviewprofile')),
+            ],
+            options={
+                'db_table': 'retrieval_vectors',
+                'unique_together': {('profile', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_retrieval_vectors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, unique=True)),
+                ('df', models.PositiveIntegerField(default=0, help_text='Number of indexed profiles containing the term')),
+            ],
+            options={
+                'db_table': 'search_terms',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.FloatField(default=0, help_text='Query-independent quality, for ties and browsing')),
+                ('facets', models.JSONField(default=dict, help_text="{'skill': [...], 'tech': [...]} for facet counts")),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='users.orbitviewprofile')),
+            ],
+            options={
+                'db_table': 'search_documents',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('pk', models.CompositePrimaryKey('term', 'document', blank=True, editable=False, primary_key=True, serialize=False)),
+                ('impact', models.PositiveSmallIntegerField(help_text='Field-weighted BM25 term frequency, 1-255')),
+                ('document', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='users.searchdocument')),
+                ('term', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='users.searchterm')),
+            ],
+            options={
+                'db_table': 'search_postings',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='searchdocument',
+            index=models.Index(fields=['-rank', 'id'], name='search_docu_rank_7eecad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchposting',
+            index=models.Index(fields=['term', '-impact', 'document'], name='search_post_term_impact'),
+        ),
+        migrations.AddIndex(
+            model_name='searchposting',
+            index=models.Index(fields=['document', 'term'], name='search_post_document'),
+        ),
+    ]
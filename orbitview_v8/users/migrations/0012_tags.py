@@ -0,0 +1,207 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Former text column -> tag kind
+PROFILE_FIELDS = {
+    'nicknames': 'nickname',
+    'skills': 'skill',
+    'values': 'value',
+    'looking_for_opportunities': 'opportunity',
+}
+WORK_FIELDS = {'tags': 'topic', 'tech_stack': 'tech'}
+BATCH_SIZE = 1000
+MAX_TAG_LENGTH = 100
+
+
+# users.tags.tag_slug() and split_tags() as of this migration
+def tag_slug(name):
+    return ' '.join(name.lower().split())[:MAX_TAG_LENGTH]
+
+
+def split_tags(value):
+    """Tag names from 'a, b' or "['a', 'b']", in order and without repeats of the same slug."""
+    if value is None:
+        return []
+    names = {}
+    for item in value.strip().strip('[]').split(','):
+        name = ' '.join(item.strip().strip('\'"').split())[:MAX_TAG_LENGTH]
+        if name:
+            names.setdefault(tag_slug(name), name)
+    return list(names.values())
+
+
+def _link_batch(Tag, Through, owner, kinds, rows, tag_ids):
+    links = [
+        (pk, kind, tag_slug(name), name, position)
+        for pk, *values in rows
+        for kind, value in zip(kinds, values)
+        for position, name in enumerate(split_tags(value))
+    ]
+    new = {}
+    for _, kind, slug, name, _ in links:
+        if (kind, slug) not in tag_ids:
+            new.setdefault((kind, slug), name)
+    if new:
+        Tag.objects.bulk_create([Tag(kind=kind, slug=slug, name=name) for (kind, slug), name in new.items()])
+        for kind in {kind for kind, _ in new}:
+            slugs = [slug for k, slug in new if k == kind]
+            tag_ids.update(
+                ((kind, slug), pk) for slug, pk in Tag.objects.filter(kind=kind, slug__in=slugs).values_list('slug', 'pk')
+            )
+    Through.objects.bulk_create([
+        Through(**{owner: pk, 'tag_id': tag_ids[kind, slug], 'position': position})
+        for pk, kind, slug, _, position in links
+    ])
+
+
+def _copy_to_tags(apps, model_name, through_name, owner, fields):
+    Model = apps.get_model('users', model_name)
+    Tag = apps.get_model('users', 'Tag')
+    Through = apps.get_model('users', through_name)
+    tag_ids = {}
+    batch = []
+    for row in Model.objects.order_by('pk').values_list('pk', *fields).iterator(chunk_size=BATCH_SIZE):
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            _link_batch(Tag, Through, owner, list(fields.values()), batch, tag_ids)
+            batch = []
+    if batch:
+        _link_batch(Tag, Through, owner, list(fields.values()), batch, tag_ids)
+
+
+def _roll_up_work_tags(apps):
+    """A profile's own topic and tech rows: its works' ones, in work order (as tags.sync_work_tags())."""
+    WorkTag = apps.get_model('users', 'WorkTag')
+    ProfileTag = apps.get_model('users', 'ProfileTag')
+    rows = WorkTag.objects.order_by('work__profile_id', 'work__display_order', 'work_id', 'position')
+    batch = []
+    current, seen = None, {}
+    for profile_id, tag_id in rows.values_list('work__profile_id', 'tag_id').iterator(chunk_size=BATCH_SIZE):
+        if profile_id != current:
+            batch += [ProfileTag(profile_id=current, tag_id=t, position=i) for i, t in enumerate(seen)]
+            current, seen = profile_id, {}
+            if len(batch) >= BATCH_SIZE:
+                ProfileTag.objects.bulk_create(batch)
+                batch = []
+        seen[tag_id] = None
+    batch += [ProfileTag(profile_id=current, tag_id=t, position=i) for i, t in enumerate(seen)]
+    ProfileTag.objects.bulk_create(batch)
+
+
+def _copy_to_text(apps, model_name, through_name, owner, fields):
+    Model = apps.get_model('users', model_name)
+    Through = apps.get_model('users', through_name)
+    kinds = {kind: field for field, kind in fields.items()}
+    texts = {}
+    # Leaving out the profiles' roll-up of their works' tags
+    links = Through.objects.filter(tag__kind__in=kinds).order_by(owner, 'position').values_list(
+        owner, 'tag__kind', 'tag__name'
+    )
+    for pk, kind, name in links.iterator(chunk_size=BATCH_SIZE):
+        texts.setdefault(pk, {}).setdefault(kinds[kind], []).append(name)
+    rows = []
+    for pk, values in texts.items():
+        rows.append(Model(pk=pk, **{field: ', '.join(names) for field, names in values.items()}))
+    Model.objects.bulk_update(rows, list(fields), batch_size=BATCH_SIZE)
+
+
+def split_text_columns(apps, schema_editor):
+    """Move each comma-separated column into tag rows."""
+    _copy_to_tags(apps, 'OrbitViewProfile', 'ProfileTag', 'profile_id', PROFILE_FIELDS)
+    _copy_to_tags(apps, 'Work', 'WorkTag', 'work_id', WORK_FIELDS)
+    _roll_up_work_tags(apps)
+
+
+def join_text_columns(apps, schema_editor):
+    _copy_to_text(apps, 'OrbitViewProfile', 'ProfileTag', 'profile_id', PROFILE_FIELDS)
+    _copy_to_text(apps, 'Work', 'WorkTag', 'work_id', WORK_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_profile_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('skill', 'Skill'), ('nickname', 'Nickname'), ('value', 'Value'), ('opportunity', 'Opportunity'), ('topic', 'Work topic'), ('tech', 'Technology')], max_length=20)),
+                ('name', models.CharField(help_text="As first entered, e.g. 'Node.js'", max_length=100)),
+                ('slug', models.CharField(help_text="Lowercase lookup key, e.g. 'node.js'", max_length=100)),
+            ],
+            options={
+                'db_table': 'tags',
+                'constraints': [models.UniqueConstraint(fields=('kind', 'slug'), name='unique_tag_kind_slug')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProfileTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('profile', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='profile_tags', to='users.orbitviewprofile')),
+                ('tag', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='profile_tags', to='users.tag')),
+            ],
+            options={
+                'db_table': 'profile_tags',
+                'indexes': [models.Index(fields=['tag', 'profile'], name='profile_tags_tag_profile')],
+                'constraints': [models.UniqueConstraint(fields=('profile', 'tag'), name='unique_profile_tag')],
+            },
+        ),
+        migrations.CreateModel(
+            name='WorkTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('tag', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='work_tags', to='users.tag')),
+                ('work', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='work_tags', to='users.work')),
+            ],
+            options={
+                'db_table': 'work_tags',
+                'indexes': [models.Index(fields=['tag', 'work'], name='work_tags_tag_work')],
+                'constraints': [models.UniqueConstraint(fields=('work', 'tag'), name='unique_work_tag')],
+            },
+        ),
+        migrations.RunPython(split_text_columns, join_text_columns),
+        # Defaults so that unapplying can add the required columns back to existing rows
+        migrations.AlterField(
+            model_name='orbitviewprofile',
+            name='nicknames',
+            field=models.TextField(default='', help_text='Comma-separated list of nicknames'),
+        ),
+        migrations.AlterField(
+            model_name='orbitviewprofile',
+            name='values',
+            field=models.TextField(default='', help_text="Core values like 'Move fast', 'Build in public'"),
+        ),
+        migrations.RemoveField(
+            model_name='orbitviewprofile',
+            name='looking_for_opportunities',
+        ),
+        migrations.RemoveField(
+            model_name='orbitviewprofile',
+            name='nicknames',
+        ),
+        migrations.RemoveField(
+            model_name='orbitviewprofile',
+            name='skills',
+        ),
+        migrations.RemoveField(
+            model_name='orbitviewprofile',
+            name='values',
+        ),
+        migrations.RemoveField(
+            model_name='work',
+            name='tags',
+        ),
+        migrations.RemoveField(
+            model_name='work',
+            name='tech_stack',
+        ),
+    ]
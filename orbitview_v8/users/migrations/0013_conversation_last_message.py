@@ -0,0 +1,56 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:40
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+BATCH_SIZE = 1000
+PREVIEW_CHARS = 200
+
+
+def message_preview(content):
+    """users.write_behind.message_preview() as of this migration."""
+    text = ' '.join(content.split())
+    return text if len(text) <= PREVIEW_CHARS else text[:PREVIEW_CHARS - 1] + '\u2026'
+
+
+def fill_last_message(apps, schema_editor):
+    """Preview the latest message of every existing conversation, a batch at a time."""
+    Conversation = apps.get_model('users', 'Conversation')
+    Message = apps.get_model('users', 'Message')
+    latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-timestamp', '-id')
+    batches = Conversation.objects.order_by('pk').annotate(
+        last_content=Subquery(latest.values('content')[:1]),
+        last_role=Subquery(latest.values('role')[:1]),
+    ).only('pk')
+    after = None
+    while True:
+        batch = list((batches.filter(pk__gt=after) if after else batches)[:BATCH_SIZE])
+        if not batch:
+            return
+        for conversation in batch:
+            conversation.last_message_preview = message_preview(conversation.last_content or '')
+            conversation.last_message_role = conversation.last_role or ''
+        Conversation.objects.bulk_update(batch, ['last_message_preview', 'last_message_role'])
+        after = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_role',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.RunPython(fill_last_message, migrations.RunPython.noop),
+    ]
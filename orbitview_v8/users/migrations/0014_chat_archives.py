@@ -0,0 +1,72 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_conversation_last_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedConversation',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('visitor_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('last_message_preview', models.CharField(blank=True, default='', max_length=200)),
+                ('last_message_role', models.CharField(blank=True, default='', max_length=10)),
+                ('message_count', models.IntegerField(default=0)),
+                ('started_at', models.DateTimeField()),
+                ('last_activity', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'archived_conversations',
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ChatArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month the conversations started in')),
+                ('file', models.FileField(max_length=255, upload_to='chat_archives/')),
+                ('compression', models.CharField(choices=[('zstd', 'Zstandard'), ('gzip', 'Gzip')], max_length=10)),
+                ('conversation_count', models.IntegerField(default=0)),
+                ('message_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'chat_archives',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['last_activity'], name='conversatio_last_ac_f87419_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedconversation',
+            name='profile',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_conversations', to='users.orbitviewprofile'),
+        ),
+        migrations.AddField(
+            model_name='chatarchive',
+            name='profile',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_archives', to='users.orbitviewprofile'),
+        ),
+        migrations.AddField(
+            model_name='archivedconversation',
+            name='archive',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='users.chatarchive'),
+        ),
+        migrations.AddIndex(
+            model_name='chatarchive',
+            index=models.Index(fields=['profile', 'month'], name='chat_archiv_profile_6a4256_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedconversation',
+            index=models.Index(fields=['profile', '-started_at'], name='archived_co_profile_30a1d5_idx'),
+        ),
+    ]
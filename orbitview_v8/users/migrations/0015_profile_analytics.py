@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_chat_archives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularQuestionDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('profile', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='question_days', to='users.orbitviewprofile')),
+                ('question', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='days', to='users.popularquestion')),
+            ],
+            options={
+                'db_table': 'popular_question_days',
+                'indexes': [models.Index(fields=['profile', 'day'], name='question_days_profile_day')],
+                'constraints': [models.UniqueConstraint(fields=('question', 'day'), name='unique_question_day')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProfileStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField(help_text='Start of the hour or (UTC) day')),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('conversations', models.PositiveIntegerField(default=0)),
+                ('questions', models.PositiveIntegerField(default=0)),
+                ('visitors', models.BinaryField(default=b'', help_text='HyperLogLog sketch of the visitors (see users/hll.py)')),
+                ('profile', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='users.orbitviewprofile')),
+            ],
+            options={
+                'db_table': 'profile_stats',
+                'indexes': [models.Index(fields=['period', 'start'], name='profile_stats_period_start')],
+                'constraints': [models.UniqueConstraint(fields=('profile', 'period', 'start'), name='unique_profile_stats_period')],
+            },
+        ),
+    ]
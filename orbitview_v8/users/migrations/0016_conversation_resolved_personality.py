@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0015_profile_analytics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='resolved_personality',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
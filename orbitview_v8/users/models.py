@@ -1,7 +1,9 @@
 from django.db import models
+from django.utils import timezone
 import uuid
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth.models import AbstractUser
+from .tags import tag_list
 
 
 class User(AbstractUser):
@@ -32,6 +34,33 @@ class User(AbstractUser):
     def full_name(self):
         return f"{self.first_name} {self.last_name}".strip()
 
+    def get_session_auth_hash(self):
+        # Users served by auth_cache.CachedModelBackend come without their
+        # password hash, carrying the session hash derived from it instead
+        if 'password' in self.get_deferred_fields() and hasattr(self, '_session_auth_hash'):
+            return self._session_auth_hash
+        return super().get_session_auth_hash()
+
+
+class UsernameSequence(models.Model):
+    """Next free numeric suffix for a username base, e.g. johnsmith -> johnsmith7"""
+
+    SCOPE_CHOICES = [
+        ('user', 'User username'),
+        ('profile', 'Profile slug'),
+    ]
+
+    scope = models.CharField(max_length=20, choices=SCOPE_CHOICES)
+    base = models.CharField(max_length=150)
+    next_suffix = models.PositiveBigIntegerField(default=0, help_text="0 means the bare base is free")
+
+    class Meta:
+        db_table = 'username_sequences'
+        unique_together = ['scope', 'base']
+
+    def __str__(self):
+        return f"{self.scope}:{self.base} -> {self.next_suffix}"
+
 
 
 class OrbitViewProfile(models.Model):
@@ -57,15 +86,12 @@ class OrbitViewProfile(models.Model):
         null=True,
         help_text="Bullet points like 'World-class Engineer'"
     )
-    nicknames = models.TextField(help_text="Comma-separated list of nicknames")
-    skills = models.TextField(
-        blank=True,
-        null=True,
-        help_text="Comma-separated skills"
-    )
+    # Normalized into ProfileTag rows; read and assigned as comma-separated text
+    nicknames = tag_list('nickname', 'profile_tags')
+    skills = tag_list('skill', 'profile_tags')
     
     # Values & Philosophy
-    values = models.TextField(help_text="Core values like 'Move fast', 'Build in public'")
+    values = tag_list('value', 'profile_tags')  # e.g. 'Move fast, Build in public'
     working_style = models.TextField(
         blank=True,
         null=True,
@@ -73,11 +99,7 @@ class OrbitViewProfile(models.Model):
     )
     
     # Looking For section
-    looking_for_opportunities = models.TextField(
-        blank=True,
-        null=True,
-        help_text="e.g., ['Co-founder', 'Internship']"
-    )
+    looking_for_opportunities = tag_list('opportunity', 'profile_tags')  # e.g. 'Co-founder, Internship'
     looking_for_ideal_role = models.CharField(max_length=200, blank=True, null=True)
     looking_for_deal_breakers = models.TextField(
         blank=True,
@@ -129,10 +151,15 @@ class ProfileImage(models.Model):
         related_name='profile_picture'
     )
     image = models.ImageField(upload_to='profile_pictures/')
-    url = models.URLField(help_text="CDN URL")
+    url = models.URLField(blank=True, default='', help_text="CDN URL, filled in by the image pipeline")
     alt = models.CharField(max_length=200, blank=True, null=True)
     width = models.IntegerField(blank=True, null=True)
     height = models.IntegerField(blank=True, null=True)
+    variants = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Resized copies made by users/images.py: {'source': name, 'items': [...]}"
+    )
     
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -169,18 +196,9 @@ class Work(models.Model):
     start_date = models.DateField(blank=True, null=True)
     end_date = models.DateField(blank=True, null=True)
     
-    # Categorization
-    tags = models.TextField(
-        blank=True,
-        null=True,
-        help_text="e.g., ['AI/ML', 'hackathon', 'climate-tech']"
-    )
-    tech_stack = models.TextField(
-        models.CharField(max_length=50),
-        blank=True,
-        null=True,
-        help_text="Technologies used: ['React', 'Python', 'OpenAI']"
-    )
+    # Categorization, normalized into WorkTag rows
+    tags = tag_list('topic', 'work_tags')  # e.g. 'AI/ML, hackathon, climate-tech'
+    tech_stack = tag_list('tech', 'work_tags')  # e.g. 'React, Python, OpenAI'
     
     # Impact
     impact = models.TextField(
@@ -214,10 +232,15 @@ class WorkImage(models.Model):
     work = models.ForeignKey(Work, on_delete=models.CASCADE, related_name='images')
     
     image = models.ImageField(upload_to='work_images/')
-    url = models.URLField(help_text="CDN URL")
+    url = models.URLField(blank=True, default='', help_text="CDN URL, filled in by the image pipeline")
     alt = models.CharField(max_length=200, blank=True, null=True)
     width = models.IntegerField(blank=True, null=True)
     height = models.IntegerField(blank=True, null=True)
+    variants = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Resized copies made by users/images.py: {'source': name, 'items': [...]}"
+    )
     
     is_cover = models.BooleanField(default=False)
     display_order = models.IntegerField(default=0)
@@ -343,21 +366,160 @@ class ContextFile(models.Model):
         related_name='context_files'
     )
     
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('duplicate', 'Duplicate'),
+        ('unsupported', 'Unsupported type'),
+        ('failed', 'Failed'),
+    ]
+    
     file = models.FileField(upload_to='context_files/')
     title = models.CharField(max_length=200)
     file_type = models.CharField(max_length=100, help_text="MIME type")
     size_bytes = models.BigIntegerField()
     
+    # Filled in by users/context_ingest.py
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    content_hash = models.CharField(max_length=64, blank=True, default='', help_text="SHA-256 of the file")
+    ingested_file = models.CharField(max_length=255, blank=True, default='', help_text="File name the chunks were made from")
+    duplicate_of = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='duplicates',
+        help_text="Earlier upload of the same file, whose chunks stand in for this one"
+    )
+    
     uploaded_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         db_table = 'context_files'
         ordering = ['-uploaded_at']
+        indexes = [
+            models.Index(fields=['profile', 'content_hash']),
+        ]
     
     def __str__(self):
         return f"{self.title} - {self.profile.username}"
 
 
+class ContextChunk(models.Model):
+    """Retrieval-sized piece of a context file's extracted text"""
+    
+    context_file = models.ForeignKey(
+        ContextFile,
+        on_delete=models.CASCADE,
+        related_name='chunks'
+    )
+    # Denormalized so a profile's chunks are read without joining its files
+    profile = models.ForeignKey(
+        OrbitViewProfile,
+        on_delete=models.CASCADE,
+        related_name='context_chunks'
+    )
+    
+    ordinal = models.PositiveIntegerField()
+    char_start = models.PositiveBigIntegerField(help_text="Offset of the chunk in the extracted text")
+    text = models.TextField()
+    content_hash = models.CharField(max_length=64, help_text="SHA-256 of the chunk text")
+    
+    class Meta:
+        db_table = 'context_chunks'
+        ordering = ['context_file', 'ordinal']
+        unique_together = ['context_file', 'ordinal']
+        indexes = [
+            models.Index(fields=['profile', 'content_hash']),
+        ]
+    
+    def __str__(self):
+        return f"{self.context_file_id} #{self.ordinal}"
+
+
+class RetrievalVector(models.Model):
+    """Embedding of one snippet of a profile, searched by users/retrieval.py"""
+    
+    profile = models.ForeignKey(
+        OrbitViewProfile,
+        on_delete=models.CASCADE,
+        related_name='retrieval_vectors'
+    )
+    key = models.CharField(max_length=100, help_text="Source of the snippet, e.g. 'work:<id>' or 'chunk:<id>'")
+    # Set for file chunks, so re-ingesting or deleting the file drops their vectors
+    chunk = models.ForeignKey(
+        ContextChunk,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    
+    text = models.TextField()
+    vector = models.BinaryField(help_text="float16 unit vector")
+    model = models.CharField(max_length=100, help_text="Embedder that made the vector")
+    content_hash = models.CharField(max_length=64, help_text="SHA-256 of the embedded text")
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'retrieval_vectors'
+        unique_together = ['profile', 'key']
+    
+    def __str__(self):
+        return f"{self.profile_id} {self.key}"
+
+
+# ==================== Compiled AI Context ====================
+
+class ProfileContext(models.Model):
+    """Prompt-ready description of a profile, compiled ahead of chat turns"""
+    
+    profile = models.OneToOneField(
+        OrbitViewProfile,
+        on_delete=models.CASCADE,
+        related_name='compiled_context',
+        primary_key=True
+    )
+    
+    sections = models.JSONField(
+        default=dict,
+        help_text="Rendered fragments keyed by source row, e.g. 'work:<id>' -> [sort key, text]"
+    )
+    document = models.TextField(blank=True, default='')
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    
+    compiled_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'profile_contexts'
+    
+    def __str__(self):
+        return f"Compiled context for {self.profile_id}"
+
+
+# ==================== Counter Shards ====================
+
+class CounterShard(models.Model):
+    """Part of a hot profile counter, folded back into the profile column periodically"""
+
+    profile = models.ForeignKey(
+        OrbitViewProfile,
+        on_delete=models.CASCADE,
+        related_name='counter_shards'
+    )
+    field = models.CharField(max_length=50, help_text="e.g. 'total_views'")
+    shard = models.PositiveSmallIntegerField()
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'profile_counter_shards'
+        unique_together = ['profile', 'field', 'shard']
+
+    def __str__(self):
+        return f"{self.field}[{self.shard}] of {self.profile_id}: {self.value}"
+
+
 # ==================== Privacy Settings ====================
 
 class PrivacySettings(models.Model):
@@ -502,6 +664,21 @@ class Conversation(models.Model):
         null=True
     )
     
+    # Rolling summary of the turns that no longer fit in the prompt
+    summary = models.TextField(blank=True, default='')
+    summary_through = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="Timestamp of the last message folded into the summary"
+    )
+    
+    # Profile personality merged with the overrides above, see personality.py
+    resolved_personality = models.JSONField(blank=True, null=True, editable=False)
+    
+    # Kept by the message writer so conversation lists don't look up each latest message
+    last_message_preview = models.CharField(max_length=200, blank=True, default='')
+    last_message_role = models.CharField(max_length=10, blank=True, default='')
+    
     started_at = models.DateTimeField(auto_now_add=True)
     last_activity = models.DateTimeField(auto_now=True)
     
@@ -511,6 +688,8 @@ class Conversation(models.Model):
         indexes = [
             models.Index(fields=['profile', '-started_at']),
             models.Index(fields=['visitor_id']),
+            # Idle conversations, for archiving
+            models.Index(fields=['last_activity']),
         ]
     
     def __str__(self):
@@ -534,7 +713,8 @@ class Message(models.Model):
     
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is produced, not when a batched write reaches the DB
+    timestamp = models.DateTimeField(default=timezone.now)
     
     class Meta:
         db_table = 'messages'
@@ -547,6 +727,73 @@ class Message(models.Model):
         return f"{self.role}: {self.content[:50]}..."
 
 
+class ChatArchive(models.Model):
+    """Compressed JSONL of archived conversations of one profile and month (see users/archive.py)"""
+    
+    COMPRESSION_CHOICES = [
+        ('zstd', 'Zstandard'),
+        ('gzip', 'Gzip'),
+    ]
+    
+    profile = models.ForeignKey(
+        OrbitViewProfile,
+        on_delete=models.CASCADE,
+        related_name='chat_archives'
+    )
+    month = models.DateField(help_text="First day of the month the conversations started in")
+    file = models.FileField(upload_to='chat_archives/', max_length=255)
+    compression = models.CharField(max_length=10, choices=COMPRESSION_CHOICES)
+    conversation_count = models.IntegerField(default=0)
+    message_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'chat_archives'
+        indexes = [
+            models.Index(fields=['profile', 'month']),
+        ]
+    
+    def __str__(self):
+        return f"Chat archive of {self.profile_id} for {self.month:%Y-%m}"
+
+
+class ArchivedConversation(models.Model):
+    """What the owner's conversation list shows of an archived conversation"""
+    
+    # The id the conversation had while live
+    id = models.UUIDField(primary_key=True, editable=False)
+    # Covered by the index below
+    profile = models.ForeignKey(
+        OrbitViewProfile,
+        on_delete=models.CASCADE,
+        related_name='archived_conversations',
+        db_index=False
+    )
+    archive = models.ForeignKey(
+        ChatArchive,
+        on_delete=models.CASCADE,
+        related_name='conversations'
+    )
+    
+    visitor_id = models.CharField(max_length=255, blank=True, null=True)
+    last_message_preview = models.CharField(max_length=200, blank=True, default='')
+    last_message_role = models.CharField(max_length=10, blank=True, default='')
+    message_count = models.IntegerField(default=0)
+    
+    started_at = models.DateTimeField()
+    last_activity = models.DateTimeField()
+    
+    class Meta:
+        db_table = 'archived_conversations'
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['profile', '-started_at']),
+        ]
+    
+    def __str__(self):
+        return f"Archived conversation {self.id}"
+
+
 # ==================== Analytics ====================
 
 class PopularQuestion(models.Model):
@@ -562,15 +809,209 @@ class PopularQuestion(models.Model):
     question = models.TextField()
     count = models.IntegerField(default=1)
     
+    # Clustering keys (see users/popular_questions.py)
+    fingerprint = models.CharField(max_length=40, help_text="SHA-1 of the normalized question")
+    signature = models.JSONField(default=list, help_text="MinHash of the question's word shingles")
+    
     first_asked = models.DateTimeField(auto_now_add=True)
     last_asked = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'popular_questions'
         ordering = ['-count']
+        unique_together = ['profile', 'fingerprint']
         indexes = [
             models.Index(fields=['profile', '-count']),
         ]
     
     def __str__(self):
-        return f"{self.question[:50]} ({self.count}x)"
\ No newline at end of file
+        return f"{self.question[:50]} ({self.count}x)"
+
+
+class PopularQuestionDay(models.Model):
+    """How often a popular question was asked on one day"""
+    
+    # Covered by the constraint below
+    question = models.ForeignKey(
+        PopularQuestion, on_delete=models.CASCADE, related_name='days', db_index=False
+    )
+    # The question's profile, so a profile's days are one index range; covered by the index below
+    profile = models.ForeignKey(
+        OrbitViewProfile, on_delete=models.CASCADE, related_name='question_days', db_index=False
+    )
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'popular_question_days'
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'day'], name='unique_question_day'),
+        ]
+        indexes = [
+            models.Index(fields=['profile', 'day'], name='question_days_profile_day'),
+        ]
+
+
+class ProfileStats(models.Model):
+    """Activity of a profile over one hour or day (see users/analytics.py)"""
+    
+    PERIOD_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+    
+    # Covered by the constraint below
+    profile = models.ForeignKey(
+        OrbitViewProfile, on_delete=models.CASCADE, related_name='stats', db_index=False
+    )
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    start = models.DateTimeField(help_text="Start of the hour or (UTC) day")
+    
+    views = models.PositiveIntegerField(default=0)
+    conversations = models.PositiveIntegerField(default=0)
+    questions = models.PositiveIntegerField(default=0)
+    visitors = models.BinaryField(default=b'', help_text="HyperLogLog sketch of the visitors (see users/hll.py)")
+    
+    class Meta:
+        db_table = 'profile_stats'
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'period', 'start'], name='unique_profile_stats_period'),
+        ]
+        indexes = [
+            # Hours due for rolling up or expiry
+            models.Index(fields=['period', 'start'], name='profile_stats_period_start'),
+        ]
+    
+    def __str__(self):
+        return f"{self.profile_id} {self.period} {self.start}"
+
+# ==================== Tags ====================
+
+class Tag(models.Model):
+    """A skill, nickname, value, opportunity, work topic or technology (see users/tags.py)"""
+    
+    KIND_CHOICES = [
+        ('skill', 'Skill'),
+        ('nickname', 'Nickname'),
+        ('value', 'Value'),
+        ('opportunity', 'Opportunity'),
+        ('topic', 'Work topic'),
+        ('tech', 'Technology'),
+    ]
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    name = models.CharField(max_length=100, help_text="As first entered, e.g. 'Node.js'")
+    slug = models.CharField(max_length=100, help_text="Lowercase lookup key, e.g. 'node.js'")
+    
+    class Meta:
+        db_table = 'tags'
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'slug'], name='unique_tag_kind_slug'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind}: {self.name}"
+
+
+class ProfileTag(models.Model):
+    """A tag of a profile at its position in that kind's list; topics and tech are its works' ones"""
+    
+    # Both covered by the constraint and index below
+    profile = models.ForeignKey(
+        OrbitViewProfile, on_delete=models.CASCADE, related_name='profile_tags', db_index=False
+    )
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='profile_tags', db_index=False)
+    position = models.PositiveSmallIntegerField(default=0)
+    
+    class Meta:
+        db_table = 'profile_tags'
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'tag'], name='unique_profile_tag'),
+        ]
+        indexes = [
+            # Profiles with a tag
+            models.Index(fields=['tag', 'profile'], name='profile_tags_tag_profile'),
+        ]
+    
+    def __str__(self):
+        return f"{self.profile_id}: {self.tag_id}"
+
+
+class WorkTag(models.Model):
+    """A topic or technology of a work, at its position in the work's list"""
+    
+    work = models.ForeignKey(Work, on_delete=models.CASCADE, related_name='work_tags', db_index=False)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='work_tags', db_index=False)
+    position = models.PositiveSmallIntegerField(default=0)
+    
+    class Meta:
+        db_table = 'work_tags'
+        constraints = [
+            models.UniqueConstraint(fields=['work', 'tag'], name='unique_work_tag'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'work'], name='work_tags_tag_work'),
+        ]
+    
+    def __str__(self):
+        return f"{self.work_id}: {self.tag_id}"
+
+# ==================== Profile Search ====================
+
+class SearchTerm(models.Model):
+    """A word or facet value ('skill:python') of the profile search index"""
+    
+    term = models.CharField(max_length=100, unique=True)
+    df = models.PositiveIntegerField(default=0, help_text="Number of indexed profiles containing the term")
+    
+    class Meta:
+        db_table = 'search_terms'
+    
+    def __str__(self):
+        return f"{self.term} ({self.df})"
+
+
+class SearchDocument(models.Model):
+    """A public profile as indexed by users/search.py"""
+    
+    profile = models.OneToOneField(
+        OrbitViewProfile,
+        on_delete=models.CASCADE,
+        related_name='search_document'
+    )
+    rank = models.FloatField(default=0, help_text="Query-independent quality, for ties and browsing")
+    facets = models.JSONField(default=dict, help_text="{'skill': [...], 'tech': [...]} for facet counts")
+    
+    indexed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'search_documents'
+        indexes = [
+            models.Index(fields=['-rank', 'id']),
+        ]
+    
+    def __str__(self):
+        return f"Search document of {self.profile_id}"
+
+
+class SearchPosting(models.Model):
+    """Occurrence of a term in a document, with its precomputed weight"""
+    
+    pk = models.CompositePrimaryKey('term', 'document')
+    # Both covered by the indexes below
+    term = models.ForeignKey(SearchTerm, on_delete=models.CASCADE, related_name='+', db_index=False)
+    document = models.ForeignKey(
+        SearchDocument, on_delete=models.CASCADE, related_name='postings', db_index=False
+    )
+    impact = models.PositiveSmallIntegerField(help_text="Field-weighted BM25 term frequency, 1-255")
+    
+    class Meta:
+        db_table = 'search_postings'
+        indexes = [
+            # Best documents for a term first, for the top-k scan
+            models.Index(fields=['term', '-impact', 'document'], name='search_post_term_impact'),
+            models.Index(fields=['document', 'term'], name='search_post_document'),
+        ]
+    
+    def __str__(self):
+        return f"{self.term_id} in {self.document_id}: {self.impact}"
@@ -1,12 +1,15 @@
-from groq import Groq
 from decouple import config
 
+from users.llm import LLMGateway
+from users.tokens import context_window, count_tokens, fit_messages, load_encoding
+
 groq_api_key = config("GROQ_API_KEY")
 
 if not groq_api_key:
     raise ValueError("Missing GROQ_API_KEY environment variable")
 
-client = Groq(api_key=groq_api_key)
+gateway = LLMGateway(api_key=groq_api_key)
+load_encoding()
 
 models = [
     'groq/compound-mini',
@@ -29,6 +32,9 @@ models = [
 current_model = models[-3]  # "openai/gpt-oss-20b"
 print("Using model:", current_model, "\n")
 
+# Past turns resent with each message are capped at this many tokens
+HISTORY_TOKEN_BUDGET = min(4000, context_window(current_model) // 2)
+
 conversation = []
 convo_over = False
 
@@ -40,29 +46,28 @@ while not convo_over:
         convo_over = True
         break
 
+    # Build the message list for the API call from the newest turns that fit
+    messages_for_llm, dropped = fit_messages(
+        [{"role": "system", "content": "You are a helpful assistant."}],
+        conversation,
+        message,
+        HISTORY_TOKEN_BUDGET,
+    )
+
     # Add user message to conversation history
     conversation.append({"role": "user", "content": message})
 
-    # Build the message list for the API call
-    messages_for_llm = [
-        {"role": "system", "content": "You are a helpful assistant."},
-    ] + conversation
-
-    print("Conversation size: " + str(len(str(conversation))))
+    prompt_tokens = sum(count_tokens(m["content"]) for m in messages_for_llm)
+    print(f"Prompt tokens: {prompt_tokens} ({dropped} older messages left out)")
 
     print("ASSISTANT:")
 
     # Stream the response
-    completion = client.chat.completions.create(
-        model=current_model,
-        messages=messages_for_llm,
-        stream=True
-    )
+    completion = gateway.stream_chat_sync(current_model, messages_for_llm)
 
     assistant_message = ""
 
-    for chunk in completion:
-        delta = chunk.choices[0].delta.content or ""
+    for delta in completion:
         print(delta, end="", flush=True)
         assistant_message += delta
 
@@ -0,0 +1,87 @@
+"""
+Full-response cache of public profile pages.
+
+Rendered pages are stored under the username together with the profile
+version they were rendered at, their ETag and when they were rendered. A
+request is answered from the cache only while the profile's version stamp
+(see profile_version.py) still matches, so any save to the profile or one of
+its rows retires the page at once; PAGE_CACHE_TTL only bounds how stale the
+view counts and popular questions on it may get.
+
+Only pages anyone may see are cached: private, unlisted and password
+protected profiles are always rendered per request and marked `private,
+no-store` for shared caches too.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+from .models import OrbitViewProfile
+from .profile_version import profile_version
+
+
+def _key(username):
+    return f"profile-page:{username}"
+
+
+def is_cacheable(visibility, privacy):
+    return visibility == 'public' and not (privacy is not None and privacy.password_protected)
+
+
+def lookup(username):
+    """
+    (page, profile_id, version) for a username. `page` is the cached page when
+    it is still current; otherwise it is None and `version` is the stamp to
+    store the re-rendered page under, read before the profile is loaded so a
+    change committed meanwhile leaves the new entry stale rather than wrong.
+    """
+    page = cache.get(_key(username))
+    if page is not None:
+        profile_id = page['profile_id']
+    else:
+        profile_id = OrbitViewProfile.objects.filter(username=username).values_list('pk', flat=True).first()
+        if profile_id is None:
+            return None, None, None
+    version = profile_version(profile_id)
+    if page is not None and page['version'] == version:
+        return page, profile_id, version
+    return None, profile_id, version
+
+
+def store_page(profile, version, body, rendered_at):
+    page = {
+        'profile_id': profile.pk,
+        'user_id': profile.user_id,
+        'version': version,
+        'body': body,
+        'etag': quote_etag(hashlib.sha256(body).hexdigest()[:32]),
+        'last_modified': int(rendered_at.timestamp()),
+    }
+    cache.set(_key(profile.username), page, settings.PAGE_CACHE_TTL)
+    return page
+
+
+def not_modified(request, etag, last_modified):
+    """Whether a conditional GET can be answered with 304 (RFC 9110 precedence)."""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def page_response(request, page):
+    """A 200 or 304 for a cached page, with validators for shared caches."""
+    if not_modified(request, page['etag'], page['last_modified']):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(page['body'], content_type='application/json')
+    response['ETag'] = page['etag']
+    response['Last-Modified'] = http_date(page['last_modified'])
+    # Shared caches may keep the page but must ask again, so every view is counted
+    response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    return response
@@ -0,0 +1,74 @@
+"""
+Effective AI personality of a conversation.
+
+A profile's AIPersonality merged with the conversation's overrides, the
+placeholder values it fills into the answering prompt, the max_tokens its
+response length allows and the fingerprint cached answers are keyed by.
+It is resolved when a conversation starts and stored on
+Conversation.resolved_personality; later turns reuse it while its stamp
+matches, that is while the profile version (bumped by every AIPersonality
+save, see profile_version.py), the overrides and the prompt template are
+the ones it was resolved from. Changing any of them re-resolves it on the
+next turn, with one query and one update, so nothing has to find and clear
+stored copies.
+"""
+from .models import AIPersonality, Conversation
+from .prompts import personality_values
+from .response_cache import personality_fingerprint
+
+
+FIELDS = ('tone', 'formality_level', 'response_length', 'custom_instructions', 'personality_traits')
+# Conversation columns that override the profile's AI personality
+OVERRIDES = {
+    'ai_tone_override': 'tone',
+    'ai_formality_override': 'formality_level',
+    'ai_response_length_override': 'response_length',
+}
+# Upper bound on the answer, by response length; the prompt asks for less
+RESPONSE_MAX_TOKENS = {
+    'concise': 256,
+    'balanced': 512,
+    'detailed': 1024,
+}
+DEFAULT_RESPONSE_LENGTH = 'balanced'
+
+
+def _stamp(conversation, version, template):
+    return [version, template.digest, *(getattr(conversation, column) for column in OVERRIDES)]
+
+
+def resolve(personality, conversation, template):
+    """
+    The effective personality from an AIPersonality values() dict (or None)
+    and a conversation's overrides, for prompts rendered from `template`.
+    """
+    settings = dict(personality or {})
+    for column, field in OVERRIDES.items():
+        if getattr(conversation, column) is not None:
+            settings[field] = getattr(conversation, column)
+    length = settings.get('response_length')
+    max_tokens = RESPONSE_MAX_TOKENS.get(length, RESPONSE_MAX_TOKENS[DEFAULT_RESPONSE_LENGTH])
+    return {
+        'settings': settings,
+        'values': personality_values(settings),
+        'max_tokens': max_tokens,
+        'fingerprint': personality_fingerprint({**settings, 'max_tokens': max_tokens, 'prompt': template.digest}),
+    }
+
+
+async def aresolve(conversation, version, template):
+    """
+    The conversation's stored resolution, re-resolved and stored again when
+    out of date. A conversation not saved yet only gets the attribute set,
+    to be written with its insert.
+    """
+    stamp = _stamp(conversation, version, template)
+    stored = conversation.resolved_personality
+    if stored and stored.get('stamp') == stamp:
+        return stored
+    personality = await AIPersonality.objects.filter(profile_id=conversation.profile_id).values(*FIELDS).afirst()
+    resolved = {**resolve(personality, conversation, template), 'stamp': stamp}
+    conversation.resolved_personality = resolved
+    if not conversation._state.adding:
+        await Conversation.objects.filter(pk=conversation.pk).aupdate(resolved_personality=resolved)
+    return resolved
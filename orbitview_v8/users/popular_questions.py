@@ -0,0 +1,332 @@
+"""
+Popular question aggregation.
+
+Visitor questions are queued in memory by the chat path and folded into
+PopularQuestion rows by a background thread every POPULAR_QUESTIONS_INTERVAL
+seconds. Questions are normalized and clustered: the same wording maps to one
+fingerprint, and rewordings join an existing row when the MinHash estimate of
+their word-shingle Jaccard similarity reaches POPULAR_QUESTIONS_SIMILARITY.
+
+A batch is written with one INSERT of the new clusters (ignoring ones another
+process created meanwhile) and one additive bulk UPDATE of the counts, then
+the top POPULAR_QUESTIONS_TOP_N of every touched profile are read back off
+the (profile, -count) index and cached, so pages never sort on request. The
+same batch adds to PopularQuestionDay rows, the per-day counts the analytics
+dashboard ranks questions over a date range with.
+
+A batch that fails is written again one profile at a time, so a profile that
+can't be written (deleted since its questions were queued) doesn't hold back
+the others. Its questions go back in the queue and are dropped after failing
+`max_attempts` flushes in a row.
+"""
+import atexit
+import datetime
+import hashlib
+import logging
+import threading
+import zlib
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import PopularQuestion, PopularQuestionDay
+from .response_cache import normalize_question
+
+
+logger = logging.getLogger(__name__)
+
+
+MINHASH_PERMUTATIONS = 64
+# Clusters of a profile compared against each new question, most asked first
+MAX_CANDIDATES = 500
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = np.random.RandomState(1729)
+_A = _rng.randint(1, 1 << 31, MINHASH_PERMUTATIONS).astype(np.uint64)
+_B = _rng.randint(0, 1 << 31, MINHASH_PERMUTATIONS).astype(np.uint64)
+
+
+def question_fingerprint(question):
+    """Identity of a question's normalized wording."""
+    return hashlib.sha1(normalize_question(question).encode()).hexdigest()
+
+
+def minhash_signature(question):
+    """MinHash of the word and word-bigram shingles of a normalized question."""
+    words = normalize_question(question).split()
+    shingles = set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+    if not shingles:
+        return [0] * MINHASH_PERMUTATIONS
+    hashes = np.array([zlib.crc32(s.encode()) for s in shingles], dtype=np.uint64)
+    permuted = (hashes[:, None] * _A[None, :] + _B[None, :]) % _MERSENNE_PRIME
+    return permuted.min(axis=0).tolist()
+
+
+def _top_key(profile_id):
+    return f"popular-questions:{profile_id}"
+
+
+def refresh_top_questions(profile_id, limit=None):
+    limit = limit or settings.POPULAR_QUESTIONS_TOP_N
+    top = list(
+        PopularQuestion.objects.filter(profile_id=profile_id)
+        .order_by('-count')
+        .values('question', 'count')[:limit]
+    )
+    cache.set(_top_key(profile_id), top, None)
+    return top
+
+
+def top_questions(profile_id):
+    """The profile's most asked questions, from the precomputed list."""
+    top = cache.get(_top_key(profile_id))
+    if top is None:
+        top = refresh_top_questions(profile_id)
+    return top
+
+
+class _Clusters:
+    """Existing clusters of one profile, loaded once per batch."""
+
+    def __init__(self, profile_id):
+        rows = list(
+            PopularQuestion.objects.filter(profile_id=profile_id)
+            .order_by('-count')
+            .values_list('pk', 'fingerprint', 'signature')[:MAX_CANDIDATES]
+        )
+        self.by_fingerprint = {fingerprint: pk for pk, fingerprint, _ in rows}
+        self.ids = [pk for pk, _, _ in rows]
+        self.signatures = [signature for _, _, signature in rows]
+        self._matrix = None
+
+    def match(self, fingerprint, signature, threshold):
+        if fingerprint in self.by_fingerprint:
+            return self.by_fingerprint[fingerprint]
+        if not threshold or not self.signatures:
+            return None
+        if self._matrix is None or len(self._matrix) != len(self.signatures):
+            self._matrix = np.array(self.signatures, dtype=np.uint64)
+        similarity = (self._matrix == np.array(signature, dtype=np.uint64)).mean(axis=1)
+        best = int(similarity.argmax())
+        return self.ids[best] if similarity[best] >= threshold else None
+
+    def add(self, pk, fingerprint, signature):
+        self.by_fingerprint[fingerprint] = pk
+        self.ids.append(pk)
+        self.signatures.append(signature)
+
+
+class PopularQuestionPipeline:
+    def __init__(self, batch_size=500, interval=10.0, similarity=0.6, enabled=True, max_attempts=5):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.similarity = similarity
+        self.enabled = enabled
+        self.max_attempts = max_attempts
+        # {profile id: flushes in a row that failed to write its questions}
+        self._attempts = {}
+        self._queue = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def record(self, profile_id, question):
+        """Queue a visitor question. Never touches the database."""
+        if not question or not question.strip():
+            return
+        with self._lock:
+            self._queue.append((profile_id, question.strip(), timezone.now()))
+            if len(self._queue) >= self.batch_size:
+                self._wakeup.notify()
+        if not self.enabled:
+            self.flush()
+        else:
+            self._ensure_thread()
+
+    def _aggregate(self, queued):
+        """
+        Collapse the queue into (profile, fingerprint) -> [question, count,
+        last asked, {UTC day: count}].
+        """
+        counts = {}
+        for profile_id, question, asked_at in queued:
+            key = (profile_id, question_fingerprint(question))
+            day = asked_at.astimezone(datetime.timezone.utc).date()
+            entry = counts.get(key)
+            if entry is None:
+                counts[key] = [question, 1, asked_at, Counter({day: 1})]
+            else:
+                entry[1] += 1
+                entry[2] = max(entry[2], asked_at)
+                entry[3][day] += 1
+        return counts
+
+    def flush(self):
+        """Fold everything queued so far into PopularQuestion rows."""
+        with self._flush_lock:
+            with self._lock:
+                queued, self._queue = self._queue, []
+            if not queued:
+                return 0
+            try:
+                profile_ids = self._write(self._aggregate(queued))
+                written = len(queued)
+            except Exception:
+                logger.warning(
+                    'Aggregating %d popular questions in one batch failed, aggregating them per profile',
+                    len(queued), exc_info=True,
+                )
+                profile_ids, written = self._write_each(queued)
+            for profile_id in profile_ids:
+                self._attempts.pop(profile_id, None)
+                refresh_top_questions(profile_id)
+            return written
+
+    def _write_each(self, queued):
+        """Write a failed batch one profile at a time; returns the profiles written and their question count."""
+        by_profile = defaultdict(list)
+        for item in queued:
+            by_profile[item[0]].append(item)
+        written, retry = set(), []
+        for profile_id, items in by_profile.items():
+            try:
+                self._write(self._aggregate(items))
+            except Exception:
+                attempts = self._attempts.get(profile_id, 0) + 1
+                if attempts >= self.max_attempts:
+                    logger.exception(
+                        'Dropping %d popular questions of profile %s after repeated failures', len(items), profile_id
+                    )
+                    self._attempts.pop(profile_id, None)
+                    continue
+                logger.exception(
+                    'Aggregating %d popular questions of profile %s failed, will retry', len(items), profile_id
+                )
+                self._attempts[profile_id] = attempts
+                retry += items
+            else:
+                written.add(profile_id)
+        if retry:
+            with self._lock:
+                self._queue[:0] = retry
+        return written, sum(len(by_profile[profile_id]) for profile_id in written)
+
+    def _write(self, aggregated):
+        clusters = {}
+        deltas = defaultdict(lambda: [0, None])
+        days = defaultdict(Counter)
+        profiles = {}
+        created = []
+        for (profile_id, fingerprint), (question, count, asked_at, by_day) in aggregated.items():
+            if profile_id not in clusters:
+                clusters[profile_id] = _Clusters(profile_id)
+            signature = minhash_signature(question)
+            pk = clusters[profile_id].match(fingerprint, signature, self.similarity)
+            if pk is None:
+                row = PopularQuestion(
+                    profile_id=profile_id, question=question, count=0,
+                    fingerprint=fingerprint, signature=signature,
+                )
+                created.append(row)
+                clusters[profile_id].add(row.pk, fingerprint, signature)
+                pk = row.pk
+            delta = deltas[pk]
+            delta[0] += count
+            delta[1] = asked_at if delta[1] is None else max(delta[1], asked_at)
+            days[pk].update(by_day)
+            profiles[pk] = profile_id
+
+        with transaction.atomic():
+            if created:
+                PopularQuestion.objects.bulk_create(created, ignore_conflicts=True)
+                # Another process may have created some of these clusters first
+                stored = {
+                    (profile_id, fingerprint): pk
+                    for profile_id, fingerprint, pk in PopularQuestion.objects.filter(
+                        profile_id__in={row.profile_id for row in created},
+                        fingerprint__in=[row.fingerprint for row in created],
+                    ).values_list('profile_id', 'fingerprint', 'pk')
+                }
+                for row in created:
+                    pk = stored[(row.profile_id, row.fingerprint)]
+                    if pk != row.pk:
+                        count, asked_at = deltas.pop(row.pk)
+                        delta = deltas[pk]
+                        delta[0] += count
+                        delta[1] = asked_at if delta[1] is None else max(delta[1], asked_at)
+                        days[pk].update(days.pop(row.pk))
+                        profiles[pk] = profiles.pop(row.pk)
+            PopularQuestion.objects.bulk_update(
+                [
+                    PopularQuestion(pk=pk, count=F('count') + count, last_asked=asked_at)
+                    for pk, (count, asked_at) in deltas.items()
+                ],
+                ['count', 'last_asked'],
+            )
+            self._write_days(days, profiles)
+        return set(clusters)
+
+    @staticmethod
+    def _write_days(days, profiles):
+        PopularQuestionDay.objects.bulk_create(
+            [
+                PopularQuestionDay(question_id=pk, profile_id=profiles[pk], day=day)
+                for pk, by_day in days.items() for day in by_day
+            ],
+            ignore_conflicts=True,
+        )
+        keys = {(pk, day) for pk, by_day in days.items() for day in by_day}
+        rows = PopularQuestionDay.objects.filter(
+            question_id__in=list(days), day__in={day for _, day in keys}
+        ).values_list('pk', 'question_id', 'day')
+        PopularQuestionDay.objects.bulk_update(
+            [
+                PopularQuestionDay(pk=row_pk, count=F('count') + days[pk][day])
+                for row_pk, pk, day in rows if (pk, day) in keys
+            ],
+            ['count'],
+        )
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, name='popular-questions', daemon=True
+                    )
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if len(self._queue) < self.batch_size and not self._closed:
+                    self._wakeup.wait(self.interval)
+                closed = self._closed
+            close_old_connections()
+            self.flush()
+            close_old_connections()
+            if closed:
+                return
+
+    def close(self):
+        """Stop the background thread after a final flush."""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+
+popular_questions = PopularQuestionPipeline(
+    batch_size=settings.POPULAR_QUESTIONS_BATCH_SIZE,
+    interval=settings.POPULAR_QUESTIONS_INTERVAL,
+    similarity=settings.POPULAR_QUESTIONS_SIMILARITY,
+)
+atexit.register(popular_questions.close)
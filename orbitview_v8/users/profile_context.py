@@ -0,0 +1,229 @@
+"""
+Profile context compiler.
+
+The answering prompt needs the whole profile as text. Building it from the
+ORM on every chat turn costs a dozen queries and a lot of string work, so the
+document is compiled once into ProfileContext and read back with a single
+query per turn.
+
+The document is assembled from sections, one per source row ('profile',
+'work:<id>', 'accomplishment:<id>', ...). When a row changes only its section
+is re-rendered and the document is re-joined from the stored sections.
+"""
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .models import (
+    Accomplishment,
+    ContextChunk,
+    ContextFile,
+    OrbitViewProfile,
+    ProfileContext,
+    SocialLink,
+    Work,
+)
+from .tags import tag_prefetch
+
+
+GROUPS = (
+    ('profile', None),
+    ('work', '## Work'),
+    ('accomplishment', '## Accomplishments'),
+    ('social', '## Links'),
+    ('file', '## Context files'),
+)
+
+# Upper bound on how much of a context file's text goes into the prompt
+CONTEXT_FILE_MAX_CHARS = 20000
+
+
+def _line(label, value):
+    return f"{label}: {value}" if value else None
+
+
+def _join(lines):
+    return '\n'.join(line for line in lines if line)
+
+
+def _date_key(value):
+    # Newest first, with undated rows last
+    return -value.toordinal() if value else 1
+
+
+def render_profile(profile):
+    return ('profile', [0], _join([
+        f"# {profile.first_name} {profile.last_name} (@{profile.username})",
+        profile.byline,
+        '',
+        profile.about,
+        _line('Highlights', profile.aboutlines),
+        _line('Nicknames', profile.nicknames),
+        _line('Skills', profile.skills),
+        _line('Values', profile.values),
+        _line('Working style', profile.working_style),
+        _line('Looking for', profile.looking_for_opportunities),
+        _line('Ideal role', profile.looking_for_ideal_role),
+        _line('Deal breakers', profile.looking_for_deal_breakers),
+    ]))
+
+
+def render_work(work):
+    """Expects `images`, `links` and `work_tags` to be prefetched when rendering many works."""
+    dates = ' - '.join(str(d) for d in (work.start_date, work.end_date) if d)
+    links = [f"- {link.title or 'Link'}: {link.url}" for link in work.links.all()]
+    images = [f"- {image.alt}" for image in work.images.all() if image.alt]
+    text = _join([
+        f"### {work.title} ({work.get_status_display()}{', ' + dates if dates else ''})",
+        work.description,
+        _line('Tags', work.tags),
+        _line('Tech stack', work.tech_stack),
+        _line('Impact', work.impact),
+        'Links:\n' + '\n'.join(links) if links else None,
+        'Images:\n' + '\n'.join(images) if images else None,
+    ])
+    sort_key = [work.display_order, _date_key(work.end_date), _date_key(work.start_date)]
+    return (f"work:{work.pk}", sort_key, text)
+
+
+def render_accomplishment(accomplishment):
+    text = _join([
+        f"### {accomplishment.title} — {accomplishment.get_type_display()}, "
+        f"{accomplishment.issuer} ({accomplishment.date})",
+        accomplishment.description,
+        _line('Link', accomplishment.link),
+    ])
+    sort_key = [accomplishment.display_order, _date_key(accomplishment.date)]
+    return (f"accomplishment:{accomplishment.pk}", sort_key, text)
+
+
+def render_social_link(link):
+    text = f"- {link.get_platform_display()}: {link.url}" + (f" ({link.username})" if link.username else '')
+    return (f"social:{link.pk}", [link.display_order], text)
+
+
+def _context_file_text(context_file):
+    """
+    The file's extracted text up to CONTEXT_FILE_MAX_CHARS, re-joined from its
+    chunks without their overlaps. Prefetched `chunks` are expected to be
+    limited to that range already, as compile_profile_context() does.
+    """
+    chunks = context_file.chunks.all()
+    if 'chunks' not in getattr(context_file, '_prefetched_objects_cache', {}):
+        chunks = chunks.filter(char_start__lt=CONTEXT_FILE_MAX_CHARS)
+    parts = []
+    end = 0
+    for chunk in chunks:
+        if chunk.char_start < end:
+            parts.append(chunk.text[end - chunk.char_start:])
+        else:
+            parts.append(('\n' if parts else '') + chunk.text)
+        end = chunk.char_start + len(chunk.text)
+    return ''.join(parts)[:CONTEXT_FILE_MAX_CHARS] or None
+
+
+def render_context_file(context_file):
+    if context_file.status == 'duplicate' and context_file.duplicate_of_id:
+        # The original's section already carries the text
+        body = f"(Same file as {context_file.duplicate_of.title})"
+    else:
+        body = _context_file_text(context_file)
+    text = _join([f"### {context_file.title}", body])
+    return (f"file:{context_file.pk}", [-context_file.uploaded_at.timestamp()], text)
+
+
+def assemble(sections):
+    """Join stored sections into the final document in a stable order."""
+    grouped = {name: [] for name, _ in GROUPS}
+    for key, (sort_key, text) in sections.items():
+        grouped[key.split(':', 1)[0]].append((sort_key, key, text))
+
+    parts = []
+    for name, heading in GROUPS:
+        rows = sorted(grouped[name])
+        if not rows:
+            continue
+        if heading:
+            parts.append(heading)
+        parts.extend(text for _, _, text in rows)
+    return '\n\n'.join(parts)
+
+
+def _save(profile_id, sections):
+    document = assemble(sections)
+    content_hash = hashlib.sha256(document.encode()).hexdigest()
+    fields = {'sections': sections, 'document': document, 'content_hash': content_hash}
+    row = ProfileContext.objects.filter(profile_id=profile_id)
+    if not row.update(compiled_at=timezone.now(), **fields):
+        try:
+            with transaction.atomic():
+                ProfileContext.objects.create(profile_id=profile_id, **fields)
+        except IntegrityError:
+            # Another first compile inserted the row in the meantime
+            row.update(compiled_at=timezone.now(), **fields)
+    return document, content_hash
+
+
+def compile_profile_context(profile_id):
+    """Render every section of a profile from scratch and store the result."""
+    profile = OrbitViewProfile.objects.prefetch_related(tag_prefetch('profile_tags')).get(pk=profile_id)
+    rendered = [render_profile(profile)]
+    rendered += [
+        render_work(work)
+        for work in Work.objects.filter(profile_id=profile_id).prefetch_related(
+            'images', 'links', tag_prefetch('work_tags')
+        )
+    ]
+    rendered += [render_accomplishment(a) for a in Accomplishment.objects.filter(profile_id=profile_id)]
+    rendered += [render_social_link(link) for link in SocialLink.objects.filter(profile_id=profile_id)]
+    rendered += [
+        render_context_file(f)
+        for f in ContextFile.objects.filter(profile_id=profile_id).select_related('duplicate_of').prefetch_related(
+            Prefetch('chunks', queryset=ContextChunk.objects.filter(char_start__lt=CONTEXT_FILE_MAX_CHARS))
+        )
+    ]
+    return _save(profile_id, {key: [sort_key, text] for key, sort_key, text in rendered})
+
+
+def update_section(profile_id, rendered=None, remove=None):
+    """
+    Replace one rendered section (or drop the section `remove`) and re-join the
+    document, without touching any other row of the profile.
+    """
+    with transaction.atomic():
+        context = (
+            ProfileContext.objects.select_for_update()
+            .only('sections')
+            .filter(profile_id=profile_id)
+            .first()
+        )
+        if context is None:
+            # The profile may be going away in the same transaction
+            if not OrbitViewProfile.objects.filter(pk=profile_id).exists():
+                return None
+            return compile_profile_context(profile_id)
+        sections = context.sections
+        if remove:
+            sections.pop(remove, None)
+        if rendered:
+            key, sort_key, text = rendered
+            sections[key] = [sort_key, text]
+        return _save(profile_id, sections)
+
+
+def get_profile_context(profile_id):
+    """(document, content_hash) for a profile, compiling it on first use."""
+    row = ProfileContext.objects.filter(profile_id=profile_id).values_list('document', 'content_hash').first()
+    return row or compile_profile_context(profile_id)
+
+
+async def aget_profile_context(profile_id):
+    row = await ProfileContext.objects.filter(profile_id=profile_id).values_list(
+        'document', 'content_hash'
+    ).afirst()
+    if row is None:
+        row = await sync_to_async(compile_profile_context)(profile_id)
+    return row
@@ -0,0 +1,146 @@
+"""
+Read model of the public profile page.
+
+profile_page_queryset() loads a profile with everything the page shows in a
+fixed number of queries, however many works, images or links it has: the
+one-to-one rows are joined in, every list is prefetched once, and popular
+questions come from their precomputed top list. serialize_profile_page()
+then only walks the loaded objects, so it never goes back to the database.
+"""
+from django.contrib.auth.hashers import check_password
+from django.db.models import Prefetch
+
+from .counters import COUNTED_FIELDS, profile_counters
+from .models import OrbitViewProfile, Work
+from .popular_questions import top_questions
+from .tags import tag_prefetch
+
+
+def profile_page_queryset():
+    return OrbitViewProfile.objects.select_related(
+        'profile_picture', 'privacy', 'ai_personality'
+    ).prefetch_related(
+        Prefetch('works', queryset=Work.objects.prefetch_related('images', 'links', tag_prefetch('work_tags'))),
+        tag_prefetch('profile_tags'),
+        'accomplishments',
+        'social_links',
+        'counter_shards',
+    )
+
+
+def _related(profile, name):
+    """A one-to-one row loaded by select_related, or None when there isn't one."""
+    return getattr(profile, name, None)
+
+
+def profile_visibility(profile):
+    privacy = _related(profile, 'privacy')
+    if privacy is not None:
+        return privacy.visibility
+    return 'public' if profile.is_public else 'private'
+
+
+def can_view(profile, user, password=None):
+    """Whether `user` may see the page. Private profiles are for their followers."""
+    if user.is_authenticated and user.pk == profile.user_id:
+        return True
+    privacy = _related(profile, 'privacy')
+    if privacy is not None and privacy.password_protected:
+        if not password or not check_password(password, privacy.password_protected):
+            return False
+    if profile_visibility(profile) != 'private':
+        return True
+    return user.is_authenticated and profile.followers.filter(pk=user.pk).exists()
+
+
+def _image(image):
+    if image is None:
+        return None
+    return {
+        'url': image.url,
+        'alt': image.alt,
+        'width': image.width,
+        'height': image.height,
+        # For srcset: the same picture at smaller widths and other formats
+        'variants': [
+            {'url': item['url'], 'width': item['width'], 'format': item['format']}
+            for item in image.variants.get('items', [])
+        ],
+    }
+
+
+def _counts(profile):
+    # Approximate like ProfileCounters.counts(), from the already loaded rows
+    counts = {field: getattr(profile, field) for field in COUNTED_FIELDS}
+    for shard in profile.counter_shards.all():
+        counts[shard.field] += shard.value
+    for field, delta in profile_counters.pending(profile.pk).items():
+        counts[field] += delta
+    return counts
+
+
+def serialize_profile_page(profile):
+    personality = _related(profile, 'ai_personality')
+    return {
+        'id': str(profile.id),
+        'username': profile.username,
+        'first_name': profile.first_name,
+        'last_name': profile.last_name,
+        'byline': profile.byline,
+        'about': profile.about,
+        'aboutlines': profile.aboutlines,
+        'nicknames': profile.nicknames,
+        'skills': profile.skills,
+        'values': profile.values,
+        'working_style': profile.working_style,
+        'looking_for': {
+            'opportunities': profile.looking_for_opportunities,
+            'ideal_role': profile.looking_for_ideal_role,
+            'deal_breakers': profile.looking_for_deal_breakers,
+        },
+        'visibility': profile_visibility(profile),
+        'profile_picture': _image(_related(profile, 'profile_picture')),
+        'ai_personality': personality and {
+            'tone': personality.tone,
+            'formality_level': personality.formality_level,
+            'response_length': personality.response_length,
+            'personality_traits': personality.personality_traits,
+        },
+        'works': [
+            {
+                'id': str(work.id),
+                'title': work.title,
+                'description': work.description,
+                'status': work.status,
+                'start_date': work.start_date,
+                'end_date': work.end_date,
+                'tags': work.tags,
+                'tech_stack': work.tech_stack,
+                'impact': work.impact,
+                'images': [
+                    dict(_image(image), is_cover=image.is_cover) for image in work.images.all()
+                ],
+                'links': [{'title': link.title, 'url': link.url} for link in work.links.all()],
+            }
+            for work in profile.works.all()
+        ],
+        'accomplishments': [
+            {
+                'id': str(accomplishment.id),
+                'title': accomplishment.title,
+                'issuer': accomplishment.issuer,
+                'description': accomplishment.description,
+                'date': accomplishment.date,
+                'type': accomplishment.type,
+                'link': accomplishment.link,
+            }
+            for accomplishment in profile.accomplishments.all()
+        ],
+        'social_links': [
+            {'platform': link.platform, 'url': link.url, 'username': link.username}
+            for link in profile.social_links.all()
+        ],
+        'popular_questions': top_questions(profile.id),
+        'stats': _counts(profile),
+        'updated_at': profile.updated_at,
+    }
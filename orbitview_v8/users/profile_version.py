@@ -0,0 +1,40 @@
+"""
+Content version stamps for profiles.
+
+Anything derived from a profile (cached answers, compiled prompt context,
+rendered pages) is keyed by the profile's current version. Saving the
+profile or any of its child rows bumps the version, which makes every
+derived entry unreachable at once without having to find and delete them.
+"""
+import uuid
+
+from django.core.cache import cache
+
+
+def _key(profile_id):
+    return f"profile-version:{profile_id}"
+
+
+def profile_version(profile_id):
+    version = cache.get(_key(profile_id))
+    if version is None:
+        # A lost stamp must never match an old one, so start a fresh one
+        version = uuid.uuid4().hex
+        if not cache.add(_key(profile_id), version, None):
+            version = cache.get(_key(profile_id), version)
+    return version
+
+
+async def aprofile_version(profile_id):
+    version = await cache.aget(_key(profile_id))
+    if version is None:
+        version = uuid.uuid4().hex
+        if not await cache.aadd(_key(profile_id), version, None):
+            version = await cache.aget(_key(profile_id), version)
+    return version
+
+
+def bump_profile_version(profile_id):
+    version = uuid.uuid4().hex
+    cache.set(_key(profile_id), version, None)
+    return version
@@ -1,21 +1,206 @@
-from decouple import config
+"""
+System prompt templates.
+
+Templates live in PROMPT_DIRS as `<name>.v<version>.txt` files, e.g.
+`profile_answering.v2.txt`, and are read and compiled once when the app
+starts (UsersConfig.ready). A file named by PROMPT_FILES replaces every
+version of its template, and PROMPT_VERSIONS pins a template to an older
+version; otherwise the highest version is used.
+
+PROMPT_FILES are the plain prompts deployments configured before templates
+existed: their text is used literally, `$` included, and the placeholders of
+REQUIRED_FIELDS their template needs (the profile `context`) are appended. A
+versioned template missing one of those is a configuration error.
+
+Placeholders are `${name}` (`$$` is a literal dollar sign). Compiling splits
+a template into its static prefix, the text before the first placeholder,
+and (placeholder, following text) pairs, so rendering is one string join:
+no parsing or file access per chat turn, and every prompt of a template
+starts with the same prefix for the provider's prompt cache. Missing values
+render as empty.
+
+With PROMPT_AUTO_RELOAD (on under DEBUG) edited, added and removed files
+are picked up on the next render, checked at most once a second.
+"""
+import hashlib
+import re
+import string
+import threading
+import time
 from pathlib import Path
-import os
 
-current_folder = os.getcwd()
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+TEMPLATE_FILE_RE = re.compile(r'^(?P<name>[\w-]+)\.v(?P<version>\d+)\.txt$')
+RELOAD_CHECK_INTERVAL = 1.0
+# The version a PROMPT_FILES override is registered as
+OVERRIDE_VERSION = 'custom'
+# Placeholders a template must have for the prompt to carry what the model answers from
+REQUIRED_FIELDS = {
+    'profile_answering': ('context',),
+}
+
+RESPONSE_LENGTHS = {
+    'concise': 'short, a few sentences at most',
+    'balanced': 'a short paragraph, longer only when the question needs it',
+    'detailed': 'thorough, with specifics and examples from the profile',
+}
+
+
+class PromptNotFound(LookupError):
+    pass
+
+
+class PromptTemplate:
+    def __init__(self, name, version, text, path=None):
+        self.name = name
+        self.version = version
+        self.path = path
+        # Changes with the text, so answers cached under an older prompt aren't reused
+        self.digest = hashlib.sha1(text.encode()).hexdigest()[:12]
+        self.prefix, self.parts = self._compile(text)
+        self.fields = frozenset(field for field, _ in self.parts)
+
+    @staticmethod
+    def _compile(text):
+        """(static prefix, ((placeholder, text after it), ...))"""
+        literals, fields = [''], []
+        position = 0
+        for match in string.Template.pattern.finditer(text):
+            literals[-1] += text[position:match.start()]
+            position = match.end()
+            if match.group('escaped') is not None:
+                literals[-1] += '$'
+                continue
+            field = match.group('named') or match.group('braced')
+            if field is None:
+                raise ValueError(f"invalid placeholder at character {match.start()}")
+            fields.append(field)
+            literals.append('')
+        literals[-1] += text[position:]
+        return literals[0], tuple(zip(fields, literals[1:]))
+
+    def render(self, values):
+        """The prompt with `values` (a mapping) in place of its placeholders."""
+        if not self.parts:
+            return self.prefix
+        rendered = [self.prefix]
+        for field, literal in self.parts:
+            rendered.append(str(values.get(field) or ''))
+            rendered.append(literal)
+        return ''.join(rendered)
+
+
+class PromptRegistry:
+    def __init__(self):
+        self._templates = {}
+        self._sources = {}
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self.loaded = False
+
+    def _files(self):
+        """{path: (name, version)} of every template file, overrides included."""
+        files = {}
+        for directory in settings.PROMPT_DIRS:
+            for path in sorted(Path(directory).glob('*.txt')):
+                match = TEMPLATE_FILE_RE.match(path.name)
+                if match:
+                    files[path] = (match['name'], int(match['version']))
+        for name, path in settings.PROMPT_FILES.items():
+            if path:
+                # Relative paths are from the project directory, wherever the process started
+                files[Path(settings.BASE_DIR, path)] = (name, OVERRIDE_VERSION)
+        return files
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self):
+        """Read and compile every template; an unreadable or invalid one is a configuration error."""
+        templates, sources = {}, {}
+        for path, (name, version) in self._files().items():
+            try:
+                text = path.read_text(encoding='utf-8').strip()
+                required = REQUIRED_FIELDS.get(name, ())
+                if version == OVERRIDE_VERSION:
+                    text = text.replace('$', '$$') + ''.join(f"\n\n${{{field}}}" for field in required)
+                template = PromptTemplate(name, version, text, path)
+                missing = [field for field in required if field not in template.fields]
+                if missing:
+                    raise ValueError(f"missing placeholder {', '.join('${' + f + '}' for f in missing)}")
+            except (OSError, ValueError) as exc:
+                raise ImproperlyConfigured(f"Prompt template {path}: {exc}") from exc
+            templates.setdefault(name, {})[version] = template
+            sources[path] = self._mtime(path)
+        with self._lock:
+            self._templates, self._sources = templates, sources
+            self.loaded = True
+        return sum(len(versions) for versions in templates.values())
+
+    def _changed(self):
+        files = self._files()
+        return files.keys() != self._sources.keys() or any(
+            self._mtime(path) != mtime for path, mtime in self._sources.items()
+        )
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + RELOAD_CHECK_INTERVAL
+        if self._changed():
+            try:
+                self.load()
+            except ImproperlyConfigured:
+                # Keep serving the last good templates while a file is mid-edit
+                pass
+
+    def get(self, name, version=None):
+        if not self.loaded:
+            self.load()
+        elif settings.PROMPT_AUTO_RELOAD:
+            self._maybe_reload()
+        versions = self._templates.get(name)
+        if not versions:
+            raise PromptNotFound(f"No prompt template named {name!r}")
+        version = version or settings.PROMPT_VERSIONS.get(name)
+        if version is None:
+            version = OVERRIDE_VERSION if OVERRIDE_VERSION in versions else max(
+                v for v in versions if v != OVERRIDE_VERSION
+            )
+        if version not in versions:
+            raise PromptNotFound(f"No version {version} of prompt template {name!r}")
+        return versions[version]
+
+    def render(self, name, values=None, version=None):
+        return self.get(name, version).render(values or {})
 
-print(current_folder)
 
-co_pilot_prompt_path = config("ORBITVIEW_V8_PROFILE_CO_PILOT_SYSTEM_PROMPT")
-profile_answering_prompt_path = config("ORBITVIEW_V8_PROFILE_PROFILE_ANSWERING_SYSTEM_PROMPT")
+def personality_values(personality):
+    """
+    Placeholder values for an AI personality (a dict of AIPersonality fields,
+    conversation overrides already applied), or the defaults.
+    """
+    personality = personality or {}
+    traits = personality.get('personality_traits') or []
+    if isinstance(traits, str):
+        traits = [traits]
+    instructions = (personality.get('custom_instructions') or '').strip()
+    length = personality.get('response_length') or 'balanced'
+    return {
+        'tone': personality.get('tone') or 'professional',
+        'formality_level': personality.get('formality_level') or 5,
+        'response_length': RESPONSE_LENGTHS.get(length, RESPONSE_LENGTHS['balanced']),
+        'traits': f"- Personality: {', '.join(map(str, traits))}.\n" if traits else '',
+        'custom_instructions': f"- Their own instructions: {instructions}\n" if instructions else '',
+    }
 
-prompts = [
-    co_pilot_prompt_path, 
-    profile_answering_prompt_path
-]
 
-for prompt_path in prompts: 
-    SYSTEM_PROMPT = Path(prompt_path).read_text().strip()
-    print(SYSTEM_PROMPT)
-    print("\n\n---------------------------------------------------------------------------\n\n")    
-    
\ No newline at end of file
+prompt_registry = PromptRegistry()
@@ -0,0 +1,149 @@
+"""
+Cache of AI answers to visitors' opening questions.
+
+Answers are keyed by (profile, profile content version, personality settings,
+normalized question). Because the version changes whenever the profile or one
+of its rows is saved, stale answers are never served; the signal handlers
+also drop them eagerly to free memory. When RESPONSE_CACHE_SIMILARITY is set,
+a question that misses exactly is matched against the cached questions of
+the same profile by embedding cosine similarity. It defaults to off unless an
+EMBEDDING_MODEL is configured, since the lexical fallback embedder can't tell
+questions that differ by one word apart.
+
+Entries live in process memory with LRU eviction and a TTL; only first turns
+of a conversation are cached, since later answers depend on the history.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+PUNCTUATION_RE = re.compile(r"[^\w\s]")
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(text):
+    """Case, punctuation and whitespace insensitive form of a question."""
+    text = PUNCTUATION_RE.sub(' ', text.lower())
+    return WHITESPACE_RE.sub(' ', text).strip()
+
+
+def personality_fingerprint(settings_dict):
+    """Short stable hash of the AI personality settings an answer was produced with."""
+    encoded = json.dumps(settings_dict or {}, sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode()).hexdigest()[:16]
+
+
+class _Entry:
+    __slots__ = ('answer', 'expires_at', 'embedding')
+
+    def __init__(self, answer, expires_at, embedding):
+        self.answer = answer
+        self.expires_at = expires_at
+        self.embedding = embedding
+
+
+class ResponseCache:
+    """Thread-safe LRU + TTL cache of answers with optional similarity lookup."""
+
+    def __init__(self, max_entries=10000, ttl=3600, similarity_threshold=0.0,
+                 max_similar_candidates=256):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.max_similar_candidates = max_similar_candidates
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # namespace -> OrderedDict of normalized questions, for similarity scans
+        self._namespaces = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def namespace(profile_id, version, personality):
+        return (str(profile_id), version, personality)
+
+    def _embed(self, question):
+        if not self.similarity_threshold:
+            return None
+        from .embeddings import get_embedder
+
+        return get_embedder().embed([question])[0]
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        questions = self._namespaces.get(key[0])
+        if questions is not None:
+            questions.pop(key[1], None)
+            if not questions:
+                del self._namespaces[key[0]]
+
+    def get(self, namespace, question):
+        question = normalize_question(question)
+        now = time.monotonic()
+        with self._lock:
+            key = (namespace, question)
+            entry = self._entries.get(key)
+            if entry is None and self.similarity_threshold:
+                key, entry = self._most_similar(namespace, question)
+            if entry is not None and entry.expires_at <= now:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.answer
+
+    def _most_similar(self, namespace, question):
+        questions = self._namespaces.get(namespace)
+        if not questions:
+            return None, None
+        # Embedding happens under the lock; the hashing embedder is microseconds
+        embedding = self._embed(question)
+        best_key, best_entry, best_score = None, None, self.similarity_threshold
+        for candidate in reversed(list(questions)[-self.max_similar_candidates:]):
+            entry = self._entries.get((namespace, candidate))
+            if entry is None or entry.embedding is None:
+                continue
+            score = float(embedding @ entry.embedding)
+            if score >= best_score:
+                best_key, best_entry, best_score = (namespace, candidate), entry, score
+        return best_key, best_entry
+
+    def set(self, namespace, question, answer):
+        question = normalize_question(question)
+        embedding = self._embed(question)
+        with self._lock:
+            key = (namespace, question)
+            self._entries[key] = _Entry(answer, time.monotonic() + self.ttl, embedding)
+            self._entries.move_to_end(key)
+            self._namespaces.setdefault(namespace, OrderedDict())[question] = None
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+
+    def invalidate_profile(self, profile_id):
+        profile_id = str(profile_id)
+        with self._lock:
+            for namespace in [ns for ns in self._namespaces if ns[0] == profile_id]:
+                for question in list(self._namespaces[namespace]):
+                    self._drop((namespace, question))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._namespaces.clear()
+
+
+response_cache = ResponseCache(
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=settings.RESPONSE_CACHE_TTL,
+    similarity_threshold=settings.RESPONSE_CACHE_SIMILARITY,
+)
@@ -0,0 +1,363 @@
+"""
+Retrieval of the profile snippets relevant to a visitor's question.
+
+Sending the whole compiled profile with every chat turn stops scaling once a
+profile has many works or long context files. Instead every snippet of a
+profile is embedded once with the local document embedder (embeddings.py) and stored
+as a float16 vector in RetrievalVector. The snippets are the sections
+rendered by profile_context, except whole context files, plus each
+ContextChunk. When a row changes only its snippet is re-embedded, and text
+whose hash hasn't changed is never embedded twice.
+
+For search a profile's vectors are held in process memory (LRU over
+RETRIEVAL_CACHE_PROFILES profiles) as one int8 matrix with a scale per row:
+half the size of the stored float16 and, since NumPy has no fast float16
+arithmetic, several times quicker to score exhaustively. A counter in the
+cache tells a process that
+another one changed a profile's vectors; its own small changes are patched
+into its cached matrix without a reload.
+
+Profiles whose compiled document fits in RETRIEVAL_FULL_CONTEXT_CHARS are
+still sent whole; bigger ones are cut down to the profile summary and the
+RETRIEVAL_TOP_K best matching snippets.
+"""
+import hashlib
+import logging
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from .embeddings import get_document_embedder
+from .models import ContextChunk, ProfileContext, RetrievalVector
+from .profile_context import aget_profile_context, compile_profile_context
+
+
+logger = logging.getLogger(__name__)
+
+
+# Snippets embedded and written per batch
+EMBED_BATCH_SIZE = 256
+# Matrix rows scored at a time; blocks that stay in the CPU cache score fastest
+SCORE_BLOCK_ROWS = 1024
+# Above this many new or removed rows a cached matrix is reloaded rather than patched
+MAX_PATCH_ROWS = 32
+
+
+def _version_key(profile_id):
+    return f"retrieval-version:{profile_id}"
+
+
+def _text_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _bump(profile_id):
+    """Advance the profile's index version, shared by every process through the cache."""
+    key = _version_key(profile_id)
+    # Random start, so a stamp lost from the cache can't restart at a value still held somewhere
+    cache.add(key, random.getrandbits(48), None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = random.getrandbits(48)
+        cache.set(key, version, None)
+        return version
+
+
+def _quantize(vectors):
+    """int8 rows and float32 scales with vectors ~= rows * scales[:, None]."""
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    return np.rint(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Matrix:
+    __slots__ = ('version', 'keys', 'texts', 'vectors', 'scales', 'positions')
+
+    def __init__(self, version, keys, texts, vectors, scales):
+        self.version = version
+        self.keys = keys
+        self.texts = texts
+        self.vectors = vectors
+        self.scales = scales
+        self.positions = {key: i for i, key in enumerate(keys)}
+
+
+class RetrievalIndex:
+    """Per-profile int8 matrices of snippet vectors, with exhaustive top-k search."""
+
+    def __init__(self, max_profiles=32):
+        self.max_profiles = max_profiles
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, profile_id, version):
+        embedder = get_document_embedder()
+        keys, texts, vectors = [], [], []
+        rows = RetrievalVector.objects.filter(profile_id=profile_id, model=embedder.name).values_list(
+            'key', 'text', 'vector'
+        )
+        for key, text, vector in rows.iterator(chunk_size=2000):
+            keys.append(key)
+            texts.append(text)
+            vectors.append(bytes(vector))
+        matrix = np.frombuffer(b''.join(vectors), dtype=np.float16).reshape(len(keys), embedder.dim)
+        return _Matrix(version, keys, texts, *_quantize(matrix))
+
+    def matrix(self, profile_id):
+        version = cache.get(_version_key(profile_id))
+        with self._lock:
+            entry = self._profiles.get(profile_id)
+            if entry is not None and entry.version == version:
+                self._profiles.move_to_end(profile_id)
+                return entry
+        entry = self._load(profile_id, version)
+        with self._lock:
+            self._profiles[profile_id] = entry
+            self._profiles.move_to_end(profile_id)
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+        return entry
+
+    def apply(self, profile_id, version, upserts=(), removed=()):
+        """
+        Bring a cached matrix up to `version` after this process wrote
+        `upserts` [(key, text, vector)] and deleted `removed` keys, or drop it
+        when that isn't the only change since it was loaded.
+        """
+        with self._lock:
+            entry = self._profiles.get(profile_id)
+            if entry is None:
+                return
+            new_keys = [key for key, _, _ in upserts if key not in entry.positions]
+            removed = {key for key in removed if key in entry.positions}
+            if (entry.version is None or version != entry.version + 1
+                    or len(new_keys) + len(removed) > MAX_PATCH_ROWS):
+                del self._profiles[profile_id]
+                return
+            keys, texts, vectors, scales = entry.keys, entry.texts, entry.vectors, entry.scales
+            if new_keys or removed:
+                # Copy on write: searches holding the old matrix keep a consistent one
+                keep = [i for i, key in enumerate(keys) if key not in removed]
+                keys = [keys[i] for i in keep] + new_keys
+                texts = [texts[i] for i in keep] + [''] * len(new_keys)
+                vectors = np.concatenate([vectors[keep], np.zeros((len(new_keys), vectors.shape[1]), np.int8)])
+                scales = np.concatenate([scales[keep], np.ones(len(new_keys), np.float32)])
+            else:
+                vectors, scales = vectors.copy(), scales.copy()
+            patched = _Matrix(version, keys, texts, vectors, scales)
+            if upserts:
+                rows, row_scales = _quantize([vector for _, _, vector in upserts])
+                for (key, text, _), row, scale in zip(upserts, rows, row_scales):
+                    position = patched.positions[key]
+                    patched.texts[position] = text
+                    patched.vectors[position] = row
+                    patched.scales[position] = scale
+            self._profiles[profile_id] = patched
+
+    def drop(self, profile_id):
+        with self._lock:
+            self._profiles.pop(profile_id, None)
+
+    def search(self, profile_id, question, k=None):
+        """The k snippets most similar to `question`, as [(score, key, text)], best first."""
+        k = k or settings.RETRIEVAL_TOP_K
+        entry = self.matrix(profile_id)
+        count = len(entry.keys)
+        if not count:
+            return []
+        query = get_document_embedder().embed([question])[0].astype(np.float32)
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, SCORE_BLOCK_ROWS):
+            end = start + SCORE_BLOCK_ROWS
+            scores[start:end] = (entry.vectors[start:end] @ query) * entry.scales[start:end]
+        if count > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(count)
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(float(scores[i]), entry.keys[i], entry.texts[i]) for i in top]
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+retrieval_index = RetrievalIndex(max_profiles=settings.RETRIEVAL_CACHE_PROFILES)
+
+
+def index_snippets(profile_id, snippets):
+    """
+    Embed and store snippets given as (key, text, chunk id or None), skipping
+    those stored with the same text by the current embedder. Returns how many
+    were embedded.
+    """
+    embedder = get_document_embedder()
+    embedded = 0
+    for batch in _batches(snippets, EMBED_BATCH_SIZE):
+        stored = dict(
+            (key, (content_hash, model))
+            for key, content_hash, model in RetrievalVector.objects.filter(
+                profile_id=profile_id, key__in=[key for key, _, _ in batch]
+            ).values_list('key', 'content_hash', 'model')
+        )
+        hashed = [(key, text, chunk_id, _text_hash(text)) for key, text, chunk_id in batch]
+        changed = [row for row in hashed if stored.get(row[0]) != (row[3], embedder.name)]
+        if not changed:
+            continue
+        vectors = embedder.embed([text for _, text, _, _ in changed]).astype(np.float16)
+        RetrievalVector.objects.bulk_create(
+            [
+                RetrievalVector(
+                    profile_id=profile_id, key=key, chunk_id=chunk_id, text=text,
+                    vector=vector.tobytes(), model=embedder.name, content_hash=content_hash,
+                )
+                for (key, text, chunk_id, content_hash), vector in zip(changed, vectors)
+            ],
+            update_conflicts=True,
+            unique_fields=['profile', 'key'],
+            update_fields=['chunk', 'text', 'vector', 'model', 'content_hash', 'updated_at'],
+        )
+        retrieval_index.apply(
+            profile_id, _bump(profile_id),
+            upserts=[(key, text, vector) for (key, text, _, _), vector in zip(changed, vectors)],
+        )
+        embedded += len(changed)
+    return embedded
+
+
+def remove_snippets(profile_id, keys):
+    RetrievalVector.objects.filter(profile_id=profile_id, key__in=keys).delete()
+    retrieval_index.apply(profile_id, _bump(profile_id), removed=keys)
+
+
+def invalidate(profile_id):
+    """Make every process reload the profile's vectors, after rows went away by cascade."""
+    _bump(profile_id)
+    retrieval_index.drop(profile_id)
+
+
+def _chunk_snippets(chunks):
+    for chunk_id, title, text in chunks.values_list('id', 'context_file__title', 'text').iterator(chunk_size=2000):
+        yield (f"chunk:{chunk_id}", f"[{title}] {text}", chunk_id)
+
+
+def profile_snippets(profile_id):
+    """Every retrievable (key, text, chunk id) of a profile."""
+    sections = ProfileContext.objects.filter(profile_id=profile_id).values_list('sections', flat=True).first()
+    if sections is None:
+        compile_profile_context(profile_id)
+        sections = ProfileContext.objects.filter(profile_id=profile_id).values_list('sections', flat=True).get()
+    for key, (_, text) in sections.items():
+        # Files are searched by their chunks
+        if not key.startswith('file:') and text:
+            yield (key, text, None)
+    yield from _chunk_snippets(ContextChunk.objects.filter(profile_id=profile_id, context_file__status='ready'))
+
+
+def index_profile(profile_id):
+    """(Re)build a profile's vectors: embed what changed and drop what no longer exists."""
+    keys = set()
+
+    def tracked():
+        for snippet in profile_snippets(profile_id):
+            keys.add(snippet[0])
+            yield snippet
+
+    embedded = index_snippets(profile_id, tracked())
+    stale = [
+        key for key in RetrievalVector.objects.filter(profile_id=profile_id).values_list('key', flat=True)
+        if key not in keys
+    ]
+    for batch in _batches(stale, 500):
+        remove_snippets(profile_id, batch)
+    return embedded, len(stale)
+
+
+def section_changed(profile_id, rendered=None, remove=None):
+    """Keep the vectors in step with one re-rendered or removed profile_context section."""
+    if remove:
+        if remove.startswith('file:'):
+            # The file's chunks, and with them their vectors, were deleted with it
+            invalidate(profile_id)
+        else:
+            remove_snippets(profile_id, [remove])
+    if rendered:
+        key, _, text = rendered
+        if not key.startswith('file:'):
+            index_snippets(profile_id, [(key, text, None)] if text else [])
+
+
+def file_ingested(context_file):
+    """Index the chunks of a freshly ingested file; its old chunks went with their vectors."""
+    invalidate(context_file.profile_id)
+    if context_file.status == 'ready':
+        index_snippets(context_file.profile_id, _chunk_snippets(context_file.chunks.all()))
+
+
+_backfills = ThreadPoolExecutor(1, thread_name_prefix='retrieval-backfill')
+_backfilling = set()
+_backfilling_lock = threading.Lock()
+
+
+def _backfill(profile_id):
+    close_old_connections()
+    try:
+        index_profile(profile_id)
+    except Exception:
+        logger.exception('Indexing profile %s for retrieval failed', profile_id)
+    finally:
+        with _backfilling_lock:
+            _backfilling.discard(profile_id)
+        close_old_connections()
+
+
+def _schedule_backfill(profile_id):
+    with _backfilling_lock:
+        if profile_id in _backfilling:
+            return
+        _backfilling.add(profile_id)
+    _backfills.submit(_backfill, profile_id)
+
+
+def build_context(profile_id, question):
+    """
+    The profile summary followed by the snippets most relevant to `question`,
+    or None when the profile has no vectors yet (they are then built in the
+    background and the whole document is used meanwhile).
+    """
+    hits = retrieval_index.search(profile_id, question, settings.RETRIEVAL_TOP_K + 1)
+    if not hits:
+        _schedule_backfill(profile_id)
+        return None
+    entry = retrieval_index.matrix(profile_id)
+    head = entry.texts[entry.positions['profile']] if 'profile' in entry.positions else ''
+    excerpts = [text for _, key, text in hits if key != 'profile'][:settings.RETRIEVAL_TOP_K]
+    return '\n\n'.join(part for part in [head, '## Most relevant to the question', *excerpts] if part)
+
+
+async def abuild_context(profile_id, question):
+    """The profile text to answer `question` from: whole when small, retrieved excerpts otherwise."""
+    document, _ = await aget_profile_context(profile_id)
+    if len(document) <= settings.RETRIEVAL_FULL_CONTEXT_CHARS:
+        return document
+    return await sync_to_async(build_context)(profile_id, question) or document
@@ -0,0 +1,405 @@
+"""
+Full-text and faceted search over public profiles.
+
+The index lives in three tables:
+- SearchTerm holds every word and facet value ('skill:python',
+  'tech:django') with its document frequency.
+- SearchDocument has one row per public profile, with a query-independent
+  rank and the profile's facet values.
+- SearchPosting holds one (term, document, impact) row per distinct term of
+  a profile. The impact is a field-weighted BM25 term frequency scaled to
+  1-255, so a skill or byline word weighs more than one buried in `about`.
+  Facet postings carry the document's rank as their impact instead.
+
+index_profile() brings one profile's postings up to date with a diff, and
+the signal handlers call it when the profile, its works, its accomplishments
+or its privacy change. rebuild_index() runs the same diff over every
+profile, which also catches ranks moving with views.
+
+A query ANDs its words and facet filters, rarest term first. Up to
+SEARCH_CANDIDATES postings of the rarest term are read best-impact first
+from the (term, impact) index. The other terms are then looked up only for
+those documents. The score adds idf x impact over the words plus a little
+of the document's rank. When the rarest term alone matches more than
+SEARCH_CANDIDATES documents, the results, total and facet counts cover its
+best ones and are flagged as estimates. Pages are keyset cursors over
+(score, document id).
+"""
+import base64
+import json
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import OrbitViewProfile, SearchDocument, SearchPosting, SearchTerm
+from .profile_page import profile_visibility
+from .tags import tag_prefetch, tag_slug
+
+
+TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9+#]*(?:\.[a-z0-9]+)*")
+STOPWORDS = frozenset(
+    'a an and are as at be by for from has have i in is it its my of on or our so that the their '
+    'this to was we were with you your'.split()
+)
+MAX_TERM_LENGTH = 100
+FACETS = ('skill', 'tech')
+# How much a word counts towards its term frequency, by the field it is in
+FIELD_WEIGHTS = {
+    'byline': 3.0,
+    'skills': 3.0,
+    'nicknames': 2.0,
+    'tags': 2.0,
+    'tech': 2.0,
+    'accomplishments': 2.0,
+    'about': 1.0,
+}
+# BM25 term frequency saturation and length normalization, over weighted lengths
+K1 = 1.2
+B = 0.5
+AVERAGE_LENGTH = 80.0
+# Most query words used, the rest are ignored
+MAX_QUERY_TERMS = 8
+FACET_COUNTS_KEY = 'search-facet-counts'
+DOCUMENT_COUNT_KEY = 'search-document-count'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def tokenize(text):
+    return [
+        token for token in TOKEN_RE.findall((text or '').lower())
+        if token not in STOPWORDS and len(token) <= MAX_TERM_LENGTH
+    ]
+
+
+def facet_value(value):
+    # A tag slug, short enough to fit a term with its 'skill:' prefix
+    return tag_slug(value)[:MAX_TERM_LENGTH - 10]
+
+
+def profile_rank(profile):
+    """Query-independent quality in [0, 1], from completeness and popularity."""
+    completion = min(max(profile.profile_completion, 0), 100) / 100
+    popularity = min(math.log1p(max(profile.total_views, 0)) / math.log1p(100000), 1.0)
+    return round(0.5 * completion + 0.5 * popularity, 4)
+
+
+def _tags(rows, kind):
+    return [row.tag for row in rows if row.tag.kind == kind]
+
+
+def profile_fields(profile):
+    """Searchable text of a profile by field, from the rows _search_queryset() prefetches."""
+    rows = list(profile.profile_tags.all())
+    return {
+        'byline': profile.byline,
+        'about': profile.about,
+        'skills': ' '.join(tag.name for tag in _tags(rows, 'skill')),
+        'nicknames': ' '.join(tag.name for tag in _tags(rows, 'nickname')),
+        # Rolled up from the profile's works
+        'tags': ' '.join(tag.name for tag in _tags(rows, 'topic')),
+        'tech': ' '.join(tag.name for tag in _tags(rows, 'tech')),
+        'accomplishments': ' '.join(a.title for a in profile.accomplishments.all()),
+    }
+
+
+def profile_facets(profile):
+    rows = list(profile.profile_tags.all())
+    return {kind: sorted({facet_value(tag.slug) for tag in _tags(rows, kind)}) for kind in FACETS}
+
+
+def term_impacts(fields, facets, rank):
+    """{term: impact} of a document."""
+    frequencies = defaultdict(float)
+    for field, text in fields.items():
+        for token in tokenize(text):
+            frequencies[token] += FIELD_WEIGHTS[field]
+    length = sum(frequencies.values())
+    norm = K1 * (1 - B + B * length / AVERAGE_LENGTH)
+    impacts = {
+        term: max(1, min(255, round(255 * tf / (tf + norm))))
+        for term, tf in frequencies.items()
+    }
+    # Facet filters rank by the document's quality
+    facet_impact = 1 + round(254 * rank)
+    for kind, values in facets.items():
+        for value in values:
+            impacts[f"{kind}:{value}"] = facet_impact
+    return impacts
+
+
+def _term_ids(terms):
+    """Ids of `terms`, creating the ones not in the dictionary yet."""
+    ids = dict(SearchTerm.objects.filter(term__in=terms).values_list('term', 'id'))
+    missing = [term for term in terms if term not in ids]
+    if missing:
+        SearchTerm.objects.bulk_create([SearchTerm(term=term) for term in missing], ignore_conflicts=True)
+        ids.update(SearchTerm.objects.filter(term__in=missing).values_list('term', 'id'))
+    return ids
+
+
+def is_searchable(profile):
+    """Only public profiles are listed, and not ones behind a password."""
+    privacy = getattr(profile, 'privacy', None)
+    return profile_visibility(profile) == 'public' and not (privacy and privacy.password_protected)
+
+
+def _search_queryset():
+    return OrbitViewProfile.objects.select_related('privacy').prefetch_related(
+        tag_prefetch('profile_tags'), 'accomplishments'
+    )
+
+
+def remove_profile(profile_id):
+    with transaction.atomic():
+        document = SearchDocument.objects.select_for_update().filter(profile_id=profile_id).first()
+        if document is None:
+            return
+        term_ids = list(SearchPosting.objects.filter(document=document).values_list('term_id', flat=True))
+        SearchTerm.objects.filter(id__in=term_ids).update(df=F('df') - 1)
+        document.delete()
+
+
+def index_profile(profile_id, profile=None):
+    """
+    Bring a profile's search document and postings in line with the profile.
+    `profile` may be passed already loaded through _search_queryset().
+    """
+    if profile is None:
+        profile = _search_queryset().filter(pk=profile_id).first()
+    if profile is None or not is_searchable(profile):
+        return remove_profile(profile_id)
+
+    rank = profile_rank(profile)
+    facets = profile_facets(profile)
+    wanted = term_impacts(profile_fields(profile), facets, rank)
+    with transaction.atomic():
+        document, _ = SearchDocument.objects.select_for_update().update_or_create(
+            profile_id=profile_id, defaults={'rank': rank, 'facets': facets}
+        )
+        current = dict(
+            SearchPosting.objects.filter(document=document).values_list('term__term', 'impact')
+        )
+        added = wanted.keys() - current.keys()
+        removed = current.keys() - wanted.keys()
+        changed = {term for term in wanted.keys() & current.keys() if wanted[term] != current[term]}
+        if not (added or removed or changed):
+            return document
+        ids = _term_ids(sorted(added | removed | changed))
+        SearchPosting.objects.filter(
+            document=document, term_id__in=[ids[term] for term in removed | changed]
+        ).delete()
+        SearchPosting.objects.bulk_create([
+            SearchPosting(term_id=ids[term], document=document, impact=wanted[term])
+            for term in added | changed
+        ])
+        SearchTerm.objects.filter(id__in=[ids[term] for term in added]).update(df=F('df') + 1)
+        SearchTerm.objects.filter(id__in=[ids[term] for term in removed]).update(df=F('df') - 1)
+    return document
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Bring every profile's document up to date in place, e.g. to refresh
+    ranks, which move with views without a signal. Each profile is diffed in
+    its own short transaction through index_profile(), so search keeps
+    serving the whole index meanwhile and the signal handlers can run
+    alongside. Returns the document count.
+    """
+    indexed = 0
+    profiles = OrbitViewProfile.objects.order_by('pk').values_list('pk', flat=True)
+    batch = []
+    for profile_id in profiles.iterator(chunk_size=batch_size):
+        batch.append(profile_id)
+        if len(batch) >= batch_size:
+            indexed += _index_batch(batch)
+            batch = []
+    if batch:
+        indexed += _index_batch(batch)
+
+    # Documents of profiles deleted without the signal (e.g. a queryset delete)
+    orphans = SearchDocument.objects.exclude(profile_id__in=OrbitViewProfile.objects.values('pk'))
+    for profile_id in orphans.values_list('profile_id', flat=True).iterator():
+        remove_profile(profile_id)
+
+    # Recount, in case a df drifted; counted on the (term, impact) index in one statement
+    SearchTerm.objects.update(df=Coalesce(Subquery(
+        SearchPosting.objects.filter(term=OuterRef('pk')).values('term').annotate(n=Count('*')).values('n')
+    ), 0))
+    cache.delete_many([FACET_COUNTS_KEY, DOCUMENT_COUNT_KEY])
+    return indexed
+
+
+def _index_batch(profile_ids):
+    """Index a batch of profiles loaded in one query; returns how many are searchable."""
+    profiles = {profile.pk: profile for profile in _search_queryset().filter(pk__in=profile_ids)}
+    indexed = 0
+    for profile_id in profile_ids:
+        # A profile deleted since the id was read is removed from the index
+        if index_profile(profile_id, profiles.get(profile_id)) is not None:
+            indexed += 1
+    return indexed
+
+
+def _document_count():
+    count = cache.get(DOCUMENT_COUNT_KEY)
+    if count is None:
+        count = SearchDocument.objects.count()
+        cache.set(DOCUMENT_COUNT_KEY, count, 60)
+    return count
+
+
+def _global_facet_counts():
+    counts = cache.get(FACET_COUNTS_KEY)
+    if counts is None:
+        counts = {
+            kind: [
+                {'value': term.split(':', 1)[1], 'count': df}
+                for term, df in SearchTerm.objects.filter(term__startswith=f"{kind}:", df__gt=0)
+                .order_by('-df', 'term').values_list('term', 'df')[:settings.SEARCH_FACET_LIMIT]
+            ]
+            for kind in FACETS
+        }
+        cache.set(FACET_COUNTS_KEY, counts, 60)
+    return counts
+
+
+def _idf(df, total):
+    return math.log(1 + (total - df + 0.5) / (df + 0.5))
+
+
+def encode_cursor(score, document_id):
+    return base64.urlsafe_b64encode(json.dumps([score, document_id]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        score, document_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return float(score), int(document_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def _page(ranked, cursor, limit):
+    """ranked: [(score, document id)] best first."""
+    if cursor:
+        after = decode_cursor(cursor)
+        ranked = [item for item in ranked if (-item[0], item[1]) > (-after[0], after[1])]
+    page = ranked[:limit]
+    next_cursor = encode_cursor(*page[-1]) if len(ranked) > limit else None
+    return page, next_cursor
+
+
+def _results(page):
+    documents = SearchDocument.objects.filter(id__in=[document_id for _, document_id in page]).select_related(
+        'profile'
+    ).only(
+        'id', 'facets', 'profile__username', 'profile__first_name', 'profile__last_name', 'profile__byline'
+    )
+    by_id = {document.id: document for document in documents}
+    return [
+        {
+            'username': by_id[document_id].profile.username,
+            'first_name': by_id[document_id].profile.first_name,
+            'last_name': by_id[document_id].profile.last_name,
+            'byline': by_id[document_id].profile.byline,
+            'skills': by_id[document_id].facets.get('skill', []),
+            'tech': by_id[document_id].facets.get('tech', []),
+            'score': round(score, 4),
+        }
+        for score, document_id in page if document_id in by_id
+    ]
+
+
+def _browse(cursor, limit):
+    documents = SearchDocument.objects.order_by('-rank', 'id')
+    if cursor:
+        rank, document_id = decode_cursor(cursor)
+        documents = documents.filter(rank__lte=rank).exclude(rank=rank, id__lte=document_id)
+    ranked = list(documents.values_list('rank', 'id')[:limit + 1])
+    page = ranked[:limit]
+    return {
+        'results': _results(page),
+        'facets': _global_facet_counts(),
+        'total': _document_count(),
+        'estimated': False,
+        'next_cursor': encode_cursor(*page[-1]) if len(ranked) > limit else None,
+    }
+
+
+def _empty():
+    return {'results': [], 'facets': {kind: [] for kind in FACETS}, 'total': 0, 'estimated': False,
+            'next_cursor': None}
+
+
+def search(query='', filters=None, cursor=None, limit=20):
+    """
+    A page of public profiles matching every word of `query` and every
+    {facet: [values]} filter, with facet counts over the matches.
+    """
+    words = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    facet_terms = [
+        f"{kind}:{facet_value(value)}"
+        for kind in FACETS for value in (filters or {}).get(kind, []) if facet_value(value)
+    ]
+    if not words and not facet_terms:
+        return _browse(cursor, limit)
+
+    terms = {term.term: term for term in SearchTerm.objects.filter(term__in=words + facet_terms)}
+    if any(term not in terms or terms[term].df <= 0 for term in words + facet_terms):
+        return _empty()
+    total_documents = max(_document_count(), 1)
+    weights = {term: _idf(terms[term].df, total_documents) / 255 for term in words}
+    ordered = sorted(words + facet_terms, key=lambda term: terms[term].df)
+
+    # The rarest term's best postings, each with the impact of the other terms
+    # (None when the document lacks one) looked up on the (document, term) index
+    driver = terms[ordered[0]]
+    others = {
+        f"impact_{i}": Subquery(
+            SearchPosting.objects.filter(document=OuterRef('document'), term=terms[term]).values('impact')[:1]
+        )
+        for i, term in enumerate(ordered[1:])
+    }
+    rows = SearchPosting.objects.filter(term=driver).annotate(**others).order_by('-impact', 'document_id').values_list(
+        'document_id', 'impact', 'document__rank', 'document__facets', *others
+    )[:settings.SEARCH_CANDIDATES]
+
+    facet_counts = {kind: Counter() for kind in FACETS}
+    ranked = []
+    scanned = 0
+    for document_id, impact, rank, facets, *impacts in rows:
+        scanned += 1
+        if None in impacts:
+            continue
+        score = weights.get(driver.term, 0) * impact + settings.SEARCH_RANK_WEIGHT * rank
+        for term, other in zip(ordered[1:], impacts):
+            score += weights.get(term, 0) * other
+        ranked.append((score, document_id))
+        for kind in FACETS:
+            facet_counts[kind].update(facets.get(kind, []))
+    ranked.sort(key=lambda item: (-item[0], item[1]))
+
+    estimated = driver.df > scanned
+    page, next_cursor = _page(ranked, cursor, limit)
+    return {
+        'results': _results(page),
+        'facets': {
+            kind: [
+                {'value': value, 'count': count}
+                for value, count in facet_counts[kind].most_common(settings.SEARCH_FACET_LIMIT)
+            ]
+            for kind in FACETS
+        },
+        'total': round(driver.df * len(ranked) / scanned) if estimated else len(ranked),
+        'estimated': estimated,
+        'next_cursor': next_cursor,
+    }
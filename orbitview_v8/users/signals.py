@@ -0,0 +1,211 @@
+"""
+Signal handlers that keep profile-derived caches in step with the database,
+and the login bookkeeping that replaces Django's update_last_login.
+"""
+from django.contrib.auth.models import update_last_login
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.utils import timezone
+
+from . import profile_context, retrieval, search
+from .auth_cache import invalidate_user
+from .context_ingest import context_ingestion, needs_ingestion
+from .images import image_pipeline, needs_processing
+from .models import (
+    AIPersonality,
+    Accomplishment,
+    ContextFile,
+    OrbitViewProfile,
+    PrivacySettings,
+    ProfileImage,
+    SocialLink,
+    User,
+    Work,
+    WorkImage,
+    WorkLink,
+)
+from .profile_version import bump_profile_version
+from .response_cache import response_cache
+from .tags import save_pending_tags, sync_work_tags, tag_prefetch
+
+
+PROFILE_CHILD_MODELS = (
+    ProfileImage,
+    Work,
+    Accomplishment,
+    SocialLink,
+    ContextFile,
+    PrivacySettings,
+    AIPersonality,
+)
+WORK_CHILD_MODELS = (WorkImage, WorkLink)
+
+# Rows rendered into the compiled profile context, with their section renderer
+CONTEXT_SECTIONS = {
+    Work: ('work', profile_context.render_work),
+    Accomplishment: ('accomplishment', profile_context.render_accomplishment),
+    SocialLink: ('social', profile_context.render_social_link),
+    ContextFile: ('file', profile_context.render_context_file),
+}
+# Models with tag_list() attributes, and the relation their tags are saved through
+TAG_RELATIONS = {OrbitViewProfile: 'profile_tags', Work: 'work_tags'}
+# Rows whose text or visibility is part of a profile's search document
+SEARCH_SOURCES = (Work, Accomplishment, PrivacySettings)
+
+
+def profile_changed(profile_id):
+    """Invalidate everything derived from a profile once the change is committed."""
+    def invalidate():
+        bump_profile_version(profile_id)
+        response_cache.invalidate_profile(profile_id)
+
+    transaction.on_commit(invalidate)
+
+
+def section_changed(profile_id, rendered=None, remove=None):
+    """Re-join the compiled context around one section and re-index it for retrieval."""
+    profile_context.update_section(profile_id, rendered, remove=remove)
+    retrieval.section_changed(profile_id, rendered, remove=remove)
+
+
+def reindex(profile_id):
+    transaction.on_commit(lambda: search.index_profile(profile_id))
+
+
+def _work_profile_id(work_id):
+    return Work.objects.filter(pk=work_id).values_list('profile_id', flat=True).first()
+
+
+def _profile_saved(sender, instance, **kwargs):
+    profile_changed(instance.pk)
+    # has_profile / profile_username in the owner's cached /me payload
+    transaction.on_commit(lambda: invalidate_user(instance.user_id))
+    if kwargs.get('signal') is post_save:
+        transaction.on_commit(
+            lambda: section_changed(instance.pk, profile_context.render_profile(instance))
+        )
+        reindex(instance.pk)
+
+
+def _profile_child_saved(sender, instance, **kwargs):
+    profile_changed(instance.profile_id)
+    if sender in SEARCH_SOURCES:
+        reindex(instance.profile_id)
+    if sender not in CONTEXT_SECTIONS:
+        return
+    prefix, render = CONTEXT_SECTIONS[sender]
+    if kwargs.get('signal') is post_save:
+        transaction.on_commit(
+            lambda: section_changed(instance.profile_id, render(instance))
+        )
+    else:
+        transaction.on_commit(
+            lambda: section_changed(instance.profile_id, remove=f"{prefix}:{instance.pk}")
+        )
+
+
+def _work_child_saved(sender, instance, **kwargs):
+    profile_id = _work_profile_id(instance.work_id)
+    # When the work itself is being deleted its own signal covers the profile
+    if profile_id is None:
+        return
+    profile_changed(profile_id)
+
+    def rerender_work():
+        work = Work.objects.filter(pk=instance.work_id).prefetch_related(
+            'images', 'links', tag_prefetch('work_tags')
+        ).first()
+        if work is not None:
+            section_changed(profile_id, profile_context.render_work(work))
+
+    transaction.on_commit(rerender_work)
+
+
+def _image_saved(sender, instance, update_fields=None, **kwargs):
+    # The pipeline's own save only lists the columns it fills in
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    if needs_processing(instance):
+        transaction.on_commit(lambda: image_pipeline.submit(sender, instance.pk))
+
+
+def _context_file_saved(sender, instance, update_fields=None, **kwargs):
+    # Ingestion's own save doesn't list the file
+    if update_fields is not None and 'file' not in update_fields:
+        return
+    if needs_ingestion(instance):
+        transaction.on_commit(lambda: context_ingestion.submit(instance.pk))
+
+
+def _context_file_deleting(sender, instance, **kwargs):
+    # Re-uploads that relied on this file's chunks get chunked themselves
+    duplicates = list(instance.duplicates.values_list('pk', flat=True))
+
+    def reingest():
+        for pk in duplicates:
+            context_ingestion.submit(pk)
+
+    if duplicates:
+        transaction.on_commit(reingest)
+
+
+def _profile_deleting(sender, instance, **kwargs):
+    # Before the cascade, while the postings are still there to update term counts from
+    search.remove_profile(instance.pk)
+
+
+def _tags_saved(sender, instance, **kwargs):
+    if save_pending_tags(instance, TAG_RELATIONS[sender]) and sender is Work:
+        sync_work_tags([instance.profile_id])
+
+
+def _work_deleted(sender, instance, **kwargs):
+    # Its tags go with it, and from the profile's roll-up unless another work has them
+    sync_work_tags([instance.profile_id])
+
+
+def _user_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_user(instance.pk))
+
+
+# First, so handlers that run right away outside a transaction already see the tags
+for model in TAG_RELATIONS:
+    post_save.connect(_tags_saved, sender=model, dispatch_uid=f'{model.__name__}-tags')
+post_delete.connect(_work_deleted, sender=Work, dispatch_uid='Work-tags')
+
+for action, signal in (('saved', post_save), ('deleted', post_delete)):
+    signal.connect(_user_saved, sender=User, dispatch_uid=f'user-{action}')
+    signal.connect(_profile_saved, sender=OrbitViewProfile, dispatch_uid=f'profile-{action}')
+    for model in PROFILE_CHILD_MODELS:
+        signal.connect(_profile_child_saved, sender=model, dispatch_uid=f'{model.__name__}-{action}')
+    for model in WORK_CHILD_MODELS:
+        signal.connect(_work_child_saved, sender=model, dispatch_uid=f'{model.__name__}-{action}')
+
+for model in (ProfileImage, WorkImage):
+    post_save.connect(_image_saved, sender=model, dispatch_uid=f'{model.__name__}-process')
+
+post_save.connect(_context_file_saved, sender=ContextFile, dispatch_uid='ContextFile-ingest')
+pre_delete.connect(_context_file_deleting, sender=ContextFile, dispatch_uid='ContextFile-reingest')
+pre_delete.connect(_profile_deleting, sender=OrbitViewProfile, dispatch_uid='profile-unindex')
+
+
+def record_login(sender, request, user, **kwargs):
+    """
+    Store last_login and last_login_ip together with any fields the login flow
+    changed on the user (listed in `user.login_update_fields`), in one UPDATE
+    that leaves the rest of the row and updated_at alone.
+    """
+    fields = set(getattr(user, 'login_update_fields', ()))
+    user.last_login = timezone.now()
+    fields.add('last_login')
+    ip = request.META.get('REMOTE_ADDR') if request is not None else None
+    if ip and ip != user.last_login_ip:
+        user.last_login_ip = ip
+        fields.add('last_login_ip')
+    user.save(update_fields=sorted(fields))
+    user.login_update_fields = ()
+
+
+user_logged_in.disconnect(update_last_login, dispatch_uid='update_last_login')
+user_logged_in.connect(record_login, dispatch_uid='users-record-login')
@@ -0,0 +1,266 @@
+"""
+Server-Sent Events framing for streamed chat answers.
+
+EventStream turns an async iterator of LLM tokens into SSE frames:
+
+- tokens are coalesced into one `data:` frame per size/time budget instead of
+  one write per token,
+- a `: ping` comment is sent whenever the stream is idle so proxies keep the
+  connection open,
+- every frame carries an id and is recorded in a short-lived ReplayBuffer, so
+  a client that drops can reconnect with `Last-Event-ID` and pick up the rest,
+- tokens are pulled through a small bounded queue; when the client reads slowly
+  the queue fills and we stop reading from the LLM,
+- when the client goes away the answer keeps being generated into the
+  ReplayBuffer for up to DETACHED_GRACE seconds, so a reconnect can follow it
+  to the end; only then is the upstream request cancelled.
+"""
+import asyncio
+import contextlib
+import uuid
+
+from django.core.cache import cache
+
+
+HEARTBEAT = b': ping\n\n'
+
+COALESCE_BYTES = 256
+COALESCE_DELAY = 0.05
+HEARTBEAT_INTERVAL = 15
+DETACHED_GRACE = 120
+MAX_PENDING_TOKENS = 64
+RECONNECT_DELAY_MS = 3000
+REPLAY_TTL = 300
+
+
+def format_event(data=None, event=None, id=None, retry=None):
+    """Encode one SSE frame. Multi-line data is split over several `data:` lines."""
+    lines = []
+    if id is not None:
+        lines.append(f"id: {id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    if retry is not None:
+        lines.append(f"retry: {retry}")
+    if data is not None:
+        lines.extend(f"data: {line}" for line in data.split('\n'))
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+class ReplayBuffer:
+    """
+    Frames sent for the latest answer of a conversation, kept for REPLAY_TTL
+    seconds so a reconnecting client can resume after its Last-Event-ID.
+
+    Each frame is its own cache entry next to a small header record holding
+    the state and the last sequence number, so appending a frame costs the
+    same however long the answer already is.
+    """
+
+    def __init__(self, conversation_id, owner, stream_id=None, ttl=REPLAY_TTL):
+        self.key = self.cache_key(conversation_id)
+        self.owner = owner
+        self.stream_id = stream_id or uuid.uuid4().hex[:12]
+        self.ttl = ttl
+        self._record = {'stream': self.stream_id, 'owner': owner, 'last': 0, 'state': 'streaming'}
+        cache.set(self.key, self._record, ttl)
+
+    @staticmethod
+    def cache_key(conversation_id):
+        return f"sse-replay:{conversation_id}"
+
+    @staticmethod
+    def frame_key(key, stream_id, seq):
+        return f"{key}:{stream_id}:{seq}"
+
+    @classmethod
+    def load(cls, conversation_id):
+        return cache.get(cls.cache_key(conversation_id))
+
+    @classmethod
+    def frames(cls, conversation_id, record, after=0):
+        """(seq, event, data) of the frames of `record` after sequence number `after`."""
+        key = cls.cache_key(conversation_id)
+        keys = {cls.frame_key(key, record['stream'], seq): seq for seq in range(after + 1, record['last'] + 1)}
+        found = cache.get_many(keys)
+        return [(keys[k], *found[k]) for k in keys if k in found]
+
+    def append(self, seq, event, data):
+        self._record['last'] = seq
+        cache.set_many({
+            self.frame_key(self.key, self.stream_id, seq): (event, data),
+            self.key: self._record,
+        }, self.ttl)
+
+    def finish(self, state):
+        self._record['state'] = state
+        cache.set(self.key, self._record, self.ttl)
+
+
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+_END = object()
+
+
+class EventStream:
+    """Async iterator of SSE-encoded bytes for a stream of LLM tokens."""
+
+    def __init__(self, tokens, buffer=None, coalesce_bytes=COALESCE_BYTES,
+                 coalesce_delay=COALESCE_DELAY, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 max_pending=MAX_PENDING_TOKENS, detached_grace=DETACHED_GRACE):
+        self.tokens = tokens
+        self.buffer = buffer
+        self.coalesce_bytes = coalesce_bytes
+        self.coalesce_delay = coalesce_delay
+        self.heartbeat_interval = heartbeat_interval
+        self.max_pending = max_pending
+        self.detached_grace = detached_grace
+        self.stream_id = buffer.stream_id if buffer else uuid.uuid4().hex[:12]
+        self.detached = None
+        self._seq = 0
+        self._pending = []
+        self._pending_size = 0
+        self._deadline = None
+        self._state = 'streaming'
+
+    def __aiter__(self):
+        return self._frames()
+
+    async def _pump(self, queue):
+        try:
+            async for token in self.tokens:
+                await queue.put(token)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            await queue.put(_Failure(exc))
+            return
+        finally:
+            aclose = getattr(self.tokens, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+        await queue.put(_END)
+
+    def _frame(self, event, data):
+        self._seq += 1
+        if self.buffer is not None:
+            self.buffer.append(self._seq, event, data)
+        return format_event(data, event=event, id=f"{self.stream_id}:{self._seq}")
+
+    def _flush(self):
+        frame = self._frame(None, ''.join(self._pending))
+        self._pending, self._pending_size, self._deadline = [], 0, None
+        return frame
+
+    async def _next_frame(self, queue):
+        """
+        The next frame(s) to send, HEARTBEAT when idle, or None once the answer
+        has ended. Coalescing state lives on the stream, so a cancelled wait
+        loses nothing and the detached drain carries on where the client left.
+        """
+        loop = asyncio.get_running_loop()
+        while self._state == 'streaming':
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = self._deadline - loop.time() if self._pending else self.heartbeat_interval
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    return self._flush() if self._pending else HEARTBEAT
+
+            if item is _END or isinstance(item, _Failure):
+                frames = self._flush() if self._pending else b''
+                if item is _END:
+                    self._state = 'done'
+                    return frames + self._frame('done', '')
+                self._state = 'error'
+                return frames + self._frame('error', 'The assistant is unavailable, please try again.')
+
+            self._pending.append(item)
+            self._pending_size += len(item)
+            if self._deadline is None:
+                self._deadline = loop.time() + self.coalesce_delay
+            if self._pending_size >= self.coalesce_bytes or loop.time() >= self._deadline:
+                return self._flush()
+        return None
+
+    async def _frames(self):
+        queue = asyncio.Queue(self.max_pending)
+        pump = asyncio.create_task(self._pump(queue))
+        try:
+            yield format_event(retry=RECONNECT_DELAY_MS)
+            while (frame := await self._next_frame(queue)) is not None:
+                yield frame
+        finally:
+            if self._state == 'streaming' and self.buffer is not None:
+                # The client went away: finish the answer for a reconnect to follow
+                self.detached = asyncio.create_task(self._drain_detached(queue, pump))
+                _detached.add(self.detached)
+                self.detached.add_done_callback(_detached.discard)
+            else:
+                await self._close(pump)
+
+    async def _drain_detached(self, queue, pump):
+        async def drain():
+            while await self._next_frame(queue) is not None:
+                pass
+
+        try:
+            await asyncio.wait_for(drain(), self.detached_grace)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await self._close(pump)
+
+    async def _close(self, pump):
+        pump.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await pump
+        if self._state == 'streaming':
+            self._state = 'aborted'
+        if self.buffer is not None:
+            self.buffer.finish(self._state)
+
+
+# Streams still generating after their client disconnected, kept referenced until done
+_detached = set()
+
+
+async def replay(conversation_id, last_event_id=None, poll_interval=0.25,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, idle_timeout=60):
+    """
+    Re-send the frames after `last_event_id` from a conversation's ReplayBuffer,
+    then keep following it while the original answer is still being generated.
+    """
+    loop = asyncio.get_running_loop()
+    record = ReplayBuffer.load(conversation_id)
+    if record is None:
+        return
+    stream_id, _, last_seq = (last_event_id or '').partition(':')
+    sent = int(last_seq) if stream_id == record['stream'] and last_seq.isdigit() else 0
+    stream_id = record['stream']
+    last_progress = last_beat = loop.time()
+
+    yield format_event(retry=RECONNECT_DELAY_MS)
+    # A newer answer replacing the buffer ends the replay of this one
+    while record is not None and record['stream'] == stream_id:
+        for seq, event, data in ReplayBuffer.frames(conversation_id, record, sent):
+            sent = seq
+            last_progress = last_beat = loop.time()
+            yield format_event(data, event=event, id=f"{record['stream']}:{seq}")
+
+        if record['state'] == 'aborted':
+            yield format_event('', event='aborted')
+            return
+        if record['state'] != 'streaming' or loop.time() - last_progress > idle_timeout:
+            return
+
+        if loop.time() - last_beat >= heartbeat_interval:
+            last_beat = loop.time()
+            yield HEARTBEAT
+        await asyncio.sleep(poll_interval)
+        record = ReplayBuffer.load(conversation_id)
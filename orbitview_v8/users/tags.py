@@ -0,0 +1,203 @@
+"""
+Normalized tags: skills, nicknames, values and opportunities of a profile,
+topics and technologies of a work.
+
+Each distinct value is one Tag row per kind, keyed by its slug (lowercase,
+whitespace collapsed), and profiles and works point at tags through
+ProfileTag / WorkTag rows with their position in the list. A profile also
+gets ProfileTag rows for the union of its works' topics and technologies,
+kept in step by sync_work_tags(). "Everyone who knows Rust" is then one range
+of the (tag, profile) index (see tagged()) instead of a LIKE scan over
+comma-separated text.
+
+The models keep their old attributes through tag_list(): `profile.skills`
+still reads as 'Rust, Python' and accepts the same text, or a list, when
+assigned. Assigned values are held on the instance and written when it is
+saved (see signals.py).
+"""
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+
+
+MAX_TAG_LENGTH = 100
+PENDING_ATTR = '_pending_tags'
+# Kinds of tag on a work (through WorkTag), also rolled up onto its profile
+WORK_KINDS = ('topic', 'tech')
+
+
+def tag_slug(name):
+    return ' '.join(name.lower().split())[:MAX_TAG_LENGTH]
+
+
+def split_tags(value):
+    """
+    Tag names from 'a, b', "['a', 'b']" or a list, in order and without
+    repeats of the same slug.
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.strip().strip('[]').split(',')
+    names = {}
+    for item in value:
+        name = ' '.join(str(item).strip().strip('\'"').split())[:MAX_TAG_LENGTH]
+        if name:
+            names.setdefault(tag_slug(name), name)
+    return list(names.values())
+
+
+def _through(instance, relation):
+    return instance._meta.get_field(relation).related_model
+
+
+def tag_prefetch(relation, model=None):
+    """Prefetch of a profile's or work's tag rows, in order, with their tags."""
+    from .models import ProfileTag, WorkTag
+
+    through = model or {'profile_tags': ProfileTag, 'work_tags': WorkTag}[relation]
+    return Prefetch(relation, queryset=through.objects.select_related('tag').order_by('position'))
+
+
+def tag_rows(instance, relation):
+    """The instance's tag rows, loaded with one query the first time unless prefetched."""
+    if relation not in getattr(instance, '_prefetched_objects_cache', {}):
+        prefetch_related_objects([instance], tag_prefetch(relation, _through(instance, relation)))
+    return list(getattr(instance, relation).all())
+
+
+def tag_names(instance, kind, relation):
+    pending = instance.__dict__.get(PENDING_ATTR, {})
+    if kind in pending:
+        return pending[kind]
+    if instance._state.adding:
+        return []
+    return [row.tag.name for row in tag_rows(instance, relation) if row.tag.kind == kind]
+
+
+def tag_list(kind, relation):
+    """
+    Attribute standing in for a former comma-separated text column: reads as
+    'a, b' (None when empty) and takes text or a list of names.
+    """
+    def get_text(instance):
+        return ', '.join(tag_names(instance, kind, relation)) or None
+
+    def set_text(instance, value):
+        instance.__dict__.setdefault(PENDING_ATTR, {})[kind] = split_tags(value)
+
+    return property(get_text, set_text, doc=f"{kind} tags, as comma-separated text")
+
+
+def get_tags(kind, names):
+    """{slug: Tag} for `names`, creating the missing ones."""
+    from .models import Tag
+
+    wanted = {tag_slug(name): name for name in names}
+    tags = {tag.slug: tag for tag in Tag.objects.filter(kind=kind, slug__in=wanted)}
+    missing = [Tag(kind=kind, slug=slug, name=name) for slug, name in wanted.items() if slug not in tags]
+    if missing:
+        Tag.objects.bulk_create(missing, ignore_conflicts=True)
+        tags.update((tag.slug, tag) for tag in Tag.objects.filter(kind=kind, slug__in=[t.slug for t in missing]))
+    return tags
+
+
+def save_pending_tags(instance, relation):
+    """
+    Write the tag lists assigned since the instance was loaded or last saved.
+    Returns whether any changed.
+    """
+    pending = instance.__dict__.pop(PENDING_ATTR, None)
+    if not pending:
+        return False
+    through = _through(instance, relation)
+    owner = instance._meta.get_field(relation).field.attname
+    changed = False
+    with transaction.atomic():
+        for kind, names in pending.items():
+            tags = get_tags(kind, names)
+            wanted = [tags[tag_slug(name)].pk for name in names]
+            rows = through.objects.filter(**{owner: instance.pk, 'tag__kind': kind})
+            if list(rows.order_by('position').values_list('tag_id', flat=True)) == wanted:
+                continue
+            rows.delete()
+            through.objects.bulk_create([
+                through(**{owner: instance.pk, 'tag_id': tag_id, 'position': position})
+                for position, tag_id in enumerate(wanted)
+            ])
+            changed = True
+    getattr(instance, '_prefetched_objects_cache', {}).pop(relation, None)
+    return changed
+
+
+def sync_work_tags(profile_ids):
+    """
+    Set the profiles' own topic and tech rows to the union of their works'
+    ones, in work order, so profiles are found by those tags without
+    going through their works.
+    """
+    from .models import ProfileTag, WorkTag
+
+    rows = WorkTag.objects.filter(work__profile_id__in=profile_ids, tag__kind__in=WORK_KINDS).order_by(
+        'work__profile_id', 'work__display_order', 'work_id', 'position'
+    ).values_list('work__profile_id', 'tag_id')
+    wanted = {}
+    for profile_id, tag_id in rows:
+        wanted.setdefault(profile_id, {})[tag_id] = None
+    with transaction.atomic():
+        ProfileTag.objects.filter(profile_id__in=profile_ids, tag__kind__in=WORK_KINDS).delete()
+        ProfileTag.objects.bulk_create([
+            ProfileTag(profile_id=profile_id, tag_id=tag_id, position=position)
+            for profile_id, tag_ids in wanted.items()
+            for position, tag_id in enumerate(tag_ids)
+        ], batch_size=5000)
+
+
+def create_pending_tags(instances, relation):
+    """
+    Write the tag lists of instances just made with bulk_create(), which
+    doesn't send the post_save that save_pending_tags() runs on.
+    """
+    if not instances:
+        return
+    through = _through(instances[0], relation)
+    owner = instances[0]._meta.get_field(relation).field.attname
+    pending = [(instance, instance.__dict__.pop(PENDING_ATTR, {})) for instance in instances]
+    names = {}
+    for _, lists in pending:
+        for kind, values in lists.items():
+            names.setdefault(kind, {}).update((tag_slug(name), name) for name in values)
+    tags = {kind: get_tags(kind, kind_names.values()) for kind, kind_names in names.items()}
+    through.objects.bulk_create([
+        through(**{owner: instance.pk, 'tag_id': tags[kind][tag_slug(name)].pk, 'position': position})
+        for instance, lists in pending
+        for kind, values in lists.items()
+        for position, name in enumerate(values)
+    ], batch_size=5000)
+    if relation == 'work_tags':
+        sync_work_tags(list({instance.profile_id for instance in instances}))
+
+
+def tagged(queryset, kind, name):
+    """
+    Profiles (or works) of `queryset` with the tag `name` of `kind`, joined
+    on the (tag, owner) index; a profile has the topics and tech of its works.
+    Ordered by primary key, the order that index returns them in, so a page
+    of a common tag doesn't sort every match.
+    """
+    from .models import OrbitViewProfile, Tag
+
+    tag = Tag.objects.filter(kind=kind, slug=tag_slug(name)).first()
+    if tag is None:
+        return queryset.none()
+    relation = 'profile_tags' if queryset.model is OrbitViewProfile else 'work_tags'
+    owner = queryset.model._meta.get_field(relation).field.attname
+    # One row per owner and tag, so the join doesn't repeat owners
+    return queryset.filter(**{f'{relation}__tag': tag}).order_by(f'{relation}__{owner}')
+
+
+def tag_count(kind, name, relation='profile_tags'):
+    """How many profiles (or works) have the tag, counted on the index alone."""
+    from .models import Tag
+
+    through = Tag._meta.get_field(relation).related_model
+    return through.objects.filter(tag__kind=kind, tag__slug=tag_slug(name)).count()
@@ -1,3 +1,1616 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
\ No newline at end of file
+import httpx
+import rsa
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from google.auth import crypt, jwt
+from PIL import Image
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from . import archive, google_tokens, history, tokens
+from .analytics import ProfileAnalytics, dashboard, profile_analytics, rollup_day
+from .auth_cache import CachedModelBackend
+from .context_ingest import chunk_text, context_ingestion, ingest_context_file, needs_ingestion
+from .counters import ProfileCounters, profile_counters
+from .fake_llm import FakeLLMServer
+from .google_tokens import (
+    GoogleCertsSource,
+    GoogleTokenVerifier,
+    KeyStore,
+    StaticKeySource,
+    configure_token_verifier,
+)
+from .hll import HyperLogLog
+from .images import needs_processing, process_image
+from .llm import CircuitOpenError, LLMGateway, configure_gateway
+from .models import (
+    Accomplishment,
+    AIPersonality,
+    ArchivedConversation,
+    ChatArchive,
+    ContextFile,
+    Conversation,
+    CounterShard,
+    Message,
+    OrbitViewProfile,
+    PopularQuestionDay,
+    PrivacySettings,
+    ProfileContext,
+    SearchDocument,
+    SearchTerm,
+    SocialLink,
+    User,
+    UsernameSequence,
+    Work,
+    WorkImage,
+    WorkLink,
+)
+from .personality import RESPONSE_MAX_TOKENS, aresolve
+from .popular_questions import PopularQuestionPipeline, popular_questions, top_questions
+from .profile_context import compile_profile_context, render_context_file, render_work
+from .profile_version import profile_version
+from .prompts import PromptNotFound, PromptRegistry, personality_values, prompt_registry
+from .response_cache import ResponseCache, personality_fingerprint, response_cache
+from .retrieval import build_context, index_profile, retrieval_index, section_changed
+from .search import rebuild_index, search
+from .sse import HEARTBEAT, EventStream, ReplayBuffer, format_event, replay
+from .tags import tag_count, tagged
+from .tokens import fit_messages, message_tokens
+from .usernames import allocate_username, create_profile, create_with_unique_username, username_base
+from .write_behind import MessageWriter, message_writer
+
+
+class LLMGatewayTests(SimpleTestCase):
+    """The gateway against a local stub server instead of the real provider."""
+
+    def gateway(self, server, **options):
+        options.setdefault('backoff_base', 0)
+        gateway = LLMGateway(api_key='test', base_url=server.base_url, **options)
+        self.addCleanup(gateway.close)
+        return gateway
+
+    def test_streams_tokens(self):
+        with FakeLLMServer(reply='hello there', first_token_delay=0) as server:
+            gateway = self.gateway(server)
+            tokens = list(gateway.stream_chat_sync('test-model', [{'role': 'user', 'content': 'hi'}]))
+        self.assertEqual(''.join(tokens), 'hello there ')
+
+    def test_retries_transient_failures(self):
+        with FakeLLMServer(reply='ok', first_token_delay=0, fail_first=2) as server:
+            gateway = self.gateway(server, max_retries=2)
+
+            async def ask():
+                return await gateway.complete('test-model', [{'role': 'user', 'content': 'hi'}])
+
+            self.assertEqual(asyncio.run(ask()), 'ok')
+        self.assertEqual(gateway.metrics()['models']['test-model']['retries'], 2)
+
+    def test_circuit_opens_after_repeated_failures(self):
+        with FakeLLMServer(first_token_delay=0, fail_first=100) as server:
+            gateway = self.gateway(server, max_retries=0, breaker_threshold=2)
+            messages = [{'role': 'user', 'content': 'hi'}]
+            for _ in range(2):
+                with self.assertRaises(Exception):
+                    gateway.complete_sync('test-model', messages)
+            with self.assertRaises(CircuitOpenError):
+                gateway.complete_sync('test-model', messages)
+            self.assertFalse(gateway.available('test-model'))
+            self.assertEqual(server.requests_served, 2)
+
+    def test_abandoned_trial_reopens_the_half_open_circuit(self):
+        with FakeLLMServer(reply='ok', first_token_delay=0.3, fail_first=1) as server:
+            gateway = self.gateway(server, max_retries=0, breaker_threshold=1, breaker_reset_timeout=0)
+            messages = [{'role': 'user', 'content': 'hi'}]
+            with self.assertRaises(Exception):
+                gateway.complete_sync('test-model', messages)
+
+            async def give_up():
+                await asyncio.wait_for(gateway.complete('test-model', messages), 0.05)
+
+            # The trial call is cancelled, which says nothing about the provider
+            with self.assertRaises(asyncio.TimeoutError):
+                asyncio.run(give_up())
+            self.assertEqual(gateway.complete_sync('test-model', messages), 'ok')
+            self.assertEqual(gateway.metrics()['models']['test-model']['circuit'], 'closed')
+            # Its client was closed with the loop that used it
+            self.assertTrue(gateway._async_client.is_closed())
+
+
+def sse_events(body):
+    """Parsed frames of an SSE body: dicts of their fields, comments under ':'."""
+    events = []
+    for frame in body.decode().split('\n\n'):
+        if not frame:
+            continue
+        event = {}
+        for line in frame.split('\n'):
+            name, _, value = line.partition(': ')
+            event[name] = f"{event[name]}\n{value}" if name in event else value
+        events.append(event)
+    return events
+
+
+class EventStreamTests(SimpleTestCase):
+    """SSE framing, heartbeats and replay of a stream of tokens."""
+
+    def collect(self, stream):
+        async def read():
+            return b''.join([frame async for frame in stream])
+        return asyncio.run(read())
+
+    def test_frames_are_encoded_line_by_line(self):
+        self.assertEqual(
+            format_event('one\ntwo', event='note', id='s:1'),
+            b'id: s:1\nevent: note\ndata: one\ndata: two\n\n',
+        )
+
+    def test_coalesces_tokens_and_sends_heartbeats(self):
+        async def tokens():
+            yield 'hel'
+            yield 'lo'
+            await asyncio.sleep(0.1)
+            yield ' there'
+
+        body = self.collect(EventStream(tokens(), coalesce_delay=0.01, heartbeat_interval=0.03))
+        events = sse_events(body)
+        self.assertIn('retry', events[0])
+        self.assertIn(HEARTBEAT, body)
+        data = [event['data'] for event in events if 'data' in event and 'event' not in event]
+        self.assertEqual(data, ['hello', ' there'])
+        self.assertEqual(events[-1]['event'], 'done')
+
+    def test_failed_stream_is_replayed_after_last_event_id(self):
+        async def tokens():
+            yield 'partial'
+            raise RuntimeError('upstream went away')
+
+        conversation_id = uuid.uuid4()
+        buffer = ReplayBuffer(conversation_id, owner='owner')
+        events = sse_events(self.collect(EventStream(tokens(), buffer=buffer, coalesce_delay=0)))
+        self.assertEqual(events[-1]['event'], 'error')
+        self.assertEqual(ReplayBuffer.load(conversation_id)['state'], 'error')
+
+        ids = [event['id'] for event in events if 'id' in event]
+        replayed = sse_events(self.collect(replay(conversation_id, ids[0])))
+        self.assertEqual([event['id'] for event in replayed if 'id' in event], ids[1:])
+        self.assertEqual(len(sse_events(self.collect(replay(conversation_id)))), len(events))
+
+    def test_dropped_stream_is_finished_for_a_reconnect(self):
+        answered = []
+
+        async def tokens():
+            for token in ('one', ' two', ' three'):
+                yield token
+                await asyncio.sleep(0.05)
+            answered.append(True)
+
+        async def drop_and_resume():
+            conversation_id = uuid.uuid4()
+            stream = EventStream(tokens(), buffer=ReplayBuffer(conversation_id, owner='owner'), coalesce_delay=0)
+            received = []
+            first_data = asyncio.Event()
+
+            async def read():
+                async for frame in stream:
+                    received.append(frame)
+                    if frame.startswith(b'id: '):
+                        first_data.set()
+
+            client = asyncio.create_task(read())
+            await first_data.wait()
+            client.cancel()
+            ids = [event['id'] for event in sse_events(b''.join(received)) if 'id' in event]
+            resumed = b''.join([frame async for frame in replay(conversation_id, ids[-1], poll_interval=0.01)])
+            await stream.detached
+            return sse_events(b''.join(received)), sse_events(resumed)
+
+        sent, resumed = asyncio.run(drop_and_resume())
+        data = [event['data'] for event in sent + resumed if 'data' in event and 'event' not in event]
+        self.assertEqual(''.join(data), 'one two three')
+        self.assertEqual(resumed[-1]['event'], 'done')
+        self.assertEqual(answered, [True])
+
+
+class ProfileChatTests(TestCase):
+    """The chat endpoint against a local stub LLM server."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='chatty', email='chatty@example.com')
+        self.profile = OrbitViewProfile.objects.create(
+            user=self.user, username='chatty', first_name='Chat', last_name='Ty', is_public=True
+        )
+        server = FakeLLMServer(reply='hello there', first_token_delay=0, token_delay=0).start()
+        self.addCleanup(server.stop)
+        configure_gateway(api_key='test', base_url=server.base_url, max_retries=0)
+        self.addCleanup(configure_gateway)
+        # Messages are written as they're added, inside the test transaction
+        writer = mock.patch.object(message_writer, 'enabled', False)
+        writer.start()
+        self.addCleanup(writer.stop)
+        for pipeline in (profile_counters, profile_analytics, popular_questions):
+            self.addCleanup(pipeline.flush)
+
+    async def ask(self, message, **headers):
+        response = await self.async_client.post(
+            '/api/profiles/chatty/chat/', {'message': message}, content_type='application/json', headers=headers
+        )
+        if response.status_code != 200:
+            return response, None
+        return response, sse_events(b''.join([part async for part in response.streaming_content]))
+
+    async def test_streams_answer_and_resumes_after_last_event_id(self):
+        response, events = await self.ask('What do you build?')
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertEqual(''.join(event['data'] for event in events if 'data' in event and 'event' not in event),
+                         'hello there ')
+        self.assertEqual(events[-1]['event'], 'done')
+        conversation_id = response['X-Conversation-Id']
+        self.assertEqual(
+            await Message.objects.filter(conversation_id=conversation_id).acount(), 2
+        )
+
+        ids = [event['id'] for event in events if 'id' in event]
+        resumed = await self.async_client.get(
+            f'/api/profiles/chatty/chat/{conversation_id}/resume/', headers={'Last-Event-ID': ids[0]}
+        )
+        replayed = sse_events(b''.join([part async for part in resumed.streaming_content]))
+        self.assertEqual([event['id'] for event in replayed if 'id' in event], ids[1:])
+
+        # The same opening question in a new conversation is answered from the cache
+        response, events = await self.ask('what do you build')
+        self.assertEqual(response['X-Cache'], 'hit')
+
+    async def test_answer_is_finished_and_saved_after_a_disconnect(self):
+        server = FakeLLMServer(tokens=6, first_token_delay=0, token_delay=0.05).start()
+        self.addCleanup(server.stop)
+        configure_gateway(api_key='test', base_url=server.base_url, max_retries=0)
+        response = await self.async_client.post(
+            '/api/profiles/chatty/chat/', {'message': 'Tell me more'}, content_type='application/json'
+        )
+        received = []
+        first_data = asyncio.Event()
+
+        async def read():
+            async for part in response.streaming_content:
+                received.append(part)
+                if part.startswith(b'id: '):
+                    first_data.set()
+
+        # The client goes away after the first frame of the answer
+        client = asyncio.create_task(read())
+        await first_data.wait()
+        client.cancel()
+        sent = sse_events(b''.join(received))
+        conversation_id = response['X-Conversation-Id']
+        resumed = await self.async_client.get(
+            f'/api/profiles/chatty/chat/{conversation_id}/resume/', headers={'Last-Event-ID': sent[-1]['id']}
+        )
+        replayed = sse_events(b''.join([part async for part in resumed.streaming_content]))
+        self.assertEqual(replayed[-1]['event'], 'done')
+        answer = ''.join(event['data'] for event in sent + replayed if 'data' in event and 'event' not in event)
+        saved = await Message.objects.filter(conversation_id=conversation_id, role='assistant').afirst()
+        self.assertEqual(saved.content, answer)
+
+    async def test_hidden_profiles_are_not_chatted_with(self):
+        privacy = await PrivacySettings.objects.acreate(profile=self.profile, visibility='private')
+        response, _ = await self.ask('Hi?')
+        self.assertEqual(response.status_code, 404)
+        await self.async_client.aforce_login(self.user)
+        response, _ = await self.ask('Hi?')
+        self.assertEqual(response.status_code, 200)
+        await self.async_client.alogout()
+
+        privacy.visibility = 'public'
+        privacy.password_protected = make_password('open sesame')
+        await privacy.asave()
+        response, _ = await self.ask('Hi?')
+        self.assertEqual(response.status_code, 404)
+        response, _ = await self.ask('Hi?', **{'X-Profile-Password': 'open sesame'})
+        self.assertEqual(response.status_code, 200)
+
+    async def test_rejects_bad_bodies(self):
+        for body in ('[1, 2]', '"hi"', '{'):
+            response = await self.async_client.post(
+                '/api/profiles/chatty/chat/', body, content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400)
+        for message in ('', '   ', 42, ['hi'], {'text': 'hi'}, True):
+            response, _ = await self.ask(message)
+            self.assertEqual(response.status_code, 400)
+
+    async def test_idle_conversations_are_kept_live_by_a_new_turn(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        response, _ = await self.ask('What do you build?')
+        conversation_id = response['X-Conversation-Id']
+        idle = timezone.now() - datetime.timedelta(days=400)
+        await Conversation.objects.filter(pk=conversation_id).aupdate(last_activity=idle)
+
+        async def turn():
+            return await self.async_client.post(
+                '/api/profiles/chatty/chat/', {'message': 'And then?', 'conversation_id': conversation_id},
+                content_type='application/json',
+            )
+
+        # Its messages still queued for write-behind, the turn alone keeps it out of the archive
+        with mock.patch.object(message_writer, 'aadd_message', mock.AsyncMock()):
+            response = await turn()
+            self.assertEqual(response.status_code, 200)
+            b''.join([part async for part in response.streaming_content])
+        cutoff = timezone.now() - datetime.timedelta(days=30)
+        self.assertEqual(await sync_to_async(archive.archive_batch)(cutoff), 0)
+
+        await Conversation.objects.filter(pk=conversation_id).aupdate(last_activity=idle)
+        self.assertEqual(await sync_to_async(archive.archive_batch)(cutoff), 1)
+        self.assertEqual((await turn()).status_code, 404)
+
+        # Archived by a run that stopped before purging it
+        conversation = await Conversation.objects.acreate(profile=self.profile)
+        chat_archive = await ChatArchive.objects.acreate(
+            profile=self.profile, month=idle.date().replace(day=1), file='chat_archives/x.jsonl.gz', compression='gzip'
+        )
+        await ArchivedConversation.objects.acreate(
+            id=conversation.pk, profile=self.profile, archive=chat_archive,
+            started_at=conversation.started_at, last_activity=conversation.last_activity,
+        )
+        conversation_id = str(conversation.pk)
+        self.assertEqual((await turn()).status_code, 410)
+
+
+class ResponseCacheTests(TestCase):
+    """Cached opening answers: what hits, what misses and what retires them."""
+
+    def setUp(self):
+        self.cache = ResponseCache(ttl=60)
+        self.namespace = ResponseCache.namespace('profile', 'v1', personality_fingerprint({'tone': 'casual'}))
+
+    def test_hits_only_the_same_question(self):
+        self.cache.set(self.namespace, 'Are you open to roles in SF?', 'Yes')
+        self.assertEqual(self.cache.get(self.namespace, 'are you open to roles in sf'), 'Yes')
+        # Exact matching by default: one word changes the question
+        self.assertIsNone(self.cache.get(self.namespace, 'Are you not open to roles in SF?'))
+        other = ResponseCache.namespace('profile', 'v1', personality_fingerprint({'tone': 'witty'}))
+        self.assertIsNone(self.cache.get(other, 'Are you open to roles in SF?'))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_reworded_questions_match_only_when_enabled(self):
+        self.assertEqual(settings.RESPONSE_CACHE_SIMILARITY, 0)
+        similar = ResponseCache(similarity_threshold=0.5)
+        similar.set(self.namespace, 'What have you built using Java at your last job?', 'Java things')
+        self.assertEqual(similar.get(self.namespace, 'What did you build using Java at your last job?'), 'Java things')
+
+    def test_expiry_and_invalidation(self):
+        self.cache.set(self.namespace, 'Hi?', 'Hello')
+        self.cache.invalidate_profile('profile')
+        self.assertIsNone(self.cache.get(self.namespace, 'Hi?'))
+
+        expiring = ResponseCache(ttl=0)
+        expiring.set(self.namespace, 'Hi?', 'Hello')
+        self.assertIsNone(expiring.get(self.namespace, 'Hi?'))
+
+        user = User.objects.create_user(username='cached', email='cached@example.com')
+        profile = OrbitViewProfile.objects.create(user=user, username='cached', first_name='Ca', last_name='Ched')
+        namespace = ResponseCache.namespace(profile.id, profile_version(profile.id), '')
+        response_cache.set(namespace, 'Hi?', 'Hello')
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.byline = 'Changed'
+            profile.save()
+        self.assertIsNone(response_cache.get(namespace, 'Hi?'))
+        self.assertNotEqual(profile_version(profile.id), namespace[1])
+
+
+class ChatHistoryTests(TestCase):
+    """Token-budgeted history windows and the rolling summary."""
+
+    def setUp(self):
+        user = User.objects.create_user(username='historic', email='historic@example.com')
+        profile = OrbitViewProfile.objects.create(user=user, username='historic', first_name='His', last_name='Toric')
+        self.conversation = Conversation.objects.create(profile=profile)
+        start = timezone.now() - datetime.timedelta(hours=1)
+        for i in range(10):
+            Message.objects.create(
+                conversation=self.conversation, role='user' if i % 2 == 0 else 'assistant',
+                content=f"turn {i} " + 'word ' * 20, timestamp=start + datetime.timedelta(minutes=i),
+            )
+        # Queued, not yet written, like the newest turns of a live chat
+        self.writer = MessageWriter(interval=3600)
+        self.addCleanup(self.writer.flush)
+        patched = mock.patch.object(history, 'message_writer', self.writer)
+        patched.start()
+        self.addCleanup(patched.stop)
+
+    def test_fit_keeps_the_newest_messages(self):
+        history_messages = [{'role': 'user', 'content': f"message {i}"} for i in range(5)]
+        cost = message_tokens(history_messages[0])
+        system = [{'role': 'system', 'content': 'You are helpful'}]
+        messages, dropped = fit_messages(system, history_messages, 'question', cost * 3)
+        self.assertEqual(dropped, 3)
+        self.assertEqual([m['content'] for m in messages], ['You are helpful', 'message 3', 'message 4', 'question'])
+
+    def test_counting_never_loads_the_encoding(self):
+        with mock.patch.object(tokens, '_encoding', None), \
+                mock.patch.object(tokens.tiktoken, 'get_encoding', side_effect=OSError('offline')) as get_encoding:
+            self.assertGreater(tokens.count_tokens('How long have you worked in Toronto?'), 0)
+            get_encoding.assert_not_called()
+            with self.assertLogs('users.tokens', 'WARNING'):
+                self.assertFalse(tokens.load_encoding())
+
+    def test_prompt_includes_queued_turns_and_summary_within_budget(self):
+        self.writer.add_message(self.conversation.pk, 'user', 'queued question')
+        self.conversation.summary = 'They asked about turns 0 to 3.'
+        self.conversation.summary_through = Message.objects.order_by('timestamp')[3].timestamp
+
+        messages, overflow = async_to_sync(history.abuild_prompt)(
+            self.conversation, 'System prompt', 'new question', 'llama-3.1-8b-instant', 100
+        )
+        self.assertFalse(overflow)
+        self.assertIn('turns 0 to 3', messages[1]['content'])
+        contents = [m['content'] for m in messages[2:]]
+        self.assertTrue(contents[0].startswith('turn 4 '))
+        self.assertEqual(contents[-2:], ['queued question', 'new question'])
+
+        with self.settings(CHAT_HISTORY_MAX_TOKENS=100):
+            messages, overflow = async_to_sync(history.abuild_prompt)(
+                self.conversation, 'System prompt', 'new question', 'llama-3.1-8b-instant', 100
+            )
+        self.assertTrue(overflow)
+        self.assertLess(len(messages), 9)
+        self.assertEqual(messages[-1]['content'], 'new question')
+
+    def test_summary_folds_old_turns_and_keeps_recent_ones(self):
+        with FakeLLMServer(reply='A short summary.', first_token_delay=0) as server:
+            configure_gateway(api_key='test', base_url=server.base_url, max_retries=0)
+            self.addCleanup(configure_gateway)
+            keep = message_tokens(Message.objects.values('content').first()) * 3
+            async_to_sync(history.asummarize)(self.conversation.pk, keep)
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary, 'A short summary.')
+        ordered = list(Message.objects.order_by('timestamp'))
+        self.assertEqual(self.conversation.summary_through, ordered[6].timestamp)
+        remaining = async_to_sync(history.aload_history)(self.conversation)
+        self.assertEqual(len(remaining), 3)
+
+
+class MessageWriterTests(TransactionTestCase):
+    """Write-behind chat messages, committed for real so foreign keys are checked."""
+
+    def setUp(self):
+        user = User.objects.create_user(username='writer', email='writer@example.com')
+        profile = OrbitViewProfile.objects.create(user=user, username='writer', first_name='Wri', last_name='Ter')
+        self.kept = Conversation.objects.create(profile=profile)
+        self.gone = Conversation.objects.create(profile=profile)
+        self.writer = MessageWriter(interval=3600, max_attempts=2)
+        self.addCleanup(self.writer.close)
+
+    def test_failing_conversation_does_not_hold_back_others(self):
+        for i in range(3):
+            self.writer.add_message(self.kept.pk, 'user', f"kept {i}")
+            self.writer.add_message(self.gone.pk, 'user', f"gone {i}")
+        # Archived or deleted while its messages were queued
+        gone = self.gone.pk
+        self.gone.delete()
+
+        with self.assertLogs('users.write_behind', 'ERROR'):
+            self.assertEqual(self.writer.flush(), 3)
+        self.assertEqual(Message.objects.filter(conversation=self.kept).count(), 3)
+        self.kept.refresh_from_db()
+        self.assertEqual(self.kept.last_message_preview, 'kept 2')
+        self.assertEqual(len(self.writer.pending_messages(gone)), 3)
+
+        # Later messages keep flowing while the bad ones are retried, then dropped
+        self.writer.add_message(self.kept.pk, 'assistant', 'kept 3')
+        with self.assertLogs('users.write_behind', 'ERROR') as logs:
+            self.assertEqual(self.writer.flush(), 1)
+        self.assertIn('Dropping 3 chat messages', logs.output[-1])
+        self.assertEqual(self.writer.pending_messages(gone), [])
+        self.assertEqual(self.writer.flush(), 0)
+        self.assertEqual(Message.objects.filter(conversation=self.kept).count(), 4)
+
+    def test_retried_messages_are_written_once(self):
+        self.writer.add_message(self.kept.pk, 'user', 'hello')
+        message = self.writer.pending_messages(self.kept.pk)[0]
+        self.writer.flush()
+        # A flush that failed after its INSERT committed puts the same rows back
+        self.writer._messages.append(message)
+        self.assertEqual(self.writer.flush(), 1)
+        self.assertEqual(Message.objects.filter(conversation=self.kept).count(), 1)
+
+
+class PopularQuestionsTests(TransactionTestCase):
+    """Clustering visitor questions into counted rows, committed so foreign keys are checked."""
+
+    def setUp(self):
+        cache.clear()
+        self.profiles = []
+        for name in ('asked', 'deleted'):
+            user = User.objects.create_user(username=name, email=f"{name}@example.com")
+            self.profiles.append(OrbitViewProfile.objects.create(
+                user=user, username=name, first_name='Pop', last_name='Ular'
+            ))
+        self.pipeline = PopularQuestionPipeline(interval=3600, similarity=0.5, max_attempts=2)
+        self.addCleanup(self.pipeline.close)
+
+    def test_rewordings_join_one_cluster(self):
+        asked = self.profiles[0].id
+        for question in ('What are you building?', 'what are you building', 'What are you building now?',
+                         'Where are you based?'):
+            self.pipeline.record(asked, question)
+        self.assertEqual(self.pipeline.flush(), 4)
+        self.assertEqual(top_questions(asked), [
+            {'question': 'What are you building?', 'count': 3},
+            {'question': 'Where are you based?', 'count': 1},
+        ])
+        self.pipeline.record(asked, 'Where are you based?')
+        self.pipeline.flush()
+        self.assertEqual([row['count'] for row in top_questions(asked)], [3, 2])
+        self.assertEqual(PopularQuestionDay.objects.filter(profile_id=asked).count(), 2)
+
+    def test_deleted_profile_does_not_block_the_queue(self):
+        asked, deleted = (profile.id for profile in self.profiles)
+        self.pipeline.record(asked, 'What are you building?')
+        self.pipeline.record(deleted, 'What are you building?')
+        self.profiles[1].delete()
+
+        with self.assertLogs('users.popular_questions', 'ERROR'):
+            self.assertEqual(self.pipeline.flush(), 1)
+        self.assertEqual(top_questions(asked), [{'question': 'What are you building?', 'count': 1}])
+        self.assertEqual(len(self.pipeline._queue), 1)
+        with self.assertLogs('users.popular_questions', 'ERROR') as logs:
+            self.assertEqual(self.pipeline.flush(), 0)
+        self.assertIn('Dropping 1 popular questions', logs.output[-1])
+        self.assertEqual(self.pipeline._queue, [])
+
+
+class ProfileCountersTests(TransactionTestCase):
+    """Counters hit from many threads while a flusher writes them out."""
+
+    def setUp(self):
+        user = User.objects.create_user(username='counted', email='counted@example.com')
+        self.profile = OrbitViewProfile.objects.create(
+            user=user, username='counted', first_name='Count', last_name='Ed'
+        )
+
+    def hammer(self, counters, threads=32, views=500):
+        start = threading.Barrier(threads + 2)
+        done = threading.Event()
+
+        def visitor():
+            start.wait()
+            for _ in range(views):
+                counters.incr(self.profile.pk, 'total_views')
+
+        def flusher():
+            start.wait()
+            while not done.is_set():
+                counters.flush()
+
+        workers = [threading.Thread(target=visitor) for _ in range(threads)]
+        background = threading.Thread(target=flusher)
+        for thread in workers + [background]:
+            thread.start()
+        start.wait()
+        for thread in workers:
+            thread.join()
+        done.set()
+        background.join()
+        return threads * views
+
+    def test_no_lost_increments(self):
+        counters = ProfileCounters(shards=1)
+        expected = self.hammer(counters)
+        self.assertEqual(counters.counts(self.profile.pk)['total_views'], expected)
+        counters.flush()
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.total_views, expected)
+
+    def test_hot_counters_are_sharded_and_folded(self):
+        counters = ProfileCounters(shards=4, hot_threshold=1, fold_every=1000)
+        expected = self.hammer(counters)
+        counters.flush()
+        self.assertTrue(CounterShard.objects.filter(profile=self.profile).exists())
+        self.assertEqual(counters.counts(self.profile.pk)['total_views'], expected)
+
+        counters.fold_shards()
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.total_views, expected)
+        self.assertFalse(CounterShard.objects.filter(profile=self.profile).exclude(value=0).exists())
+
+
+class ProfileDetailTests(TestCase):
+    """The profile page read model."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='paged', email='paged@example.com')
+        cls.profile = OrbitViewProfile.objects.create(
+            user=user, username='paged', first_name='Page', last_name='Ed', is_public=True
+        )
+        PrivacySettings.objects.create(profile=cls.profile, is_public=True, visibility='public')
+        AIPersonality.objects.create(profile=cls.profile)
+        Accomplishment.objects.create(
+            profile=cls.profile, title='Prize', issuer='Org', description='Won',
+            date=datetime.date(2024, 1, 1), type='award',
+        )
+        SocialLink.objects.create(profile=cls.profile, platform='github', url='https://github.com/paged')
+
+    def setUp(self):
+        cache.clear()
+        # Write counted views inside the test transaction, not from the flusher thread later
+        self.addCleanup(profile_counters.flush)
+        self.addCleanup(profile_analytics.flush)
+
+    def add_works(self, count):
+        for i in range(count):
+            work = Work.objects.create(profile=self.profile, title=f"Work {i}", description='Built it')
+            WorkImage.objects.create(work=work, image='work_images/w.png', url='https://cdn.example.com/w.png')
+            WorkLink.objects.create(work=work, url='https://example.com')
+
+    def queries_for_page(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/profiles/paged/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_query_count_is_constant(self):
+        self.add_works(1)
+        few, page = self.queries_for_page()
+        self.assertEqual(len(page['works']), 1)
+
+        self.add_works(20)
+        many, page = self.queries_for_page()
+        self.assertEqual(len(page['works']), 21)
+        self.assertEqual(len(page['works'][0]['images']), 1)
+        self.assertEqual(few, many)
+
+    def test_private_profile_is_hidden(self):
+        PrivacySettings.objects.filter(profile=self.profile).update(visibility='private')
+        response = self.client.get('/api/profiles/paged/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_popular_questions_follow_page_access(self):
+        url = '/api/profiles/paged/popular-questions/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        PrivacySettings.objects.filter(profile=self.profile).update(visibility='private')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        follower = User.objects.create_user(username='fan', email='fan@example.com')
+        self.profile.followers.add(follower)
+        self.client.force_login(follower)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.logout()
+
+        PrivacySettings.objects.filter(profile=self.profile).update(
+            visibility='public', password_protected=make_password('open sesame')
+        )
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url, headers={'X-Profile-Password': 'open sesame'}).status_code, 200)
+
+    def test_cached_page_revalidates_without_queries(self):
+        first = self.client.get('/api/profiles/paged/')
+        self.assertEqual(first['Cache-Control'], 'public, max-age=0, must-revalidate')
+        etag = first['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/profiles/paged/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Any change to the profile retires the cached page
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile.byline = 'Changed'
+            self.profile.save()
+        response = self.client.get('/api/profiles/paged/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['byline'], 'Changed')
+
+    def test_unlisted_profile_is_not_cached(self):
+        PrivacySettings.objects.filter(profile=self.profile).update(visibility='unlisted')
+        response = self.client.get('/api/profiles/paged/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-store')
+        self.assertIsNone(cache.get('profile-page:paged'))
+
+
+class ImagePipelineTests(TestCase):
+    """Variants, orientation and metadata of processed uploads."""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(
+            MEDIA_ROOT=media_root.name,
+            IMAGE_VARIANT_WIDTHS=[320, 640],
+            IMAGE_VARIANT_FORMATS=['webp', 'jpeg'],
+            IMAGE_DEFAULT_WIDTH=640,
+        ))
+        user = User.objects.create_user(username='pictures', email='pictures@example.com')
+        profile = OrbitViewProfile.objects.create(user=user, username='pictures', first_name='P', last_name='Ic')
+        self.work = Work.objects.create(profile=profile, title='Photos', description='')
+
+    def upload(self):
+        # Stored landscape, shot portrait: orientation 6 means rotate 90 degrees
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Camera'
+        buffer = io.BytesIO()
+        Image.new('RGB', (1000, 800), 'red').save(buffer, 'JPEG', exif=exif.tobytes())
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_processes_variants(self):
+        row = WorkImage.objects.create(work=self.work, image=self.upload())
+        self.assertTrue(needs_processing(row))
+        process_image(row)
+
+        row.refresh_from_db()
+        self.assertFalse(needs_processing(row))
+        self.assertEqual((row.width, row.height), (800, 1000))
+        self.assertEqual(
+            [(item['width'], item['format']) for item in row.variants['items']],
+            [(320, 'webp'), (320, 'jpeg'), (640, 'webp'), (640, 'jpeg'), (800, 'webp'), (800, 'jpeg')],
+        )
+        self.assertTrue(row.url.endswith('-640w.webp'))
+        with default_storage.open(row.variants['items'][1]['name']) as handle, Image.open(handle) as variant:
+            self.assertEqual(variant.size, (320, 400))
+            self.assertEqual(len(variant.getexif()), 0)
+
+    def test_reprocessing_replaces_old_variants(self):
+        row = WorkImage.objects.create(work=self.work, image=self.upload())
+        process_image(row)
+        old = [item['name'] for item in row.variants['items']]
+
+        row.image = self.upload()
+        row.save()
+        process_image(row)
+        self.assertFalse(any(default_storage.exists(name) for name in old))
+        self.assertTrue(all(default_storage.exists(item['name']) for item in row.variants['items']))
+
+    def test_stale_job_does_not_overwrite_a_newer_upload(self):
+        row = WorkImage.objects.create(work=self.work, image=self.upload())
+        stale = WorkImage.objects.get(pk=row.pk)
+        stale_variants = []
+        save = default_storage.save
+
+        def record(name, content, **kwargs):
+            stale_variants.append(save(name, content, **kwargs))
+            return stale_variants[-1]
+
+        # Replaced while the first job was still making its variants
+        row.image = self.upload()
+        row.save()
+        process_image(row)
+        with mock.patch.object(default_storage, 'save', side_effect=record):
+            self.assertIsNone(process_image(stale))
+
+        fresh = WorkImage.objects.get(pk=row.pk)
+        self.assertEqual(fresh.variants, row.variants)
+        self.assertEqual(fresh.url, row.url)
+        self.assertTrue(all(default_storage.exists(item['name']) for item in fresh.variants['items']))
+        self.assertTrue(stale_variants)
+        self.assertFalse(any(default_storage.exists(name) for name in stale_variants))
+
+
+@override_settings(CONTEXT_CHUNK_CHARS=100, CONTEXT_CHUNK_OVERLAP=20)
+class ContextIngestTests(TestCase):
+    """Streaming extraction, chunking and de-duplication of context files."""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        user = User.objects.create_user(username='context', email='context@example.com')
+        self.profile = OrbitViewProfile.objects.create(
+            user=user, username='context', first_name='Con', last_name='Text'
+        )
+
+    def upload(self, name, data, file_type):
+        return ContextFile.objects.create(
+            profile=self.profile, title=name, file_type=file_type, size_bytes=0,
+            file=SimpleUploadedFile(name, data, content_type=file_type),
+        )
+
+    def test_chunks_overlap_and_rejoin(self):
+        text = ' '.join(f"Sentence {i} about naïve café résumés." for i in range(60))
+        windows = list(chunk_text(iter(text[i:i + 7] for i in range(0, len(text), 7)), 100, 20))
+        self.assertTrue(all(len(chunk) <= 100 for _, chunk in windows))
+        for (start, chunk), (next_start, _) in zip(windows, windows[1:]):
+            self.assertEqual(text[start:start + len(chunk)], chunk)
+            self.assertLess(next_start, start + len(chunk))
+
+        # Blocks smaller than a multi-byte character must not garble it
+        context_file = ingest_context_file(self.upload('notes.txt', text.encode(), 'text/plain'), block_size=5)
+        self.assertEqual(context_file.status, 'ready')
+        self.assertEqual(context_file.size_bytes, len(text.encode()))
+        self.assertFalse(needs_ingestion(context_file))
+        self.assertEqual(context_file.chunks.count(), len(windows))
+        self.assertEqual(render_context_file(context_file)[2], f"### notes.txt\n{text}")
+
+    def test_reupload_is_deduplicated(self):
+        original = ingest_context_file(self.upload('cv.md', b'# CV\n\nBuilt things.', 'text/markdown'))
+        copy = ingest_context_file(self.upload('cv (1).md', b'# CV\n\nBuilt things.', 'text/markdown'))
+        self.assertEqual(copy.status, 'duplicate')
+        self.assertEqual(copy.duplicate_of, original)
+        self.assertEqual(copy.chunks.count(), 0)
+
+        original.delete()
+        copy.refresh_from_db()
+        self.assertTrue(needs_ingestion(copy))
+        self.assertEqual(ingest_context_file(copy).status, 'ready')
+        self.assertEqual(copy.chunks.get().text, '# CV\n\nBuilt things.')
+
+    def test_duplicates_are_reingested_with_a_changed_original(self):
+        original = ingest_context_file(self.upload('cv.md', b'# CV\n\nBuilt things.', 'text/markdown'))
+        copy = ingest_context_file(self.upload('cv (1).md', b'# CV\n\nBuilt things.', 'text/markdown'))
+
+        with mock.patch.object(context_ingestion, 'submit') as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                original.file = SimpleUploadedFile('cv.md', b'# CV\n\nBuilt more.', content_type='text/markdown')
+                original.save()
+                ingest_context_file(original)
+        submit.assert_any_call(copy.pk)
+        copy.refresh_from_db()
+        self.assertIsNone(copy.duplicate_of)
+        self.assertTrue(needs_ingestion(copy))
+        self.assertEqual(ingest_context_file(copy).status, 'ready')
+        self.assertEqual(copy.chunks.get().text, '# CV\n\nBuilt things.')
+
+    def test_extracts_markup_and_documents(self):
+        html = self.upload(
+            'page.html',
+            b'<html><head><title>x</title></head><body><script>var a;</script>'
+            b'<h1>Portfolio</h1><p>Shipped &amp; scaled.</p></body></html>',
+            'text/html; charset=utf-8',
+        )
+        self.assertEqual(ingest_context_file(html).chunks.get().text, 'Portfolio\n\nShipped & scaled.')
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('word/document.xml', (
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                '<w:body><w:p><w:r><w:t>Experience</w:t></w:r></w:p>'
+                '<w:p><w:r><w:t>Led the </w:t></w:r><w:r><w:t>team</w:t></w:r></w:p></w:body></w:document>'
+            ))
+        docx = self.upload(
+            'resume.docx', buffer.getvalue(),
+            'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+        )
+        self.assertEqual(ingest_context_file(docx).chunks.get().text, 'Experience\n\nLed the team')
+
+        writer = PdfWriter()
+        font = DictionaryObject({
+            NameObject('/Type'): NameObject('/Font'),
+            NameObject('/Subtype'): NameObject('/Type1'),
+            NameObject('/BaseFont'): NameObject('/Helvetica'),
+        })
+        for line in ('Experience', 'Led the team'):
+            page = writer.add_blank_page(612, 792)
+            page[NameObject('/Resources')] = DictionaryObject({
+                NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+            })
+            content = DecodedStreamObject()
+            content.set_data(f'BT /F1 12 Tf 72 720 Td ({line}) Tj ET'.encode())
+            page.replace_contents(content)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        pdf = self.upload('resume.pdf', buffer.getvalue(), 'application/pdf')
+        self.assertEqual(ingest_context_file(pdf).chunks.get().text, 'Experience\n\nLed the team')
+
+        binary = self.upload('photo.bin', b'\x00\x01', 'application/octet-stream')
+        self.assertEqual(ingest_context_file(binary).status, 'unsupported')
+
+
+@override_settings(RETRIEVAL_TOP_K=1)
+class RetrievalTests(TestCase):
+    """Embedding, incremental updates and search of profile snippets."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='retrieved', email='retrieved@example.com')
+        cls.profile = OrbitViewProfile.objects.create(
+            user=user, username='retrieved', first_name='Re', last_name='Trieved',
+            byline='Engineer', about='Builds data systems.',
+        )
+        cls.compiler = Work.objects.create(
+            profile=cls.profile, title='Compiler', description='A tiny optimizing compiler for a lisp dialect.'
+        )
+        cls.bakery = Work.objects.create(
+            profile=cls.profile, title='Bakery site', description='Online ordering for a sourdough bakery.'
+        )
+
+    def setUp(self):
+        cache.clear()
+        retrieval_index.clear()
+        compile_profile_context(self.profile.pk)
+
+    def test_racing_first_compiles_both_succeed(self):
+        ProfileContext.objects.filter(profile=self.profile).delete()
+        update = QuerySet.update
+        raced = []
+
+        def racing_update(queryset, **fields):
+            if queryset.model is ProfileContext and not raced:
+                # The other compile inserts the row right after our UPDATE found none
+                raced.append(ProfileContext.objects.create(profile=self.profile, document='stale'))
+                return 0
+            return update(queryset, **fields)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=racing_update):
+            document, _ = compile_profile_context(self.profile.pk)
+        self.assertTrue(raced)
+        self.assertIn('Compiler', document)
+        self.assertEqual(ProfileContext.objects.get(profile=self.profile).document, document)
+
+    def test_search_and_incremental_updates(self):
+        self.assertEqual(index_profile(self.profile.pk), (3, 0))
+        self.assertEqual(index_profile(self.profile.pk), (0, 0))
+        hits = retrieval_index.search(self.profile.pk, 'sourdough bread ordering')
+        self.assertEqual(hits[0][1], f"work:{self.bakery.pk}")
+
+        # A changed row re-embeds just its snippet and patches the loaded matrix
+        self.bakery.description = 'Online ordering for a sourdough bakery, now with delivery.'
+        self.bakery.save()
+        rendered = render_work(self.bakery)
+        with self.assertNumQueries(2):
+            section_changed(self.profile.pk, rendered)
+        with self.assertNumQueries(0):
+            hits = retrieval_index.search(self.profile.pk, 'bakery delivery')
+        self.assertIn('delivery', hits[0][2])
+
+        section_changed(self.profile.pk, remove=f"work:{self.bakery.pk}")
+        keys = [key for _, key, _ in retrieval_index.search(self.profile.pk, 'bakery delivery', k=5)]
+        self.assertNotIn(f"work:{self.bakery.pk}", keys)
+        self.assertEqual(len(keys), 2)
+
+    def test_context_has_summary_and_relevant_snippets(self):
+        index_profile(self.profile.pk)
+        context = build_context(self.profile.pk, 'What compiler did they write?')
+        self.assertIn('Builds data systems.', context)
+        self.assertIn('optimizing compiler', context)
+        self.assertNotIn('sourdough', context)
+
+
+class TagTests(TestCase):
+    """Comma-separated attributes stored as tag rows."""
+
+    def setUp(self):
+        user = User.objects.create_user(username='tagged', email='tagged@example.com')
+        self.profile = OrbitViewProfile.objects.create(
+            user=user, username='tagged', first_name='Tag', last_name='Ged', is_public=True,
+            skills='Rust, python,  RUST', nicknames="['Ada']",
+        )
+        self.work = Work.objects.create(
+            profile=self.profile, title='Engine', description='', tech_stack="['React', 'Rust']", tags='games'
+        )
+        # The page view below is counted inside the test transaction
+        self.addCleanup(profile_counters.flush)
+        self.addCleanup(profile_analytics.flush)
+
+    def test_attributes_keep_their_text_shape(self):
+        profile = OrbitViewProfile.objects.get(pk=self.profile.pk)
+        self.assertEqual((profile.skills, profile.nicknames, profile.values), ('Rust, python', 'Ada', None))
+        self.assertEqual(Work.objects.get(pk=self.work.pk).tech_stack, 'React, Rust')
+
+        profile.skills = ['Go', 'Rust']
+        profile.save()
+        self.assertEqual(OrbitViewProfile.objects.get(pk=self.profile.pk).skills, 'Go, Rust')
+        response = self.client.get('/api/profiles/tagged/')
+        self.assertEqual(response.json()['skills'], 'Go, Rust')
+        self.assertEqual(response.json()['works'][0]['tech_stack'], 'React, Rust')
+
+    def test_profiles_are_found_by_their_own_and_their_works_tags(self):
+        profiles = OrbitViewProfile.objects.all()
+        self.assertEqual(list(tagged(profiles, 'skill', 'rust')), [self.profile])
+        self.assertEqual(list(tagged(profiles, 'tech', 'react')), [self.profile])
+        self.assertEqual(list(tagged(Work.objects.all(), 'topic', 'Games')), [self.work])
+        self.assertFalse(tagged(profiles, 'skill', 'cobol').exists())
+
+        # A second work with the same tech doesn't count the profile twice
+        Work.objects.create(profile=self.profile, title='Site', description='', tech_stack='react')
+        self.assertEqual(list(tagged(profiles, 'tech', 'react')), [self.profile])
+        self.assertEqual(tag_count('tech', 'react'), 1)
+        self.assertEqual(tag_count('tech', 'react', relation='work_tags'), 2)
+
+        self.work.delete()
+        self.assertEqual(tag_count('tech', 'rust'), 0)
+        self.assertEqual(tag_count('tech', 'react'), 1)
+
+
+class ProfileSearchTests(TestCase):
+    """The profile search index, kept in step by the signals, and its queries."""
+
+    def make_profile(self, username, byline, about, skills, tech):
+        user = User.objects.create_user(username=username, email=f"{username}@example.com")
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = OrbitViewProfile.objects.create(
+                user=user, username=username, first_name=username.title(), last_name='Searched',
+                byline=byline, about=about, skills=skills, is_public=True,
+            )
+            Work.objects.create(profile=profile, title='Project', description='Built it', tech_stack=tech)
+        return profile
+
+    def setUp(self):
+        cache.clear()
+        self.ada = self.make_profile('ada', 'Compiler engineer', 'Writes compilers.', 'Rust, Python', "['Rust', 'LLVM']")
+        self.bob = self.make_profile('bob', 'Designer', 'Sometimes touches a compiler.', 'Figma, Python', 'React')
+        self.cy = self.make_profile('cy', 'Baker', 'Bakes sourdough.', 'Baking', 'Ovens')
+
+    def test_ranking_and_facets(self):
+        result = search('compiler')
+        self.assertEqual([r['username'] for r in result['results']], ['ada', 'bob'])
+        self.assertEqual((result['total'], result['estimated']), (2, False))
+        self.assertIn({'value': 'python', 'count': 2}, result['facets']['skill'])
+        self.assertIn({'value': 'llvm', 'count': 1}, result['facets']['tech'])
+
+        filtered = search('compiler', {'skill': ['Figma']})
+        self.assertEqual([r['username'] for r in filtered['results']], ['bob'])
+        self.assertEqual(search('', {'tech': ['react']})['total'], 1)
+        self.assertEqual(search('compiler sourdough')['results'], [])
+
+    def test_cursor_pages_through_every_match(self):
+        seen, cursor = [], None
+        for _ in range(5):
+            page = search('', cursor=cursor, limit=1)
+            seen += [r['username'] for r in page['results']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(sorted(seen), ['ada', 'bob', 'cy'])
+        self.assertEqual(self.client.get('/api/search/profiles/', {'cursor': '!!'}).status_code, 400)
+
+    def test_profiles_leave_the_index(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            PrivacySettings.objects.create(profile=self.bob, visibility='private')
+        self.assertEqual([r['username'] for r in search('compiler')['results']], ['ada'])
+        self.assertEqual(search('', {'skill': ['python']})['total'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ada.delete()
+        self.assertEqual(search('compiler')['total'], 0)
+        response = self.client.get('/api/search/profiles/', {'q': 'sourdough'})
+        self.assertEqual([r['username'] for r in response.json()['results']], ['cy'])
+
+    def test_rebuild_updates_documents_in_place(self):
+        document_id, rank = SearchDocument.objects.values_list('pk', 'rank').get(profile=self.ada)
+        # Views move the rank without a signal
+        OrbitViewProfile.objects.filter(pk=self.ada.pk).update(total_views=5000)
+        OrbitViewProfile.objects.filter(pk=self.cy.pk).update(is_public=False)
+
+        self.assertEqual(rebuild_index(batch_size=2), 2)
+        document = SearchDocument.objects.get(profile=self.ada)
+        self.assertEqual(document.pk, document_id)
+        self.assertGreater(document.rank, rank)
+        self.assertEqual(search('sourdough')['total'], 0)
+        self.assertEqual(SearchTerm.objects.get(term='skill:python').df, 2)
+        self.assertFalse(SearchTerm.objects.filter(term='skill:baking', df__gt=0).exists())
+
+    def test_a_profile_named_search_is_reachable(self):
+        self.make_profile('search', 'Finder', 'Finds things.', 'Search', 'Lucene')
+        # Write the counted view inside the test transaction
+        self.addCleanup(profile_counters.flush)
+        self.addCleanup(profile_analytics.flush)
+        response = self.client.get('/api/profiles/search/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['username'], 'search')
+
+
+class ConversationHistoryTests(TestCase):
+    """The owner's keyset-paginated conversation and message listings."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='host', email='host@example.com')
+        self.profile = OrbitViewProfile.objects.create(
+            user=self.owner, username='host', first_name='Host', last_name='Ed', is_public=True
+        )
+        self.writer = MessageWriter(enabled=False)
+        self.client.force_login(self.owner)
+
+    def collect(self, url, key, limit):
+        seen, cursor = [], None
+        while True:
+            params = {'limit': limit, **({'cursor': cursor} if cursor else {})}
+            page = self.client.get(url, params).json()
+            seen += page[key]
+            cursor = page['next_cursor']
+            if cursor is None:
+                return seen
+
+    def test_conversations_page_newest_first_with_previews(self):
+        started = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+        ids = []
+        for i in range(5):
+            conversation = Conversation.objects.create(profile=self.profile)
+            # Two share a start time, so the id breaks the tie
+            Conversation.objects.filter(pk=conversation.pk).update(
+                started_at=started + datetime.timedelta(minutes=min(i, 3))
+            )
+            self.writer.add_message(conversation.pk, 'user', f"Question {i}")
+            self.writer.add_message(conversation.pk, 'assistant', f"Answer  {i}\n" + 'x' * 300)
+            ids.append(str(conversation.pk))
+
+        rows = self.collect('/api/profiles/host/conversations/', 'conversations', 2)
+        self.assertEqual([row['id'] for row in rows], sorted(ids[3:]) + ids[2::-1])
+        self.assertEqual(rows[-1]['last_message_role'], 'assistant')
+        self.assertTrue(rows[-1]['last_message_preview'].startswith('Answer 0 xxx'))
+        self.assertEqual(len(rows[-1]['last_message_preview']), 200)
+
+        stranger = User.objects.create_user(username='guest', email='guest@example.com')
+        self.client.force_login(stranger)
+        self.assertEqual(self.client.get('/api/profiles/host/conversations/').status_code, 404)
+
+    def test_messages_page_in_order_and_reject_bad_cursors(self):
+        conversation = Conversation.objects.create(profile=self.profile)
+        for i in range(7):
+            self.writer.add_message(conversation.pk, 'user' if i % 2 == 0 else 'assistant', f"Message {i}")
+        url = f'/api/profiles/host/conversations/{conversation.pk}/messages/'
+        rows = self.collect(url, 'messages', 3)
+        self.assertEqual([row['content'] for row in rows], [f"Message {i}" for i in range(7)])
+        self.assertEqual(self.client.get(url, {'cursor': 'bogus'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 'x'}).status_code, 400)
+        self.assertEqual(
+            self.client.get(f'/api/profiles/other/conversations/{conversation.pk}/messages/').status_code, 404
+        )
+
+    def test_messages_written_during_archiving_keep_their_conversation(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        old = timezone.now() - datetime.timedelta(days=400)
+        quiet, busy = (Conversation.objects.create(profile=self.profile) for _ in range(2))
+        for conversation in (quiet, busy):
+            self.writer.add_message(conversation.pk, 'user', 'Hello', timestamp=old)
+
+        save = archive._ArchiveFile.save
+
+        def save_after_a_reply(archive_file):
+            self.writer.add_message(busy.pk, 'assistant', 'Still here')
+            return save(archive_file)
+
+        with mock.patch.object(archive._ArchiveFile, 'save', save_after_a_reply):
+            self.assertEqual(archive.archive_batch(timezone.now() - datetime.timedelta(days=30)), 1)
+        self.assertEqual(list(Conversation.objects.values_list('pk', flat=True)), [busy.pk])
+        self.assertEqual(list(ArchivedConversation.objects.values_list('pk', flat=True)), [quiet.pk])
+        self.assertEqual(list(Message.objects.values_list('content', flat=True).order_by('timestamp')),
+                         ['Hello', 'Still here'])
+
+    def test_archived_conversations_stay_readable(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        old = timezone.now() - datetime.timedelta(days=400)
+        conversations = [Conversation.objects.create(profile=self.profile) for _ in range(3)]
+        for i, conversation in enumerate(conversations):
+            started = old if i < 2 else timezone.now()
+            Conversation.objects.filter(pk=conversation.pk).update(started_at=started + datetime.timedelta(minutes=i))
+            for j in range(3):
+                at = started + datetime.timedelta(minutes=i, seconds=j)
+                self.writer.add_message(conversation.pk, 'user', f"Chat {i} line {j}", timestamp=at)
+
+        out = io.StringIO()
+        call_command('archive_conversations', days=30, batch_size=1, stdout=out)
+        self.assertIn('Archived 2 conversations', out.getvalue())
+        self.assertEqual(list(Conversation.objects.values_list('pk', flat=True)), [conversations[2].pk])
+        self.assertEqual(Message.objects.count(), 3)
+
+        rows = self.collect('/api/profiles/host/conversations/', 'conversations', 2)
+        self.assertEqual([row['archived'] for row in rows], [False, True, True])
+        self.assertEqual(rows[1]['last_message_preview'], 'Chat 1 line 2')
+        url = f"/api/profiles/host/conversations/{rows[2]['id']}/messages/"
+        messages = self.collect(url, 'messages', 2)
+        self.assertEqual([m['content'] for m in messages], [f"Chat 0 line {j}" for j in range(3)])
+
+
+class AnalyticsTests(TestCase):
+    """Hourly analytics, their daily rollups and the dashboard served from them."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='counted', email='counted@example.com')
+        self.profile = OrbitViewProfile.objects.create(
+            user=self.user, username='counted', first_name='Coun', last_name='Ted', is_public=True
+        )
+        self.analytics = ProfileAnalytics(enabled=False)
+
+    def test_sketches_estimate_and_merge(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(20000):
+            (first if i < 12000 else second).add(f"visitor {i}")
+            # Overlap: repeats don't count twice
+            if i % 3 == 0:
+                second.add(f"visitor {i}")
+        merged = HyperLogLog.from_bytes(first.to_bytes()).merge(second)
+        self.assertAlmostEqual(merged.count(), 20000, delta=20000 * 0.05)
+        self.assertEqual(HyperLogLog.from_bytes(b'').count(), 0)
+
+    def test_dashboard_reads_rollups_and_recent_hours(self):
+        now = timezone.now()
+        yesterday = now - datetime.timedelta(days=1)
+        for i in range(30):
+            at = yesterday.replace(hour=i % 24, minute=0)
+            self.analytics.record(self.profile.id, 'views', f"visitor {i % 10}", at=at)
+        self.analytics.record(self.profile.id, 'conversations', 'visitor 1', at=now)
+        self.analytics.record(self.profile.id, 'questions', 'visitor 1', at=now)
+        PopularQuestionPipeline(enabled=False).record(self.profile.id, 'What are you building?')
+
+        self.assertEqual(rollup_day(yesterday.date()), 1)
+        # Rolling up again recomputes the day instead of adding to it
+        self.assertEqual(rollup_day(yesterday.date()), 1)
+        with self.assertNumQueries(3):
+            board = dashboard(self.profile.id, days=7, now=now)
+        self.assertEqual(len(board['days']), 7)
+        self.assertEqual(board['days'][-2]['views'], 30)
+        self.assertEqual(board['days'][-2]['visitors'], 10)
+        self.assertEqual(board['days'][-1]['conversations'], 1)
+        self.assertEqual(board['totals']['visitors'], 10)
+        self.assertEqual(board['top_questions'], [{'question': 'What are you building?', 'count': 1}])
+
+        self.client.force_login(self.user)
+        response = self.client.get('/api/profiles/counted/analytics/', {'days': 2})
+        self.assertEqual(response.json()['totals']['views'], 30)
+        self.client.logout()
+        self.assertIn(self.client.get('/api/profiles/counted/analytics/').status_code, (401, 403))
+
+
+class PersonalityTests(TestCase):
+    """Effective personalities resolved once and stored on their conversation."""
+
+    def setUp(self):
+        user = User.objects.create_user(username='persona', email='persona@example.com')
+        self.profile = OrbitViewProfile.objects.create(user=user, username='persona', first_name='Per', last_name='Sona')
+        AIPersonality.objects.create(
+            profile=self.profile, tone='witty', response_length='detailed', personality_traits=['curious']
+        )
+        self.template = prompt_registry.get('profile_answering')
+
+    def resolve(self, conversation):
+        version = profile_version(self.profile.id)
+        return async_to_sync(aresolve)(conversation, version, self.template)
+
+    def test_resolves_once_and_follows_changes(self):
+        conversation = Conversation.objects.create(profile=self.profile, ai_response_length_override='concise')
+        resolved = self.resolve(conversation)
+        self.assertEqual(resolved['settings']['tone'], 'witty')
+        self.assertEqual(resolved['max_tokens'], RESPONSE_MAX_TOKENS['concise'])
+        self.assertIn('curious', resolved['values']['traits'])
+
+        conversation = Conversation.objects.get(pk=conversation.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.resolve(conversation), resolved)
+
+        conversation.ai_response_length_override = None
+        with self.assertNumQueries(2):
+            self.assertEqual(self.resolve(conversation)['max_tokens'], RESPONSE_MAX_TOKENS['detailed'])
+
+        # Saving the personality bumps the profile version
+        with self.captureOnCommitCallbacks(execute=True):
+            personality = AIPersonality.objects.get(profile=self.profile)
+            personality.tone = 'casual'
+            personality.save()
+        changed = self.resolve(Conversation.objects.get(pk=conversation.pk))
+        self.assertEqual(changed['settings']['tone'], 'casual')
+        self.assertNotEqual(changed['fingerprint'], resolved['fingerprint'])
+
+
+class PromptRegistryTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.write('greeting.v1.txt', 'Hello ${name}.')
+        self.write('greeting.v2.txt', 'Costs $$5. Hi ${name}, ${missing}!')
+        settings_override = override_settings(
+            PROMPT_DIRS=[self.directory], PROMPT_FILES={}, PROMPT_VERSIONS={}, PROMPT_AUTO_RELOAD=True
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.registry = PromptRegistry()
+
+    def write(self, name, text):
+        path = self.directory / name
+        path.write_text(text)
+        return path
+
+    def test_renders_latest_or_pinned_version(self):
+        self.assertEqual(self.registry.load(), 2)
+        self.assertEqual(self.registry.render('greeting', {'name': 'Ada'}), 'Costs $5. Hi Ada, !')
+        self.assertEqual(self.registry.render('greeting', {'name': 'Ada'}, version=1), 'Hello Ada.')
+        with self.settings(PROMPT_VERSIONS={'greeting': 1}):
+            self.assertEqual(self.registry.render('greeting', {'name': 'Ada'}), 'Hello Ada.')
+        with self.assertRaises(PromptNotFound):
+            self.registry.render('greeting', version=3)
+        with self.assertRaises(PromptNotFound):
+            self.registry.render('farewell')
+
+    def test_override_file_and_reload(self):
+        # Plain prompts from before templates: nothing in them is a placeholder
+        override = self.write('custom.txt', 'Custom for ${name}, $100')
+        with self.settings(PROMPT_FILES={'greeting': str(override)}):
+            self.registry.load()
+            self.assertEqual(self.registry.render('greeting', {'name': 'Ada'}), 'Custom for ${name}, $100')
+
+        self.registry.load()
+        self.write('greeting.v3.txt', 'Hey ${name}')
+        self.registry._next_check = 0
+        self.assertEqual(self.registry.render('greeting', {'name': 'Ada'}), 'Hey Ada')
+        path = self.write('greeting.v3.txt', 'Howdy ${name}')
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.registry._next_check = 0
+        self.assertEqual(self.registry.render('greeting', {'name': 'Ada'}), 'Howdy Ada')
+
+    def test_profile_answering_prompts_always_carry_the_context(self):
+        legacy = self.write('answering.txt', 'You answer for them. Coaching costs $100/h.')
+        with self.settings(PROMPT_FILES={'profile_answering': str(legacy)}):
+            self.registry.load()
+            self.assertEqual(
+                self.registry.render('profile_answering', {'context': 'Name: Ada'}),
+                'You answer for them. Coaching costs $100/h.\n\nName: Ada',
+            )
+
+        self.write('profile_answering.v1.txt', 'You answer for ${tone} people.')
+        with self.assertRaisesMessage(ImproperlyConfigured, '${context}'):
+            self.registry.load()
+
+    def test_profile_prompt_uses_personality(self):
+        with self.settings(PROMPT_DIRS=[settings.BASE_DIR / 'users' / 'prompt_templates']):
+            registry = PromptRegistry()
+            prompt = registry.render('profile_answering', {
+                **personality_values({'tone': 'casual', 'personality_traits': ['curious'], 'response_length': 'concise'}),
+                'context': 'Name: Ada',
+            })
+        self.assertIn('casual', prompt)
+        self.assertIn('curious', prompt)
+        self.assertTrue(prompt.endswith('Name: Ada'))
+        self.assertNotIn('${', prompt)
+
+
+class UsernameTests(TestCase):
+    """Numbering usernames from a per-base sequence."""
+
+    def create_user(self, username):
+        return User.objects.create(username=username, email=f"{username}@example.com")
+
+    def test_base(self):
+        self.assertEqual(username_base('John Smith-Jones!'), 'johnsmithjones')
+        self.assertEqual(username_base(''), '')
+        self.assertEqual(len(username_base('a' * 500)), 140)
+
+    def test_allocates_bare_base_then_numbers(self):
+        self.assertEqual(allocate_username('user', 'adalovelace'), 'adalovelace')
+        self.assertEqual(allocate_username('user', 'adalovelace'), 'adalovelace1')
+        self.assertEqual(allocate_username('user', 'adalovelace'), 'adalovelace2')
+
+    def test_seeds_past_the_highest_suffix_taken(self):
+        for username in ('johnsmith', 'johnsmith4', 'johnsmithx', 'johnsmiths9'):
+            self.create_user(username)
+        self.assertEqual(allocate_username('user', 'johnsmith'), 'johnsmith5')
+        self.assertEqual(UsernameSequence.objects.get(scope='user', base='johnsmith').next_suffix, 6)
+
+    def test_retries_past_names_taken_by_hand(self):
+        self.create_user('grace')
+        self.assertEqual(create_with_unique_username('user', 'grace', self.create_user).username, 'grace1')
+        # Taken behind the sequence's back
+        self.create_user('grace2')
+        self.create_user('grace3')
+        self.assertEqual(create_with_unique_username('user', 'grace', self.create_user).username, 'grace4')
+        self.assertEqual(allocate_username('user', 'grace'), 'grace5')
+
+    def test_other_integrity_errors_are_raised(self):
+        def create(username):
+            raise IntegrityError('email taken')
+
+        with self.assertRaisesMessage(IntegrityError, 'email taken'):
+            create_with_unique_username('user', 'linus', create)
+        self.assertFalse(User.objects.filter(username__startswith='linus').exists())
+
+
+    def test_profiles_get_numbered_slugs(self):
+        ada = self.create_user('ada')
+        ada.first_name, ada.last_name = 'Ada', 'Lovelace'
+        other = self.create_user('ada2')
+        OrbitViewProfile.objects.create(user=other, username='ada-lovelace', first_name='A', last_name='L')
+
+        profile = create_profile(ada, byline='Analyst', about='Notes on the engine.')
+        self.assertEqual((profile.username, profile.first_name), ('ada-lovelace1', 'Ada'))
+        self.assertEqual(UsernameSequence.objects.get(scope='profile', base='ada-lovelace').next_suffix, 2)
+        # A second profile for the same user is refused, not renumbered
+        with self.assertRaises(IntegrityError):
+            create_profile(ada)
+
+
+class GoogleTokenMixin:
+    """Google-style ID tokens signed with a locally generated key."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        public_key, private_key = rsa.newkeys(1024)
+        cls.public_pem = public_key.save_pkcs1().decode()
+        cls.signer = crypt.RSASigner.from_string(private_key.save_pkcs1().decode(), key_id='key-1')
+
+    def token(self, **claims):
+        now = int(time.time())
+        payload = {
+            'iss': 'https://accounts.google.com', 'aud': 'client-id', 'sub': '42',
+            'email': 'ada@example.com', 'iat': now, 'exp': now + 600,
+        }
+        payload.update(claims)
+        return jwt.encode(self.signer, payload)
+
+
+class GoogleTokenVerifierTests(GoogleTokenMixin, SimpleTestCase):
+    """Token verification against locally generated keys, without the network."""
+
+    def test_verifies_and_caches_keys(self):
+        source = StaticKeySource({'key-1': self.public_pem}, max_age=3600)
+        verifier = GoogleTokenVerifier(KeyStore(source))
+        for _ in range(3):
+            self.assertEqual(verifier.verify(self.token(), 'client-id')['sub'], '42')
+        self.assertEqual(source.fetches, 1)
+
+    def test_rejects_foreign_tokens(self):
+        verifier = GoogleTokenVerifier(KeyStore(StaticKeySource({'key-1': self.public_pem})))
+        with self.assertRaises(ValueError):
+            verifier.verify(self.token(aud='someone-else'), 'client-id')
+        with self.assertRaises(ValueError):
+            verifier.verify(self.token(iss='https://evil.example.com'), 'client-id')
+        with self.assertRaises(ValueError):
+            verifier.verify(self.token(exp=int(time.time()) - 3600), 'client-id')
+
+    def test_unknown_key_refreshes_once(self):
+        source = StaticKeySource({'old-key': self.public_pem}, max_age=3600)
+        verifier = GoogleTokenVerifier(KeyStore(source, min_refresh_interval=60))
+        with self.assertRaises(ValueError):
+            verifier.verify(self.token(), 'client-id')
+        # Rotated in at the source: found only after the rate limit allows a refetch
+        source.keys['key-1'] = self.public_pem
+        with self.assertRaises(ValueError):
+            verifier.verify(self.token(), 'client-id')
+        self.assertEqual(source.fetches, 1)
+
+        verifier.key_store.min_refresh_interval = 0
+        self.assertEqual(verifier.verify(self.token(), 'client-id')['sub'], '42')
+        self.assertEqual(source.fetches, 2)
+
+    def test_expired_keys_are_refetched(self):
+        source = StaticKeySource({'key-1': self.public_pem}, max_age=0)
+        verifier = GoogleTokenVerifier(KeyStore(source))
+        self.assertEqual(verifier.verify(self.token(), 'client-id')['sub'], '42')
+        # Rotated out at the source
+        source.keys = {'key-2': self.public_pem}
+        with self.assertRaises(ValueError):
+            verifier.verify(self.token(), 'client-id')
+        self.assertEqual(source.fetches, 2)
+
+    def test_failed_refresh_keeps_cached_keys(self):
+        source = StaticKeySource({'key-1': self.public_pem}, max_age=0)
+        verifier = GoogleTokenVerifier(KeyStore(source))
+        verifier.verify(self.token(), 'client-id')
+        with mock.patch.object(source, 'fetch', side_effect=httpx.ConnectError('down')):
+            with self.assertLogs('users.google_tokens', 'ERROR'):
+                self.assertEqual(verifier.verify(self.token(), 'client-id')['sub'], '42')
+            # Nothing cached to fall back on
+            with self.assertRaises(httpx.ConnectError):
+                GoogleTokenVerifier(KeyStore(source)).verify(self.token(), 'client-id')
+
+    def test_certs_source_honours_cache_headers(self):
+        def respond(request):
+            if request.url.path == '/fresh':
+                return httpx.Response(
+                    200, json={'key-1': self.public_pem},
+                    headers={'Cache-Control': 'public, max-age=3600, must-revalidate', 'Age': '600'},
+                )
+            if request.url.path == '/uncached':
+                return httpx.Response(200, json={'key-1': self.public_pem})
+            return httpx.Response(503)
+
+        client = httpx.Client(transport=httpx.MockTransport(respond))
+        self.addCleanup(client.close)
+        self.assertEqual(
+            GoogleCertsSource('https://certs.test/fresh', client=client).fetch(),
+            ({'key-1': self.public_pem}, 3000),
+        )
+        self.assertEqual(GoogleCertsSource('https://certs.test/uncached', client=client).fetch()[1], None)
+        with self.assertRaises(httpx.HTTPStatusError):
+            GoogleCertsSource('https://certs.test/down', client=client).fetch()
+
+
+@override_settings(GOOGLE_OAUTH2_CLIENT_ID='client-id')
+class GoogleAuthTests(GoogleTokenMixin, TestCase):
+    """Signing in through /api/auth/google/ and staying signed in."""
+
+    def setUp(self):
+        cache.clear()
+        verifier = mock.patch.object(google_tokens, '_verifier', None)
+        verifier.start()
+        self.addCleanup(verifier.stop)
+        configure_token_verifier(StaticKeySource({'key-1': self.public_pem}))
+
+    def sign_in(self, **claims):
+        return self.client.post('/api/auth/google/', {'token': self.token(**claims).decode()}, content_type='application/json')
+
+    def test_new_user_is_signed_in(self):
+        response = self.sign_in(given_name='Ada', family_name='Lovelace', email_verified=True)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(response.json()['created'])
+        user = User.objects.get(email='ada@example.com')
+        self.assertEqual(user.username, 'adalovelace')
+        self.assertIsNotNone(user.last_login)
+
+        for _ in range(2):
+            response = self.client.get('/api/auth/me/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['user']['id'], str(user.pk))
+        self.assertEqual(self.client.session['_auth_user_backend'], 'users.auth_cache.CachedModelBackend')
+
+    def test_returning_user_updates_only_changed_fields(self):
+        user = User.objects.create(
+            username='ada', email='ada@example.com', first_name='Ada', last_name='Byron',
+            avatar_url='https://example.com/ada.png', email_verified=True,
+        )
+        OrbitViewProfile.objects.create(user=user, username='ada', first_name='Ada', last_name='Byron', byline='', about='')
+        updated_at = user.updated_at
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.sign_in(given_name='Ada', family_name='Lovelace', email_verified=False)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            {key: response.json()[key] for key in ('created', 'has_profile', 'profile_username')},
+            {'created': False, 'has_profile': True, 'profile_username': 'ada'},
+        )
+        self.assertEqual(self.client.session['_auth_user_id'], str(user.pk))
+
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE "users"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"last_name"', updates[0])
+        self.assertIn('"last_login"', updates[0])
+        for unchanged in ('"first_name"', '"avatar_url"', '"email_verified"', '"password"'):
+            self.assertNotIn(unchanged, updates[0])
+
+        user.refresh_from_db()
+        self.assertEqual((user.first_name, user.last_name), ('Ada', 'Lovelace'))
+        self.assertEqual(user.avatar_url, 'https://example.com/ada.png')
+        self.assertTrue(user.email_verified)
+        self.assertGreater(user.updated_at, updated_at)
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_cached_user_leaves_out_the_password(self):
+        user = User.objects.create(username='grace', email='grace@example.com', password=make_password('s3cret'))
+        self.client.force_login(user, backend='users.auth_cache.CachedModelBackend')
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 200)
+        self.assertNotIn(user.password.encode(), pickle.dumps(cache.get(f'auth-user:{user.pk}')))
+
+        # Served from the cache, and still checked against the session hash
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 200)
+        cached = CachedModelBackend().get_user(user.pk)
+        self.assertEqual(cached.get_session_auth_hash(), user.get_session_auth_hash())
+        self.assertEqual(cached.password, user.password)
+
+        # A changed password signs the session out
+        user.set_password('changed')
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 403)
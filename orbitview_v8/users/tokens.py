@@ -0,0 +1,84 @@
+"""
+Local token counting and prompt windowing, independent of Django so scripts
+can use it too.
+"""
+import logging
+import re
+
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# Chat formats add a few tokens of framing around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+DEFAULT_CONTEXT_WINDOW = 8192
+MODEL_CONTEXT_WINDOWS = {
+    'llama-3.1-8b-instant': 131072,
+    'llama-3.3-70b-versatile': 131072,
+    'qwen/qwen3-32b': 131072,
+    'meta-llama/llama-4-maverick-17b-128e-instruct': 131072,
+    'meta-llama/llama-4-scout-17b-16e-instruct': 131072,
+    'moonshotai/kimi-k2-instruct-0905': 262144,
+    'openai/gpt-oss-120b': 131072,
+    'openai/gpt-oss-20b': 131072,
+}
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+
+
+def context_window(model):
+    return MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+
+def load_encoding(name='cl100k_base'):
+    """
+    Load the tiktoken encoding once, at startup. tiktoken downloads it on first
+    use unless TIKTOKEN_CACHE_DIR already holds it, so this is never done while
+    answering. Returns whether it loaded; until it does, counts are estimated.
+    """
+    global _encoding
+    if tiktoken is None:
+        return False
+    try:
+        _encoding = tiktoken.get_encoding(name)
+    except Exception as exc:
+        logger.warning('Could not load the %s tiktoken encoding (%s), estimating token counts', name, exc)
+        _encoding = None
+    return _encoding is not None
+
+
+def count_tokens(text):
+    """Token count from the loaded tiktoken encoding, otherwise a close word-piece estimate."""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Roughly one token per word or symbol, plus one per 8 characters of long words
+    return sum(1 + len(piece) // 8 for piece in TOKEN_RE.findall(text))
+
+
+def message_tokens(message):
+    return count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+
+
+def fit_messages(system_messages, history, user_message, budget):
+    """
+    Keep the newest history messages that fit `budget` together with the new
+    user message. Returns the prompt and how many old messages were left out.
+    """
+    current = {'role': 'user', 'content': user_message}
+    remaining = budget - message_tokens(current)
+    kept = []
+    for message in reversed(history):
+        cost = message_tokens(message)
+        if cost > remaining:
+            break
+        kept.append(message)
+        remaining -= cost
+    kept.reverse()
+    return system_messages + kept + [current], len(history) - len(kept)
@@ -6,6 +6,31 @@ app_name = 'users'
 urlpatterns = [
     path('api/auth/google/', views.google_auth, name='google_auth'),
     path('api/auth/me/', views.current_user_view, name='current_user'),
+    path('api/search/profiles/', views.profile_search, name='profile_search'),
+    path('api/profiles/<slug:username>/', views.profile_detail, name='profile_detail'),
+    path('api/profiles/<slug:username>/chat/', views.profile_chat, name='profile_chat'),
+    path(
+        'api/profiles/<slug:username>/chat/<uuid:conversation_id>/resume/',
+        views.profile_chat_resume,
+        name='profile_chat_resume',
+    ),
+    path(
+        'api/profiles/<slug:username>/conversations/',
+        views.profile_conversations,
+        name='profile_conversations',
+    ),
+    path(
+        'api/profiles/<slug:username>/conversations/<uuid:conversation_id>/messages/',
+        views.conversation_messages,
+        name='conversation_messages',
+    ),
+    path('api/profiles/<slug:username>/analytics/', views.profile_analytics, name='profile_analytics'),
+    path(
+        'api/profiles/<slug:username>/popular-questions/',
+        views.profile_popular_questions,
+        name='profile_popular_questions',
+    ),
+    path('api/internal/llm-metrics/', views.llm_metrics, name='llm_metrics'),
 
     # An endpoint to test the streaming HTTP response in development
     path("stream-test/", views.stream_groq, name="stream_groq"),
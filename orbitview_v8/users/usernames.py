@@ -0,0 +1,112 @@
+"""
+Unique username allocation.
+
+Every username base ('johnsmith') has a UsernameSequence row holding the next
+free numeric suffix, so allocating 'johnsmith7' is one locked increment no
+matter how many johnsmiths exist. The row is seeded on first use from a
+single prefix query for the highest suffix already taken. Names taken behind
+the sequence's back (a user picking 'johnsmith8' by hand) surface as an
+IntegrityError on insert; create_with_unique_username() then re-seeds the
+sequence and tries the next suffix.
+
+The same sequences cover User.username ('user' scope) and the
+OrbitViewProfile.username slug ('profile' scope); create_profile() gives a
+new profile its slug.
+"""
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import BigIntegerField, Count, Max, Value
+from django.db.models.functions import Cast, NullIf, Substr
+from django.utils.text import slugify
+
+from .models import OrbitViewProfile, User, UsernameSequence
+
+
+SCOPES = {
+    'user': User,
+    'profile': OrbitViewProfile,
+}
+
+# Room left for the numeric suffix within the column's max_length
+SUFFIX_DIGITS = 10
+
+
+def username_base(name, scope='user'):
+    """The base to number from: lowercase alphanumerics for users, a slug for profiles."""
+    if scope == 'profile':
+        base = slugify(name or '')
+    else:
+        base = re.sub(r'[^a-z0-9]+', '', (name or '').lower())
+    max_length = SCOPES[scope]._meta.get_field('username').max_length
+    return base[:max_length - SUFFIX_DIGITS]
+
+
+def _first_free_suffix(scope, base):
+    """
+    0 if `base` itself is free, else one past the highest suffix in use, from a
+    single query on the username index.
+    """
+    taken = SCOPES[scope].objects.filter(
+        username__startswith=base,
+        username__regex=rf"^{re.escape(base)}[0-9]*$",
+    ).aggregate(
+        rows=Count('pk'),
+        highest=Max(Cast(NullIf(Substr('username', len(base) + 1), Value('')), BigIntegerField())),
+    )
+    if not taken['rows']:
+        return 0
+    return (taken['highest'] or 0) + 1
+
+
+def allocate_username(scope, base, reseed=False):
+    """Reserve the next free username for `base`."""
+    with transaction.atomic():
+        sequence = UsernameSequence.objects.select_for_update().filter(scope=scope, base=base).first()
+        if sequence is None:
+            try:
+                with transaction.atomic():
+                    sequence = UsernameSequence.objects.create(
+                        scope=scope, base=base, next_suffix=_first_free_suffix(scope, base)
+                    )
+            except IntegrityError:
+                # Seeded by a concurrent sign-up
+                sequence = UsernameSequence.objects.select_for_update().get(scope=scope, base=base)
+        elif reseed:
+            sequence.next_suffix = max(sequence.next_suffix, _first_free_suffix(scope, base))
+        suffix = sequence.next_suffix
+        sequence.next_suffix = suffix + 1
+        sequence.save(update_fields=['next_suffix'])
+    return f"{base}{suffix}" if suffix else base
+
+
+def create_with_unique_username(scope, base, create, attempts=5):
+    """
+    Call `create(username)` with freshly allocated usernames until one doesn't
+    collide. Integrity errors on anything other than the username are re-raised.
+    """
+    model = SCOPES[scope]
+    reseed = False
+    for _ in range(attempts):
+        username = allocate_username(scope, base, reseed=reseed)
+        try:
+            with transaction.atomic():
+                return create(username)
+        except IntegrityError:
+            if not model.objects.filter(username=username).exists():
+                raise
+            reseed = True
+    raise IntegrityError(f"No free {scope} username for {base!r} after {attempts} attempts")
+
+
+def create_profile(user, name=None, **fields):
+    """
+    Create `user`'s OrbitViewProfile under a free slug numbered from `name`
+    (by default their full name, else their username), e.g. ada-lovelace2.
+    """
+    base = username_base(name or user.full_name or user.username, 'profile') or 'profile'
+    fields.setdefault('first_name', user.first_name)
+    fields.setdefault('last_name', user.last_name)
+    return create_with_unique_username(
+        'profile', base, lambda username: OrbitViewProfile.objects.create(user=user, username=username, **fields)
+    )
@@ -1,17 +1,34 @@
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from decouple import config
 from django.contrib.auth import login
 from django.conf import settings
-from django.http import StreamingHttpResponse
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
-from groq import Groq
-import re
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from asgiref.sync import sync_to_async
+from contextlib import aclosing
+import json
 
-from .models import User, OrbitViewProfile
+from .auth_cache import current_user_payload
+from .counters import profile_counters
+from .google_tokens import get_token_verifier
+from .llm import get_gateway
+from . import analytics, archive, conversations, history, page_cache, personality, retrieval, search
+from .models import User, OrbitViewProfile, ArchivedConversation, Conversation
+from .popular_questions import popular_questions, top_questions
+from .profile_page import can_view, profile_page_queryset, profile_visibility, serialize_profile_page
+from .profile_version import aprofile_version, profile_version
+from .prompts import prompt_registry
+from .response_cache import response_cache
+from .sse import EventStream, ReplayBuffer, format_event, replay
+from .usernames import create_with_unique_username, username_base
+from .write_behind import message_writer
 
 
 @api_view(['POST'])
@@ -38,11 +55,7 @@ def google_auth(request):
     
     try:
         # Verify the token with Google
-        idinfo = id_token.verify_oauth2_token(
-            token,
-            google_requests.Request(),
-            client_id
-        )
+        idinfo = get_token_verifier().verify(token, client_id)
         
         # Extract user information
         google_id = idinfo['sub']
@@ -53,39 +66,45 @@ def google_auth(request):
         picture = idinfo.get('picture', '')
         name = idinfo.get('name', f'{first_name} {last_name}'.strip())
         
-        # Get or create user
-        user, created = User.objects.get_or_create(
-            email=email,
-            defaults={
-                'username': _generate_username(email, name),
-                'first_name': first_name,
-                'last_name': last_name,
-                'email_verified': email_verified,
-                'avatar_url': picture,
-                'is_active': True,
-            }
-        )
+        # Get or create user, with their profile in the same query
+        users = User.objects.select_related('orbitview_profile')
+        user = users.filter(email=email).first()
+        created = user is None
+        if created:
+            try:
+                user = create_with_unique_username(
+                    'user',
+                    _username_base(email, name),
+                    lambda username: User.objects.create(
+                        email=email,
+                        username=username,
+                        first_name=first_name,
+                        last_name=last_name,
+                        email_verified=email_verified,
+                        avatar_url=picture,
+                        is_active=True,
+                    ),
+                )
+            except IntegrityError:
+                # Signed up by a concurrent request with the same account
+                user = users.get(email=email)
+                created = False
         
-        # Update user information if not new
+        # Update user information if not new. Only changed fields are written,
+        # in the same UPDATE that records the login (see signals.record_login)
         if not created:
-            user.first_name = first_name or user.first_name
-            user.last_name = last_name or user.last_name
-            user.avatar_url = picture or user.avatar_url
-            if email_verified:
-                user.email_verified = True
-            user.save()
+            user.login_update_fields = _apply_google_claims(
+                user, first_name, last_name, picture, email_verified
+            )
         
-        # Log the user in
-        login(request, user)
+        # Log the user in. Two backends are configured, so name the one
+        # sessions should resolve through
+        login(request, user, backend='users.auth_cache.CachedModelBackend')
         
         # Check if user has an OrbitView profile
-        try:
-            profile = user.orbitview_profile
-            has_profile = True
-            profile_username = profile.username
-        except OrbitViewProfile.DoesNotExist:
-            has_profile = False
-            profile_username = None
+        profile = None if created else getattr(user, 'orbitview_profile', None)
+        has_profile = profile is not None
+        profile_username = profile.username if profile else None
         
         return Response({
             'success': True,
@@ -115,36 +134,31 @@ def google_auth(request):
         )
 
 
-def _generate_username(email, name):
+def _apply_google_claims(user, first_name, last_name, picture, email_verified):
     """
-    Generate a unique username from email or name.
-    Falls back to email prefix if name is not available.
+    Copy fresh Google claims onto a returning user, keeping current values for
+    empty claims. Returns the names of the fields that actually changed.
     """
-    # Try to create username from name
-    if name:
-        # Convert name to slug format
-        username_base = re.sub(r'[^a-z0-9]+', '', name.lower())
-        if username_base:
-            username = username_base
-            # Ensure uniqueness
-            counter = 1
-            while User.objects.filter(username=username).exists():
-                username = f"{username_base}{counter}"
-                counter += 1
-            return username
-    
-    # Fall back to email prefix
-    email_prefix = email.split('@')[0]
-    username = re.sub(r'[^a-z0-9]+', '', email_prefix.lower())
-    
-    # Ensure uniqueness
-    counter = 1
-    original_username = username
-    while User.objects.filter(username=username).exists():
-        username = f"{original_username}{counter}"
-        counter += 1
-    
-    return username
+    claims = {
+        'first_name': first_name or user.first_name,
+        'last_name': last_name or user.last_name,
+        'avatar_url': picture or user.avatar_url,
+        'email_verified': user.email_verified or bool(email_verified),
+    }
+    changed = [field for field, value in claims.items() if getattr(user, field) != value]
+    for field in changed:
+        setattr(user, field, claims[field])
+    if changed:
+        changed.append('updated_at')
+    return changed
+
+
+def _username_base(email, name):
+    """
+    Base for a new username: the name in slug form, falling back to the email
+    prefix. Numbering it into a unique username is up to users.usernames.
+    """
+    return username_base(name) or username_base(email.split('@')[0]) or 'user'
 
 
 @api_view(['GET'])
@@ -153,54 +167,353 @@ def current_user_view(request):
     """
     Get current authenticated user information.
     """
-    try:
-        profile = request.user.orbitview_profile
-        has_profile = True
-        profile_username = profile.username
-    except OrbitViewProfile.DoesNotExist:
-        has_profile = False
-        profile_username = None
-    
-    return Response({
-        'user': {
-            'id': str(request.user.id),
-            'email': request.user.email,
-            'first_name': request.user.first_name,
-            'last_name': request.user.last_name,
-            'avatar_url': request.user.avatar_url,
-            'email_verified': request.user.email_verified,
-        },
-        'has_profile': has_profile,
-        'profile_username': profile_username,
-    })
+    return Response(current_user_payload(request.user))
 
-groq_api_key = config("GROQ_API_KEY")
-client = Groq(api_key=groq_api_key)
+CHAT_MODEL = "llama-3.1-8b-instant"
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def stream_groq(request):
 
     user_message = request.data.get("message")
-    print(user_message)
 
-    system_prompt = "You are a very helpful assistant"
+    system_prompt = prompt_registry.render('assistant')
 
     def stream():
-        response = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[
+        tokens = get_gateway().stream_chat_sync(
+            CHAT_MODEL,
+            [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_message},
             ],
-            stream=True,
         )
 
-        for chunk in response:
-            delta = chunk.choices[0].delta
-            content = delta.content if delta.content else None
-            if content:
-                # Flush the token to the client immediately
-                yield content
+        for content in tokens:
+            # Flush the token to the client immediately
+            yield format_event(content)
+
+    return StreamingHttpResponse(stream(), content_type="text/event-stream")
+
+
+async def _chat_profile(request, username):
+    """
+    The profile to chat with, or None when it doesn't exist or the visitor
+    may not see its page: chat answers from the same content.
+    """
+    profile = await OrbitViewProfile.objects.select_related('privacy').only(
+        'id', 'username', 'user_id', 'is_public', 'privacy__visibility', 'privacy__password_protected'
+    ).filter(username=username).afirst()
+    if profile is None:
+        return None
+    user = await request.auser()
+    password = request.headers.get('X-Profile-Password')
+    if not await sync_to_async(can_view)(profile, user, password):
+        return None
+    return profile
+
+
+@csrf_exempt
+@require_POST
+async def profile_chat(request, username):
+    """
+    Stream an AI answer to a visitor's question about a profile.
+    Native async counterpart of stream_groq: served through orbitview_v8.asgi,
+    an in-flight generation only holds a coroutine instead of a worker thread.
+    """
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+
+    user_message = payload.get('message')
+    # Counted, cached and looked up as text further down
+    if not (isinstance(user_message, str) and user_message.strip()):
+        return JsonResponse({'error': 'message is required'}, status=400)
+
+    profile = await _chat_profile(request, username)
+    if profile is None:
+        return JsonResponse({'error': 'Profile not found'}, status=404)
+
+    visitor = analytics.visitor_key(request, visitor_id=payload.get('visitor_id'))
+    conversation_id = payload.get('conversation_id')
+    if conversation_id:
+        try:
+            conversation = await Conversation.objects.only(
+                'id', 'profile_id', 'summary', 'summary_through', 'resolved_personality', 'last_activity',
+                *personality.OVERRIDES
+            ).aget(pk=conversation_id, profile=profile)
+        except (Conversation.DoesNotExist, ValidationError):
+            return JsonResponse({'error': 'Conversation not found'}, status=404)
+        if not await archive.amark_active(conversation.id, conversation.last_activity):
+            return JsonResponse({'error': 'Conversation has been archived'}, status=410)
+    else:
+        conversation = Conversation(profile=profile, visitor_id=payload.get('visitor_id'))
+
+    template = prompt_registry.get('profile_answering')
+    resolved = await personality.aresolve(conversation, await aprofile_version(profile.id), template)
+    if not conversation_id:
+        # Inserted with its personality already resolved
+        await conversation.asave(force_insert=True)
+        await profile_counters.aincr(profile.id, 'total_conversations')
+        await analytics.profile_analytics.arecord(profile.id, 'conversations', visitor)
+    await analytics.profile_analytics.arecord(profile.id, 'questions', visitor)
+    popular_questions.record(profile.id, user_message)
+
+    buffer = ReplayBuffer(conversation.id, owner=str(profile.id))
+
+    # Opening questions don't depend on any history, so their answers are shared
+    cache_namespace = None
+    if not conversation_id:
+        cache_namespace = response_cache.namespace(profile.id, resolved['stamp'][0], resolved['fingerprint'])
+        answer = response_cache.get(cache_namespace, user_message)
+        if answer is not None:
+            await message_writer.aadd_message(conversation.id, 'user', user_message)
+            await message_writer.aadd_message(conversation.id, 'assistant', answer)
+            response = _event_stream_response(
+                EventStream(_cached_answer(answer), buffer=buffer), conversation.id
+            )
+            response['X-Cache'] = 'hit'
+            return response
+
+    gateway = get_gateway()
+    if not gateway.available(CHAT_MODEL):
+        return JsonResponse({'error': 'The assistant is temporarily unavailable'}, status=503)
+
+    system_prompt = template.render({
+        **resolved['values'],
+        'context': await retrieval.abuild_context(profile.id, user_message),
+    })
+
+    messages, overflow = await history.abuild_prompt(
+        conversation, system_prompt, user_message, CHAT_MODEL, resolved['max_tokens']
+    )
+    await message_writer.aadd_message(conversation.id, 'user', user_message)
+
+    tokens = gateway.stream_chat(CHAT_MODEL, messages, max_tokens=resolved['max_tokens'])
+
+    async def answered(answer):
+        await message_writer.aadd_message(conversation.id, 'assistant', answer)
+        if cache_namespace is not None:
+            response_cache.set(cache_namespace, user_message, answer)
+        if overflow:
+            history.schedule_summary(conversation.id)
+
+    tokens = _collect_answer(tokens, answered)
+    response = _event_stream_response(EventStream(tokens, buffer=buffer), conversation.id)
+    response['X-Cache'] = 'miss'
+    return response
+
+
+@require_GET
+async def profile_chat_resume(request, username, conversation_id):
+    """
+    Resume the latest answer of a conversation after a dropped connection.
+    Replays the frames after the Last-Event-ID header (or `last_event_id`
+    query param) and follows the answer if it is still being generated.
+    """
+    record = ReplayBuffer.load(conversation_id)
+    if record is None:
+        return JsonResponse({'error': 'Nothing to resume'}, status=404)
+
+    profile = await _chat_profile(request, username)
+    if profile is None:
+        return JsonResponse({'error': 'Profile not found'}, status=404)
+    if record['owner'] != str(profile.id):
+        return JsonResponse({'error': 'Nothing to resume'}, status=404)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    return _event_stream_response(replay(conversation_id, last_event_id), conversation_id)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def profile_detail(request, username):
+    """
+    Everything the public profile page shows, loaded in a constant number of queries.
+    Public pages are served from the page cache and answer conditional requests
+    with 304; private, unlisted and password protected ones are never cached.
+    """
+    page, profile_id, version = page_cache.lookup(username)
+    if profile_id is None:
+        return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+    if page is not None:
+        if request.user.pk != page['user_id']:
+            profile_counters.incr(profile_id, 'total_views')
+            analytics.profile_analytics.record(profile_id, 'views', analytics.visitor_key(request, request.user))
+        return page_cache.page_response(request, page)
+
+    profile = profile_page_queryset().filter(username=username).first()
+    if profile is not None and profile.pk != profile_id:
+        # The cached page was for a profile that has since given up this username
+        version = profile_version(profile.pk)
+    password = request.headers.get('X-Profile-Password')
+    if profile is None or not can_view(profile, request.user, password):
+        return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+    if request.user.pk != profile.user_id:
+        profile_counters.incr(profile.id, 'total_views')
+        analytics.profile_analytics.record(profile.id, 'views', analytics.visitor_key(request, request.user))
+
+    privacy = getattr(profile, 'privacy', None)
+    if not page_cache.is_cacheable(profile_visibility(profile), privacy):
+        response = Response(serialize_profile_page(profile))
+        response['Cache-Control'] = 'private, no-store'
+        return response
+    body = JSONRenderer().render(serialize_profile_page(profile))
+    page = page_cache.store_page(profile, version, body, timezone.now())
+    return page_cache.page_response(request, page)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def profile_popular_questions(request, username):
+    """
+    Most asked questions of a profile, served from the precomputed top list
+    to visitors who may see its page.
+    """
+    profile = OrbitViewProfile.objects.select_related('privacy').only(
+        'id', 'user_id', 'is_public', 'privacy__visibility', 'privacy__password_protected'
+    ).filter(username=username).first()
+    password = request.headers.get('X-Profile-Password')
+    if profile is None or not can_view(profile, request.user, password):
+        return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'questions': top_questions(profile.id)})
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def profile_search(request):
+    """
+    Public profiles matching `q` and any `skill` / `tech` filters (each may be
+    repeated), best first, with facet counts. Follow `next_cursor` for more.
+    """
+    limit = _page_limit(request, 20)
+    if limit is None:
+        return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+    filters = {facet: request.GET.getlist(facet) for facet in search.FACETS}
+    try:
+        return Response(search.search(
+            request.GET.get('q', ''), filters, cursor=request.GET.get('cursor'), limit=limit
+        ))
+    except search.InvalidCursor:
+        return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def profile_conversations(request, username):
+    """
+    AI conversations of the signed-in user's own profile, newest first, each
+    with a preview of its last message; archived ones are flagged `archived`.
+    Follow `next_cursor` for more.
+    """
+    profile_id = OrbitViewProfile.objects.filter(
+        username=username, user_id=request.user.pk
+    ).values_list('id', flat=True).first()
+    if profile_id is None:
+        return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+    limit = _page_limit(request, 20)
+    if limit is None:
+        return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        page, next_cursor = conversations.list_conversations(
+            profile_id, cursor=request.GET.get('cursor'), limit=limit
+        )
+    except conversations.InvalidCursor:
+        return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'conversations': page, 'next_cursor': next_cursor})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def conversation_messages(request, username, conversation_id):
+    """
+    Messages of one conversation on the signed-in user's own profile, oldest
+    first. Follow `next_cursor` for more.
+    """
+    owner = {'pk': conversation_id, 'profile__username': username, 'profile__user_id': request.user.pk}
+    # Checked first: while being archived a conversation is in both, losing its live messages
+    archived = ArchivedConversation.objects.filter(**owner).select_related('archive').first()
+    if archived is None and not Conversation.objects.filter(**owner).exists():
+        return Response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
+    limit = _page_limit(request, 50)
+    if limit is None:
+        return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        if archived is not None:
+            page, next_cursor = conversations.list_archived_messages(
+                archived, cursor=request.GET.get('cursor'), limit=limit
+            )
+        else:
+            page, next_cursor = conversations.list_messages(
+                conversation_id, cursor=request.GET.get('cursor'), limit=limit
+            )
+    except conversations.InvalidCursor:
+        return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'messages': page, 'next_cursor': next_cursor})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def profile_analytics(request, username):
+    """
+    Views, conversations, questions and unique visitors of the signed-in
+    user's own profile per day over the last `days` days (default 30) and per
+    hour over the last 24 hours, with the most asked questions of the period.
+    """
+    profile_id = OrbitViewProfile.objects.filter(
+        username=username, user_id=request.user.pk
+    ).values_list('id', flat=True).first()
+    if profile_id is None:
+        return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        days = min(max(int(request.GET.get('days', 30)), 1), 366)
+    except ValueError:
+        return Response({'error': 'Invalid days'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(analytics.dashboard(profile_id, days))
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def llm_metrics(request):
+    """
+    Connection pool, concurrency queue and circuit breaker state of the LLM gateway.
+    """
+    return Response(get_gateway().metrics())
+
+
+def _page_limit(request, default):
+    """The `limit` query param clamped to 1..100, or None when it isn't a number."""
+    try:
+        return min(max(int(request.GET.get('limit', default)), 1), 100)
+    except ValueError:
+        return None
+
+
+async def _cached_answer(answer):
+    yield answer
+
+
+async def _collect_answer(tokens, on_complete):
+    """
+    Pass tokens through and hand the full answer to `on_complete` once the
+    stream finishes. An answer whose client dropped is still finished in the
+    background (see sse.EventStream), so it is persisted too; streams that
+    fail or outlive the detached grace window never reach the callback.
+    """
+    parts = []
+    async with aclosing(tokens):
+        async for token in tokens:
+            parts.append(token)
+            yield token
+    await on_complete(''.join(parts))
+
 
-    return StreamingHttpResponse(stream(), content_type="text/event-stream")
\ No newline at end of file
+def _event_stream_response(frames, conversation_id):
+    response = StreamingHttpResponse(frames, content_type="text/event-stream")
+    response['Cache-Control'] = 'no-cache'
+    # Ask nginx-style proxies not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    response['X-Conversation-Id'] = str(conversation_id)
+    return response
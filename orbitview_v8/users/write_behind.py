@@ -0,0 +1,201 @@
+"""
+Write-behind persistence of chat messages.
+
+The chat path hands finished messages and conversation activity to the
+process-wide MessageWriter instead of saving them itself. A background thread
+flushes them with one bulk INSERT and one bulk UPDATE whenever
+MESSAGE_WRITE_BATCH_SIZE rows are waiting or MESSAGE_WRITE_INTERVAL seconds
+have passed, and once more when the process exits. The UPDATE also carries
+each conversation's last-message preview.
+
+Delivery is at-least-once: when the batch fails it is written again one
+conversation per transaction, so a conversation that can't be written (it
+was deleted or archived meanwhile) doesn't hold back the others. Its messages
+go back in the queue and are dropped only after failing `max_attempts`
+flushes in a row. Because message ids are assigned up front, a retry's INSERT
+ignores rows that already made it.
+"""
+import atexit
+import logging
+import threading
+import uuid
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import Conversation, Message
+
+
+logger = logging.getLogger(__name__)
+
+
+PREVIEW_CHARS = 200
+
+
+def message_preview(content):
+    """The start of a message on one line, as stored in Conversation.last_message_preview."""
+    text = ' '.join(content.split())
+    return text if len(text) <= PREVIEW_CHARS else text[:PREVIEW_CHARS - 1] + '\u2026'
+
+
+class MessageWriter:
+    def __init__(self, batch_size=200, interval=1.0, enabled=True, max_attempts=5):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.enabled = enabled
+        self.max_attempts = max_attempts
+        # {conversation id: flushes in a row that failed to write it}
+        self._attempts = {}
+        self._messages = []
+        self._activity = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def add_message(self, conversation_id, role, content, timestamp=None):
+        """Queue a message row; returns its id straight away."""
+        message = Message(
+            id=uuid.uuid4(),
+            conversation_id=conversation_id,
+            role=role,
+            content=content,
+            timestamp=timestamp or timezone.now(),
+        )
+        with self._lock:
+            self._messages.append(message)
+            previous = self._activity.get(conversation_id)
+            if previous is None or previous.timestamp < message.timestamp:
+                self._activity[conversation_id] = message
+            if len(self._messages) >= self.batch_size:
+                self._wakeup.notify()
+        if not self.enabled:
+            self.flush()
+        else:
+            self._ensure_thread()
+        return message.id
+
+    async def aadd_message(self, conversation_id, role, content, timestamp=None):
+        if not self.enabled:
+            return await sync_to_async(self.add_message)(conversation_id, role, content, timestamp)
+        return self.add_message(conversation_id, role, content, timestamp)
+
+    def pending_messages(self, conversation_id):
+        """Queued messages of a conversation, so reads can see their own writes."""
+        with self._lock:
+            return [m for m in self._messages if m.conversation_id == conversation_id]
+
+    def flush(self):
+        """Write everything queued so far. Safe to call from any thread."""
+        with self._flush_lock:
+            with self._lock:
+                messages, self._messages = self._messages, []
+                activity, self._activity = self._activity, {}
+            if not messages and not activity:
+                return 0
+            try:
+                with transaction.atomic():
+                    self._write(messages, activity)
+            except Exception:
+                logger.warning(
+                    'Writing %d chat messages in one batch failed, writing them per conversation',
+                    len(messages), exc_info=True,
+                )
+                return self._write_each(messages, activity)
+            for message in messages:
+                self._attempts.pop(message.conversation_id, None)
+            return len(messages)
+
+    @staticmethod
+    def _write(messages, activity):
+        Message.objects.bulk_create(messages, ignore_conflicts=True)
+        Conversation.objects.bulk_update(
+            [
+                Conversation(
+                    pk=pk,
+                    last_activity=last.timestamp,
+                    last_message_preview=message_preview(last.content),
+                    last_message_role=last.role,
+                )
+                for pk, last in activity.items()
+            ],
+            ['last_activity', 'last_message_preview', 'last_message_role'],
+        )
+
+    def _write_each(self, messages, activity):
+        """Write a failed batch one conversation at a time; returns how many messages made it."""
+        by_conversation = defaultdict(list)
+        for message in messages:
+            by_conversation[message.conversation_id].append(message)
+        written = 0
+        retry, retry_activity = [], {}
+        for pk in by_conversation.keys() | activity.keys():
+            rows = by_conversation.get(pk, [])
+            last = {pk: activity[pk]} if pk in activity else {}
+            try:
+                with transaction.atomic():
+                    self._write(rows, last)
+            except Exception:
+                attempts = self._attempts.get(pk, 0) + 1
+                if attempts >= self.max_attempts:
+                    logger.exception(
+                        'Dropping %d chat messages of conversation %s after repeated failures', len(rows), pk
+                    )
+                    self._attempts.pop(pk, None)
+                    continue
+                logger.exception('Flushing %d chat messages of conversation %s failed, will retry', len(rows), pk)
+                self._attempts[pk] = attempts
+                retry += rows
+                retry_activity.update(last)
+            else:
+                self._attempts.pop(pk, None)
+                written += len(rows)
+        if retry or retry_activity:
+            with self._lock:
+                self._messages[:0] = retry
+                for pk, last in retry_activity.items():
+                    if pk not in self._activity or self._activity[pk].timestamp < last.timestamp:
+                        self._activity[pk] = last
+        return written
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, name='message-writer', daemon=True
+                    )
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if len(self._messages) < self.batch_size and not self._closed:
+                    self._wakeup.wait(self.interval)
+                closed = self._closed
+            close_old_connections()
+            self.flush()
+            close_old_connections()
+            if closed:
+                return
+
+    def close(self):
+        """Stop the background thread after a final flush."""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+
+message_writer = MessageWriter(
+    batch_size=settings.MESSAGE_WRITE_BATCH_SIZE,
+    interval=settings.MESSAGE_WRITE_INTERVAL,
+    enabled=settings.MESSAGE_WRITE_BEHIND,
+)
+atexit.register(message_writer.close)